@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+QuantumultX 配置生成器基准测试
+
+生成指定行数的合成远程配置，由本地HTTP服务器提供下载，逐阶段记录耗时、峰值内存和
+内存块数量变化，结果保存为JSON，可与之前版本的结果对比以发现性能退化。
+
+--startup 另外测量启动开销：模块导入耗时（python -X importtime），以及远程配置未修改时
+在独立进程中完成一次无需更新的运行所需的时间。
+
+用法:
+    python3 benchmark.py --sizes 10000,100000 --output bench.json
+    python3 benchmark.py --sizes 10000,100000 --compare bench_old.json
+    python3 benchmark.py --sizes 10000 --startup
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import http.server
+from datetime import datetime
+from typing import Callable, Dict, List
+
+# 基准测试使用独立的临时目录和环境，不读取当前环境中的个人配置
+WORK_DIR = tempfile.mkdtemp(prefix="qx_benchmark_")
+for _key in [key for key in os.environ if key.startswith("QX_")]:
+    del os.environ[_key]
+os.environ.update({
+    "QX_CONFIG_PATH": os.path.join(WORK_DIR, "QuantumultX.conf"),
+    "QX_REMOTE_BACKUP": os.path.join(WORK_DIR, "qx_remote_backup.conf"),
+    "QX_LOG_FILE": os.path.join(WORK_DIR, "quantumultx_generator.log"),
+    "QX_RESOURCE_CACHE_DIR": os.path.join(WORK_DIR, "resources"),
+    # 每次计时都要完整地解析和合并，不使用生成结果缓存
+    "QX_GENERATION_CACHE_ENTRIES": "0",
+    # filter_local 优化默认关闭，基准测试中开启以测量其开销
+    "QX_FILTER_OPTIMIZE": "true",
+})
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import quantumultx_generator as qx  # noqa: E402
+
+# 默认的配置行数和重复次数
+DEFAULT_SIZES = [10000, 100000]
+DEFAULT_REPEAT = 3
+# 对比时耗时增加超过该比例视为退化
+REGRESSION_THRESHOLD = 0.10
+# 生成器日志级别，--log 时输出全部日志
+LOG_LEVEL = logging.WARNING
+
+# 需要单独计时的合并步骤（在 generate_final_config 内部调用）
+MERGE_HELPERS = [
+    "update_mitm_section",
+    "add_personal_policies_smart",
+    "add_config_items",
+    "optimize_filter_rules",
+    "apply_global_replacements",
+]
+
+
+def random_host(rng: random.Random) -> str:
+    return f"{''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(4, 12)))}.{rng.choice(['com', 'net', 'org', 'cn', 'io'])}"
+
+
+def generate_profile(line_count: int, seed: int = 0) -> str:
+    """生成约 line_count 行的合成远程配置，各section的比例接近真实配置"""
+    rng = random.Random(seed)
+    policy_count = max(line_count // 50, 10)
+    filter_count = max(line_count - policy_count - line_count // 10, 100)
+    resource_count = max(line_count // 30, 10)
+    policy_names = [f"策略{i}" for i in range(policy_count)]
+
+    lines = ["[general]",
+             "server_check_url=http://www.gstatic.com/generate_204",
+             "resource_parser_url=https://example.com/resource-parser.js",
+             "",
+             "[dns]",
+             "server=223.5.5.5",
+             "server=119.29.29.29",
+             "",
+             "[policy]"]
+    for i, name in enumerate(policy_names):
+        members = ", ".join(rng.sample(["proxy", "direct", "reject"] + policy_names[:i], k=min(i + 3, 8)))
+        kind = rng.choice(["static", "static", "available", "round-robin", "url-latency-benchmark"])
+        lines.append(f"{kind}={name}, {members}, img-url=https://example.com/icon/{i}.png")
+    lines.append("")
+
+    for section in ("server_remote", "filter_remote", "rewrite_remote"):
+        lines.append(f"[{section}]")
+        for i in range(resource_count // 3):
+            lines.append(f"https://example.com/{section}/{i}.list, tag={section}{i}, update-interval=86400, "
+                         f"opt-parser=false, enabled=true")
+        lines.append("")
+
+    lines.append("[filter_local]")
+    for i in range(filter_count):
+        choice = rng.random()
+        policy = rng.choice(policy_names)
+        if choice < 0.5:
+            lines.append(f"host-suffix, {random_host(rng)}, {policy}")
+        elif choice < 0.7:
+            lines.append(f"host, {random_host(rng)}, {policy}")
+        elif choice < 0.8:
+            lines.append(f"host-keyword, {random_host(rng).split('.')[0]}, {policy}")
+        else:
+            lines.append(f"ip-cidr, {rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/24, "
+                         f"{policy}, no-resolve")
+    lines.append("final, proxy")
+    lines.append("")
+
+    lines.append("[rewrite_local]")
+    for i in range(line_count // 20):
+        lines.append(f"^https?://{random_host(rng)}/api/{i} url reject-dict")
+    lines.append("")
+
+    hostnames = ", ".join(random_host(rng) for _ in range(min(line_count // 100, 2000)))
+    lines.append("[mitm]")
+    lines.append(f"hostname = {hostnames}")
+    lines.append("passphrase = REMOTE")
+    lines.append(f"p12 = {'A' * 8192}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def personal_overrides(line_count: int) -> Dict:
+    """与配置规模相当的个人配置：策略组、本地分流规则、替换规则和长证书"""
+    rule_count = max(line_count // 20, 10)
+    return {
+        "QX_MITM_PASSPHRASE": "BENCHMARK",
+        "QX_MITM_P12": "M" * 16384,
+        "QX_POLICIES": [f"static=个人策略{i}, proxy, direct" for i in range(max(line_count // 1000, 5))],
+        "QX_DNS": ["server=8.8.8.8"],
+        "QX_FILTER_LOCAL": [f"host-suffix, personal{i}.example.com, proxy" for i in range(rule_count)],
+        "QX_REWRITE_LOCAL": [f"^https?://personal{i}.example.com url reject" for i in range(rule_count // 10)],
+        "QX_REPLACE_1": {"search": "update-interval=86400", "replace": "update-interval=172800"},
+        "QX_REPLACE_2": {"search": "opt-parser=false", "replace": "opt-parser=true", "section": "filter_remote"},
+    }
+
+
+def start_stub_server(content: bytes) -> http.server.ThreadingHTTPServer:
+    """本地HTTP服务器，代替远程配置地址（支持 ETag / If-None-Match）"""
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StageRecorder:
+    """记录各阶段的耗时，memory=True 时同时记录峰值内存和内存块数量变化"""
+
+    def __init__(self, memory: bool = False):
+        self.memory = memory
+        self.stages = {}
+
+    def measure(self, name: str, func: Callable, *args, **kwargs):
+        if self.memory:
+            tracemalloc.reset_peak()
+            base_memory = tracemalloc.get_traced_memory()[0]
+            base_blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        stage = self.stages.setdefault(name, {"wall_ms": 0.0, "calls": 0})
+        stage["wall_ms"] += elapsed * 1000
+        stage["calls"] += 1
+        if self.memory:
+            stage["peak_kib"] = max(stage.get("peak_kib", 0),
+                                    (tracemalloc.get_traced_memory()[1] - base_memory) / 1024)
+            stage["net_blocks"] = stage.get("net_blocks", 0) + sys.getallocatedblocks() - base_blocks
+        return result
+
+    def wrap(self, generator, method_name: str):
+        """替换生成器实例上的方法，使其调用被计时（只记录耗时，避免重置外层阶段的内存峰值）"""
+        method = getattr(generator, method_name)
+        recorder = StageRecorder(memory=False)
+        recorder.stages = self.stages
+
+        def timed(*args, **kwargs):
+            name = method_name
+            if method_name == "add_config_items" and len(args) >= 3:
+                name = f"{method_name}[{args[2]}]"
+            return recorder.measure(name, method, *args, **kwargs)
+
+        setattr(generator, method_name, timed)
+
+
+def run_once(url: str, line_count: int, memory: bool) -> Dict:
+    """按 run() 的顺序执行一次完整生成，返回各阶段的测量结果"""
+    for path in (os.environ["QX_CONFIG_PATH"], os.environ["QX_REMOTE_BACKUP"]):
+        for suffix in ("", ".meta", ".sections.json"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    generator = qx.QuantumultXConfigGenerator(remote_url=url, env_overrides=personal_overrides(line_count))
+    generator.logger.setLevel(LOG_LEVEL)
+    generator.force_update = True
+    recorder = StageRecorder(memory=memory)
+    for helper in MERGE_HELPERS:
+        recorder.wrap(generator, helper)
+
+    generator.personal_config = recorder.measure("load_personal_config", generator.load_personal_config_from_env)
+    content = recorder.measure("fetch", generator.get_remote_config)
+    if content is None:
+        raise RuntimeError(f"无法从本地服务器获取配置: {url}")
+    sections = recorder.measure("parse_config_sections", generator.parse_config_sections, content)
+    final_config = recorder.measure("generate_final_config", generator.generate_final_config, sections)
+    final_index = recorder.measure("index_final_config", qx.ConfigIndex, final_config)
+    if not recorder.measure("validate_mitm_section", generator.validate_mitm_section, final_config, final_index):
+        raise RuntimeError("MITM证书验证失败")
+    recorder.measure("save_config", generator.save_config, final_config)
+
+    return {"stages": recorder.stages, "output_bytes": len(final_config.encode("utf-8"))}
+
+
+def benchmark_size(line_count: int, repeat: int) -> Dict:
+    """对一种配置规模运行多次：计时取中位数和最小值，另外单独运行一次测量内存"""
+    profile = generate_profile(line_count).encode("utf-8")
+    server = start_stub_server(profile)
+    url = f"http://127.0.0.1:{server.server_address[1]}/QuantumultX.conf"
+    try:
+        timings = [run_once(url, line_count, memory=False) for _ in range(repeat)]
+
+        tracemalloc.start()
+        try:
+            memory_run = run_once(url, line_count, memory=True)
+            peak_total = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        server.shutdown()
+
+    stages = {}
+    for name in timings[0]["stages"]:
+        samples = [run["stages"][name]["wall_ms"] for run in timings]
+        stage = {
+            "wall_ms": round(statistics.median(samples), 3),
+            "wall_ms_min": round(min(samples), 3),
+            "calls": timings[0]["stages"][name]["calls"],
+        }
+        memory_stage = memory_run["stages"].get(name, {})
+        if "peak_kib" in memory_stage:
+            stage["peak_kib"] = round(memory_stage["peak_kib"], 1)
+            stage["net_blocks"] = memory_stage["net_blocks"]
+        stages[name] = stage
+
+    # 合并步骤在 generate_final_config 内部，总耗时只统计外层阶段
+    top_level = [name for name in stages if name.split("[")[0] not in MERGE_HELPERS]
+    return {
+        "lines": line_count,
+        "input_bytes": len(profile),
+        "output_bytes": timings[0]["output_bytes"],
+        "total_ms": round(sum(stages[name]["wall_ms"] for name in top_level), 3),
+        "peak_kib": round(peak_total / 1024, 1),
+        "stages": stages,
+    }
+
+
+# 在子进程中运行一次生成器，输出运行结果和是否导入了requests
+STARTUP_SCRIPT = """
+import json, sys
+import quantumultx_generator as qx
+generator = qx.QuantumultXConfigGenerator()
+ok = generator.run()
+print(json.dumps({"ok": ok, "result": generator.metrics.result, "requests": "requests" in sys.modules}))
+"""
+
+
+def measure_import_ms() -> float:
+    """python -X importtime 统计的模块导入耗时（包含依赖，毫秒）"""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import quantumultx_generator"],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               capture_output=True, text=True, check=True)
+    for line in completed.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == "quantumultx_generator":
+            return int(fields[1]) / 1000
+    raise RuntimeError("importtime 输出中没有找到 quantumultx_generator")
+
+
+def benchmark_startup(line_count: int, repeat: int) -> Dict:
+    """启动开销：模块导入耗时，以及远程配置返回304时一次完整进程运行的耗时"""
+    profile = generate_profile(line_count).encode("utf-8")
+    server = start_stub_server(profile)
+    env = dict(os.environ)
+    env["QX_REMOTE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/QuantumultX.conf"
+    for key, value in personal_overrides(line_count).items():
+        env[key] = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    for path in (env["QX_CONFIG_PATH"], env["QX_REMOTE_BACKUP"]):
+        for suffix in ("", ".meta", ".sections.json"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def run_process() -> Dict:
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], env=env,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   capture_output=True, text=True, check=True)
+        # 通知在后台线程中输出，可能出现在结果之后，取最后一个JSON行
+        result = json.loads([line for line in completed.stdout.splitlines() if line.startswith("{")][-1])
+        result["wall_ms"] = (time.perf_counter() - start) * 1000
+        return result
+
+    try:
+        # 第一次运行生成配置和状态记录，之后的运行都应该走无需更新的路径
+        first = run_process()
+        if not first["ok"]:
+            raise RuntimeError("生成初始配置失败")
+        runs = [run_process() for _ in range(repeat)]
+    finally:
+        server.shutdown()
+
+    samples = [run["wall_ms"] for run in runs]
+    return {
+        "lines": line_count,
+        "import_ms": round(statistics.median(measure_import_ms() for _ in range(repeat)), 3),
+        "first_run_ms": round(first["wall_ms"], 3),
+        "noop_run_ms": round(statistics.median(samples), 3),
+        "noop_run_ms_min": round(min(samples), 3),
+        "noop_result": runs[-1]["result"],
+        "noop_imports_requests": any(run["requests"] for run in runs),
+    }
+
+
+def print_startup(startup: Dict):
+    print(f"\n启动开销 ({startup['lines']} 行): 模块导入 {startup['import_ms']:.1f}ms, "
+          f"首次运行 {startup['first_run_ms']:.1f}ms, 无需更新的运行 {startup['noop_run_ms']:.1f}ms "
+          f"(最小 {startup['noop_run_ms_min']:.1f}ms, 结果 {startup['noop_result']}, "
+          f"{'导入了' if startup['noop_imports_requests'] else '未导入'}requests)")
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """对比两次基准测试结果，返回耗时增加超过阈值的阶段"""
+    regressions = []
+    baseline_by_lines = {result["lines"]: result for result in baseline.get("results", [])}
+    print(f"\n对比基准: v{baseline.get('version', '?')} ({baseline.get('timestamp', '?')})")
+    for result in current["results"]:
+        old = baseline_by_lines.get(result["lines"])
+        if not old:
+            continue
+        print(f"\n{result['lines']} 行:")
+        rows = [("total", result["total_ms"], old["total_ms"])]
+        rows += [(name, stage["wall_ms"], old["stages"][name]["wall_ms"])
+                 for name, stage in result["stages"].items() if name in old["stages"]]
+        for name, new_ms, old_ms in rows:
+            ratio = new_ms / old_ms if old_ms else 1.0
+            flag = ""
+            if ratio > 1 + threshold and new_ms - old_ms > 1:
+                flag = "  ⚠️ 退化"
+                regressions.append(f"{result['lines']}行 {name}: {old_ms:.1f}ms -> {new_ms:.1f}ms")
+            print(f"  {name:<40} {old_ms:>10.1f}ms -> {new_ms:>10.1f}ms  x{ratio:.2f}{flag}")
+
+    if current.get("startup") and baseline.get("startup"):
+        print("\n启动开销:")
+        for name in ("import_ms", "noop_run_ms"):
+            new_ms = current["startup"][name]
+            old_ms = baseline["startup"][name]
+            ratio = new_ms / old_ms if old_ms else 1.0
+            flag = ""
+            if ratio > 1 + threshold and new_ms - old_ms > 1:
+                flag = "  ⚠️ 退化"
+                regressions.append(f"启动 {name}: {old_ms:.1f}ms -> {new_ms:.1f}ms")
+            print(f"  {name:<40} {old_ms:>10.1f}ms -> {new_ms:>10.1f}ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def print_result(result: Dict):
+    print(f"\n{result['lines']} 行 ({result['input_bytes']} 字节 -> {result['output_bytes']} 字节), "
+          f"总耗时 {result['total_ms']:.1f}ms, 峰值内存 {result['peak_kib']:.0f}KiB")
+    for name, stage in result["stages"].items():
+        memory = ""
+        if "peak_kib" in stage:
+            memory = f"  峰值 {stage['peak_kib']:>10.1f}KiB  内存块 {stage['net_blocks']:+d}"
+        print(f"  {name:<40} {stage['wall_ms']:>10.1f}ms (最小 {stage['wall_ms_min']:.1f}ms, "
+              f"{stage['calls']}次){memory}")
+
+
+def main():
+    global LOG_LEVEL
+    sizes = DEFAULT_SIZES
+    repeat = DEFAULT_REPEAT
+    output = ""
+    compare = ""
+    startup = False
+
+    args = sys.argv[1:]
+    while args:
+        arg = args.pop(0)
+        if arg == "--sizes" and args:
+            sizes = [int(size) for size in args.pop(0).split(",") if size]
+        elif arg == "--repeat" and args:
+            repeat = max(int(args.pop(0)), 1)
+        elif arg == "--output" and args:
+            output = args.pop(0)
+        elif arg == "--compare" and args:
+            compare = args.pop(0)
+        elif arg == "--startup":
+            startup = True
+        elif arg == "--log":
+            LOG_LEVEL = logging.INFO
+        elif arg in ["-h", "--help"]:
+            print(__doc__)
+            print("参数:")
+            print("  --sizes N,N,...  合成配置的行数（默认 10000,100000）")
+            print("  --repeat N       每种规模的计时次数，取中位数（默认 3）")
+            print("  --output PATH    保存JSON结果")
+            print("  --compare PATH   与之前保存的JSON结果对比，有退化时返回非零状态码")
+            print("  --startup        测量模块导入和无需更新时整个进程运行的耗时（使用第一个规模）")
+            print("  --log            输出生成器日志（默认只输出警告）")
+            return
+        else:
+            print(f"未知参数: {arg}")
+            sys.exit(2)
+
+    report = {
+        "version": qx.GENERATOR_VERSION,
+        "python": sys.version.split()[0],
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "repeat": repeat,
+        "results": [],
+    }
+    try:
+        for line_count in sizes:
+            result = benchmark_size(line_count, repeat)
+            report["results"].append(result)
+            print_result(result)
+        if startup:
+            report["startup"] = benchmark_startup(sizes[0], repeat)
+            print_startup(report["startup"])
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {output}")
+
+    if compare:
+        with open(compare, "r", encoding="utf-8") as f:
+            regressions = compare_results(report, json.load(f))
+        if regressions:
+            print("\n发现性能退化:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,31 @@
 import os
-import requests
 import re
 import json
 import sys
+import atexit
+import queue
+import time
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
 import hashlib
 
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不记录内存峰值
+    resource = None
+
+# requests、http.server、gzip 以及 email.utils、concurrent.futures、tempfile、ipaddress、bisect、
+# random、signal 在用到时才导入：导入requests需要几十毫秒，其余的合计也有十几毫秒，
+# 而大多数定时运行只需要一次条件请求就能确定无需更新
+if TYPE_CHECKING:
+    import http.server
+    from concurrent.futures import Future
+    import requests
+
 # 基础路径配置（可通过环境变量覆盖）
 LOCAL_CONFIG_PATH = os.getenv("QX_CONFIG_PATH", "/ql/data/config/QuantumultX.conf")
 LOG_FILE = os.getenv("QX_LOG_FILE", "/ql/data/log/quantumultx_generator.log")
@@ -15,27 +34,2222 @@ REMOTE_CONFIG_BACKUP = os.getenv("QX_REMOTE_BACKUP", "/ql/data/config/qx_remote_
 # 远程配置地址
 REMOTE_CONFIG_URL = os.getenv("QX_REMOTE_URL", "https://ddgksf2013.top/Profile/QuantumultX.conf")
 
+# 远程配置的镜像地址（逗号分隔，按顺序作为 QX_REMOTE_URL 的备用地址），
+# 对冲请求的等待时间：前一个地址在该毫秒数内没有响应时同时请求下一个地址
+REMOTE_MIRRORS = [url.strip() for url in os.getenv("QX_REMOTE_MIRRORS", "").split(',') if url.strip()]
+HEDGE_DELAY_MS = float(os.getenv("QX_HEDGE_DELAY_MS", "2000"))
+# stale-while-revalidate：远程配置在该秒数内未获取完成或获取失败时，使用已有备份生成配置，
+# 后台继续获取并更新备份供下次运行使用；0表示不启用
+STALE_WHILE_REVALIDATE = float(os.getenv("QX_STALE_WHILE_REVALIDATE", "0"))
+
+# 远程配置的最大字节数，下载时超过即中止
+MAX_REMOTE_BYTES = int(os.getenv("QX_MAX_REMOTE_BYTES", str(32 * 1024 * 1024)))
+
+# 网络请求配置：单个请求超时、并发数、每个主机的连接数上限、整批请求的总超时
+FETCH_TIMEOUT = float(os.getenv("QX_FETCH_TIMEOUT", "30"))
+FETCH_WORKERS = int(os.getenv("QX_FETCH_WORKERS", "4"))
+FETCH_PER_HOST = int(os.getenv("QX_FETCH_PER_HOST", "2"))
+FETCH_BATCH_TIMEOUT = float(os.getenv("QX_FETCH_BATCH_TIMEOUT", "120"))
+
+# 远程资源缓存模式（filter_remote / rewrite_remote 引用的资源）
+# 留空: 不处理；mirror: 改写为本地镜像地址；inline: filter_remote 内联到 filter_local
+RESOURCE_MODE = os.getenv("QX_RESOURCE_MODE", "").strip().lower()
+RESOURCE_CACHE_DIR = os.getenv("QX_RESOURCE_CACHE_DIR", "/ql/data/config/qx_resources")
+RESOURCE_MIRROR_URL = os.getenv("QX_RESOURCE_MIRROR_URL", "").rstrip('/')
+RESOURCE_RETENTION_DAYS = float(os.getenv("QX_RESOURCE_RETENTION_DAYS", "7"))
+
+# 节点订阅预处理：mirror 输出筛选后的节点列表（QX_RESOURCE_MIRROR_URL/nodes/<哈希>.txt），
+# inline 把节点直接写入 [server_local]；为空时 server_remote 原样保留
+SERVER_PIPELINE = os.getenv("QX_SERVER_PIPELINE", "").strip().lower()
+
+# 节点延迟探测：sort 按TCP连接延迟重排策略组中的节点，prune 另外移除不可达的节点；为空时不探测
+LATENCY_PROBE = os.getenv("QX_LATENCY_PROBE", "").strip().lower()
+PROBE_GROUP_TYPES = [t.strip().lower() for t in os.getenv("QX_PROBE_GROUPS", "available,url-latency-benchmark").split(',')
+                     if t.strip()]
+PROBE_CONCURRENCY = int(os.getenv("QX_PROBE_CONCURRENCY", "50"))
+PROBE_TIMEOUT = float(os.getenv("QX_PROBE_TIMEOUT", "2"))
+PROBE_TOTAL_TIMEOUT = float(os.getenv("QX_PROBE_TOTAL_TIMEOUT", "20"))
+PROBE_TTL = float(os.getenv("QX_PROBE_TTL", "900"))
+PROBE_BUCKET_MS = float(os.getenv("QX_PROBE_BUCKET_MS", "200"))
+# 延迟区间的滞后比例：延迟超出上次生成时所在区间的边界不到该比例的区间宽度时仍算作原区间，
+# 避免延迟在区间边界附近波动时反复重新生成配置
+PROBE_HYSTERESIS = float(os.getenv("QX_PROBE_HYSTERESIS", "0.5"))
+PROBE_MAX_LATENCY_MS = float(os.getenv("QX_PROBE_MAX_LATENCY_MS", "0"))
+
+# 是否优化 filter_local 规则（去除重复和被覆盖的规则、合并相邻IP段），会改写远程配置中的规则，默认关闭
+FILTER_OPTIMIZE = os.getenv("QX_FILTER_OPTIMIZE", "false").strip().lower() in ("true", "1", "yes")
+
+# 是否缓存各section的合并结果，远程配置只有部分section变化时只重新合并变化的section
+SECTION_CACHE = os.getenv("QX_SECTION_CACHE", "true").strip().lower() not in ("false", "0", "no")
+
+# 生成结果缓存：按（远程配置哈希，个人配置哈希等输入）保存生成的配置，相同输入再次生成时跳过解析和合并
+GENERATION_CACHE_DIR = os.getenv("QX_GENERATION_CACHE_DIR", "/ql/data/config/qx_generations")
+GENERATION_CACHE_ENTRIES = int(os.getenv("QX_GENERATION_CACHE_ENTRIES", "16"))
+GENERATION_CACHE_MAX_MB = float(os.getenv("QX_GENERATION_CACHE_MAX_MB", "64"))
+
+# 最终配置的预压缩副本（供静态文件服务器直接使用），可选 gzip、br，逗号分隔
+OUTPUT_COMPRESS = [fmt.strip().lower() for fmt in os.getenv("QX_OUTPUT_COMPRESS", "").split(',') if fmt.strip()]
+
+# 守护模式：正常运行间隔、随机抖动比例、失败重试的初始间隔和最大间隔（秒）
+DAEMON_INTERVAL = float(os.getenv("QX_DAEMON_INTERVAL", "300"))
+DAEMON_JITTER = float(os.getenv("QX_DAEMON_JITTER", "0.1"))
+DAEMON_RETRY = float(os.getenv("QX_DAEMON_RETRY", "60"))
+DAEMON_MAX_BACKOFF = float(os.getenv("QX_DAEMON_MAX_BACKOFF", "3600"))
+
+# 日志：单个日志文件的最大字节数和保留的轮转文件数，
+# QX_LOG_VERBOSITY=detail 时逐项输出添加的配置项，默认只输出各section的汇总计数
+LOG_MAX_BYTES = int(os.getenv("QX_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("QX_LOG_BACKUP_COUNT", "3"))
+LOG_ITEMS = os.getenv("QX_LOG_VERBOSITY", "summary").lower() == "detail"
+
+# 通知：后台发送队列长度，退出前等待通知发送完成的最长时间（秒）
+NOTIFY_QUEUE_SIZE = int(os.getenv("QX_NOTIFY_QUEUE_SIZE", "20"))
+NOTIFY_TIMEOUT = float(os.getenv("QX_NOTIFY_TIMEOUT", "30"))
+
+# 订阅服务器：监听地址和端口（端口为0时不启用，--serve 默认使用8080），单配置模式的访问令牌
+SERVE_HOST = os.getenv("QX_SERVE_HOST", "127.0.0.1")
+SERVE_PORT = int(os.getenv("QX_SERVE_PORT", "0"))
+SERVE_TOKEN = os.getenv("QX_SERVE_TOKEN", "")
+
+# 运行报告：是否在远程配置备份旁保存JSON运行报告，Prometheus textfile 输出目录（留空不输出）
+RUN_REPORT = os.getenv("QX_RUN_REPORT", "true").strip().lower() not in ("false", "0", "no")
+METRICS_TEXTFILE_DIR = os.getenv("QX_METRICS_TEXTFILE_DIR", "")
+
+# 批量模式清单文件（可通过 --batch 参数覆盖）
+BATCH_MANIFEST = os.getenv("QX_BATCH_MANIFEST", "")
+
 # 环境变量前缀
 ENV_VAR_PREFIX = "QX_"
 
+# 请求远程配置和资源时使用的请求头
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/plain, */*'
+}
+
+# 生成器版本（生成逻辑变化时更新，用于判断是否需要重新生成配置）
+GENERATOR_VERSION = "1.2.0"
+
+
+class AtomicFile:
+    """分块原子写入文件：写入同目录的临时文件，commit() 时fsync并重命名覆盖目标文件
+
+    并发读取的进程（例如提供配置下载的Web服务器）只会看到完整的旧文件或新文件；
+    discard() 删除临时文件，目标文件保持不变。进程退出时仍未提交的临时文件
+    （例如被放弃的后台下载）会被删除。
+    """
+
+    # 尚未提交或删除的临时文件
+    pending = set()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.directory = os.path.dirname(path) or '.'
+        os.makedirs(self.directory, exist_ok=True)
+        import tempfile
+        fd, self.tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp",
+                                             dir=self.directory)
+        self.file = os.fdopen(fd, 'wb')
+        self.size = 0
+        AtomicFile.pending.add(self)
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.size += len(data)
+
+    def commit(self):
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            # mkstemp创建的文件权限为0600，保持原文件权限或使用常规权限
+            if os.path.exists(self.path):
+                os.chmod(self.tmp_path, os.stat(self.path).st_mode & 0o7777)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(self.tmp_path, 0o666 & ~umask)
+            os.replace(self.tmp_path, self.path)
+        except BaseException:
+            self.discard()
+            raise
+        AtomicFile.pending.discard(self)
+
+        # 同步目录项，确保重命名在断电后仍然有效（部分平台不支持）
+        try:
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+
+    def discard(self):
+        AtomicFile.pending.discard(self)
+        if not self.file.closed:
+            self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def discard_pending(cls):
+        for staged in list(cls.pending):
+            staged.discard()
+
+
+atexit.register(AtomicFile.discard_pending)
+
+
+def write_file_atomic(path: str, data: bytes):
+    """原子写入文件：先写入同目录的临时文件并fsync，再重命名覆盖目标文件"""
+    staged = AtomicFile(path)
+    try:
+        staged.write(data)
+    except BaseException:
+        staged.discard()
+        raise
+    staged.commit()
+
+
+def create_http_session(pool_size: int = FETCH_PER_HOST) -> "requests.Session":
+    """创建共享的HTTP会话（keep-alive复用连接，每个主机的连接池大小受限）"""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max(FETCH_WORKERS, 1),
+                                            pool_maxsize=max(pool_size, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def run_in_daemon_thread(func: Callable, *args, gate: Optional[threading.Semaphore] = None,
+                         name: str = "qx-worker") -> "Future":
+    """在守护线程中执行 func，返回Future
+
+    与 ThreadPoolExecutor 不同，进程退出时不会等待仍在进行的请求。
+    gate 用于限制同时执行的任务数，取得之前被取消的任务不会执行。
+    """
+    from concurrent.futures import Future
+
+    future = Future()
+
+    def target():
+        if gate is not None:
+            gate.acquire()
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        finally:
+            if gate is not None:
+                gate.release()
+
+    threading.Thread(target=target, name=name, daemon=True).start()
+    return future
+
+
+def run_concurrent_fetches(tasks: Dict[str, Callable], max_workers: int = FETCH_WORKERS,
+                           per_host: int = FETCH_PER_HOST,
+                           batch_timeout: float = FETCH_BATCH_TIMEOUT) -> Iterator[Tuple[str, object]]:
+    """并发执行以URL为键的获取任务，按完成顺序返回 (url, 结果或异常)
+
+    同一主机同时进行的请求数不超过 per_host，整批请求超过 batch_timeout 秒后
+    未完成的任务以 TimeoutError 返回。任务在守护线程中执行：尚未开始的任务被取消，
+    已经开始的任务继续运行但结果被丢弃，调用方需要保证迟到的任务不修改共享状态。
+    """
+    from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
+
+    if not tasks:
+        return
+
+    host_limits = {}
+    for url in tasks:
+        host = urlparse(url).netloc
+        if host not in host_limits:
+            host_limits[host] = threading.BoundedSemaphore(max(per_host, 1))
+
+    def limited(url: str, func: Callable):
+        with host_limits[urlparse(url).netloc]:
+            return func()
+
+    gate = threading.BoundedSemaphore(max(min(max_workers, len(tasks)), 1))
+    futures = {run_in_daemon_thread(limited, url, func, gate=gate, name="qx-fetch"): url
+               for url, func in tasks.items()}
+    pending = set(futures.values())
+    try:
+        for future in as_completed(futures, timeout=batch_timeout):
+            url = futures[future]
+            pending.discard(url)
+            try:
+                yield url, future.result()
+            except Exception as e:
+                yield url, e
+    except FuturesTimeoutError:
+        for url in pending:
+            yield url, TimeoutError(f"整批请求超过 {batch_timeout} 秒未完成")
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def conditional_request(url: str, headers: Dict, timeout: float = FETCH_TIMEOUT) -> int:
+    """使用标准库 http.client 发送一次GET请求并返回状态码，不读取正文
+
+    用于无需更新时的快速路径，避免导入requests；不支持代理。
+    """
+    import http.client
+
+    parsed = urlparse(url)
+    if parsed.scheme == "https":
+        connection = http.client.HTTPSConnection(parsed.netloc, timeout=timeout)
+    else:
+        connection = http.client.HTTPConnection(parsed.netloc, timeout=timeout)
+    path = (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+    try:
+        connection.request("GET", path, headers=headers)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def release_response(response: "requests.Response", drain_limit: int = 64 * 1024):
+    """关闭流式响应；304或正文较短（声明了Content-Length）时先读完正文，使连接回到连接池复用
+
+    未读完正文直接关闭会断开底层连接，下一次请求需要重新建立TCP/TLS连接。
+    """
+    length = response.headers.get("Content-Length")
+    if response.status_code == 304 or (length is not None and length.isdigit() and int(length) <= drain_limit):
+        try:
+            response.content
+        except Exception:
+            pass
+    response.close()
+
+
+def hedged_get(session: "requests.Session", candidates: List[Tuple[str, Dict]],
+               hedge_delay: float = HEDGE_DELAY_MS / 1000,
+               timeout: float = FETCH_TIMEOUT) -> Tuple[Optional[str], Optional["requests.Response"], Dict, Dict]:
+    """对冲请求：按顺序请求 (URL, 请求头) 列表，前一个地址 hedge_delay 秒内没有响应或请求失败时
+    再请求下一个地址，返回第一个成功的 (URL, 响应)，以及各地址的响应延迟（毫秒）和错误。
+
+    响应以流式方式打开，只有被采用的响应会读取正文，其余响应直接关闭（见 release_response）。
+    各请求在守护线程中执行，采用的响应返回后进程退出时不会等待落选的请求。
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+    import requests
+
+    latencies = {}
+    errors = {}
+    if not candidates:
+        return None, None, latencies, errors
+
+    def attempt(url: str, headers: Dict):
+        start = time.perf_counter()
+        response = session.get(url, headers=headers, timeout=timeout, stream=True)
+        latency = (time.perf_counter() - start) * 1000
+        if response.status_code != 304 and response.status_code >= 400:
+            release_response(response)
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+        return response, latency
+
+    def close_late(future):
+        if not future.cancelled() and future.exception() is None:
+            release_response(future.result()[0])
+
+    remaining = list(candidates)
+    futures = {}
+    winner_url = winner = None
+    try:
+        while winner is None and (remaining or futures):
+            if remaining:
+                url, headers = remaining.pop(0)
+                futures[run_in_daemon_thread(attempt, url, headers, name="qx-hedge")] = url
+            done, _ = wait(futures, timeout=hedge_delay if remaining else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = futures.pop(future)
+                try:
+                    response, latency = future.result()
+                except Exception as e:
+                    errors[url] = e
+                    continue
+                latencies[url] = latency
+                if winner is None:
+                    winner_url, winner = url, response
+                else:
+                    release_response(response)
+    finally:
+        # 落选的请求完成后直接关闭连接，不等待
+        for future in futures:
+            future.add_done_callback(close_late)
+
+    return winner_url, winner, latencies, errors
+
+
+class RunMetrics:
+    """单次运行的指标：各阶段耗时、计数器和进程内存峰值
+
+    stage() 记录阶段的墙钟时间以及阶段结束时进程的内存峰值（ru_maxrss），
+    count() 累加计数器（添加的配置项、跳过的重复项、替换次数、下载字节数等）。
+    结果可导出为JSON运行报告和 Prometheus textfile 格式。
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.result = ""
+        self.duration_ms = 0.0
+
+    @staticmethod
+    def max_rss_kib() -> Optional[float]:
+        """进程启动以来的内存峰值（KiB），不支持的平台返回None"""
+        if resource is None:
+            return None
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS以字节为单位，Linux以KiB为单位
+        return rss / 1024 if sys.platform == "darwin" else float(rss)
+
+    @contextmanager
+    def stage(self, name: str):
+        """记录一个阶段的耗时，同名阶段多次执行时累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, (time.perf_counter() - start) * 1000)
+
+    def add_stage(self, name: str, wall_ms: float, calls: int = 1):
+        """累加一个阶段的耗时（用于在其他线程中计时的阶段）"""
+        entry = self.stages.setdefault(name, {"wall_ms": 0.0, "calls": 0})
+        entry["wall_ms"] += wall_ms
+        entry["calls"] += calls
+        rss = self.max_rss_kib()
+        if rss is not None:
+            entry["max_rss_kib"] = rss
+
+    def merge(self, other: "RunMetrics"):
+        """并入另一组指标（批量模式下预先获取远程配置时记录的阶段和计数器）"""
+        for name, stage in other.stages.items():
+            self.add_stage(name, stage["wall_ms"], stage["calls"])
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def count(self, name: str, value: int = 1):
+        """累加计数器"""
+        if value:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, result: str):
+        """记录运行结果和总耗时"""
+        self.result = result
+        self.duration_ms = (time.perf_counter() - self.start_time) * 1000
+
+    def to_dict(self, **info) -> Dict:
+        """机器可读的运行报告"""
+        report = dict(info)
+        report.update({
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "result": self.result,
+            "duration_ms": round(self.duration_ms, 3),
+            "max_rss_kib": self.max_rss_kib(),
+            "stages": {name: dict(stage, wall_ms=round(stage["wall_ms"], 3))
+                       for name, stage in self.stages.items()},
+            "counters": dict(self.counters),
+        })
+        return report
+
+    def to_prometheus(self, labels: Dict[str, str]) -> str:
+        """Prometheus textfile 格式（node_exporter textfile collector）"""
+
+        def escape(value) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def format_labels(extra: Dict[str, str]) -> str:
+            items = dict(labels, **extra)
+            return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in items.items()) + "}"
+
+        lines = [
+            "# HELP qx_generator_last_run_timestamp_seconds 上次运行的开始时间",
+            "# TYPE qx_generator_last_run_timestamp_seconds gauge",
+            f"qx_generator_last_run_timestamp_seconds{format_labels({})} {self.started_at.timestamp():.3f}",
+            "# HELP qx_generator_success 上次运行是否成功",
+            "# TYPE qx_generator_success gauge",
+            f"qx_generator_success{format_labels({})} {0 if self.result == 'failed' else 1}",
+            "# HELP qx_generator_duration_seconds 上次运行的总耗时",
+            "# TYPE qx_generator_duration_seconds gauge",
+            f"qx_generator_duration_seconds{format_labels({})} {self.duration_ms / 1000:.6f}",
+            "# HELP qx_generator_stage_seconds 上次运行各阶段的耗时",
+            "# TYPE qx_generator_stage_seconds gauge",
+        ]
+        for name, stage in self.stages.items():
+            lines.append(f"qx_generator_stage_seconds{format_labels({'stage': name})} {stage['wall_ms'] / 1000:.6f}")
+        lines += [
+            "# HELP qx_generator_count 上次运行的计数器",
+            "# TYPE qx_generator_count gauge",
+        ]
+        for name, value in self.counters.items():
+            lines.append(f"qx_generator_count{format_labels({'counter': name})} {value}")
+        rss = self.max_rss_kib()
+        if rss is not None:
+            lines += [
+                "# HELP qx_generator_max_rss_bytes 进程内存峰值",
+                "# TYPE qx_generator_max_rss_bytes gauge",
+                f"qx_generator_max_rss_bytes{format_labels({})} {int(rss * 1024)}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+class RemoteResourceCache:
+    """filter_remote / rewrite_remote 引用资源的本地缓存
+
+    资源内容按MD5哈希存放在 objects 目录（内容寻址），index.json 记录每个URL
+    当前内容的哈希和 ETag / Last-Modified，用于条件请求重新验证。
+    同一进程内每个URL只验证一次，批量模式下各配置档案共享同一个缓存。
+    """
+
+    def __init__(self, cache_dir: str, session: "requests.Session", logger):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.session = session
+        self.logger = logger
+        self.index = self.load_index()
+        # 本进程内已验证的URL -> 内容哈希
+        self.refreshed = {}
+        # 实际下载的资源字节数（不含304）
+        self.bytes_fetched = 0
+
+    def load_index(self) -> Dict:
+        """加载资源索引"""
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if isinstance(index, dict):
+                    return index
+        except Exception as e:
+            self.logger.warning(f"加载资源缓存索引失败: {str(e)}")
+        return {}
+
+    def save_index(self):
+        """保存资源索引"""
+        try:
+            write_file_atomic(self.index_file, json.dumps(self.index, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            self.logger.warning(f"保存资源缓存索引失败: {str(e)}")
+
+    def object_path(self, content_hash: str) -> str:
+        """资源内容的存放路径"""
+        return os.path.join(self.objects_dir, f"{content_hash}.txt")
+
+    def mirror_url(self, content_hash: str) -> str:
+        """资源的本地镜像地址"""
+        return f"{RESOURCE_MIRROR_URL}/objects/{content_hash}.txt"
+
+    def read_text(self, content_hash: str) -> str:
+        """读取缓存的资源内容"""
+        with open(self.object_path(content_hash), 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+
+    def fetch_resource(self, url: str) -> Dict:
+        """获取单个资源，已缓存时发送条件请求，返回新的索引记录"""
+        cached = self.index.get(url, {})
+        headers = dict(REQUEST_HEADERS)
+        if cached.get("hash") and os.path.exists(self.object_path(cached["hash"])):
+            if cached.get("etag"):
+                headers['If-None-Match'] = cached["etag"]
+            if cached.get("last_modified"):
+                headers['If-Modified-Since'] = cached["last_modified"]
+
+        response = self.session.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+        if response.status_code == 304:
+            return cached
+        response.raise_for_status()
+
+        body = response.content
+        if not body.strip():
+            raise ValueError("资源内容为空")
+
+        content_hash = hashlib.md5(body).hexdigest()
+        path = self.object_path(content_hash)
+        if not os.path.exists(path):
+            write_file_atomic(path, body)
+
+        return {
+            "hash": content_hash,
+            "size": len(body),
+            "etag": response.headers.get('ETag', ''),
+            "last_modified": response.headers.get('Last-Modified', ''),
+        }
+
+    def refresh(self, urls: List[str]) -> Dict[str, str]:
+        """并发验证一组资源，返回 URL -> 内容哈希（获取失败时使用旧缓存）"""
+        pending = [url for url in dict.fromkeys(urls) if url not in self.refreshed]
+        if pending:
+            self.logger.info(f"开始并发验证 {len(pending)} 个远程资源")
+            tasks = {url: (lambda url=url: self.fetch_resource(url)) for url in pending}
+            updated_count = 0
+            for url, result in run_concurrent_fetches(tasks):
+                if isinstance(result, Exception):
+                    cached = self.index.get(url, {})
+                    if cached.get("hash") and os.path.exists(self.object_path(cached["hash"])):
+                        self.logger.warning(f"获取资源失败，使用旧缓存: {url}: {str(result)}")
+                        self.refreshed[url] = cached["hash"]
+                    else:
+                        self.logger.warning(f"获取资源失败，保留原地址: {url}: {str(result)}")
+                    continue
+
+                if result is not self.index.get(url):
+                    # 304时返回的是原索引记录，其余情况为新下载的内容
+                    self.bytes_fetched += result.get("size", 0)
+                if result.get("hash") != self.index.get(url, {}).get("hash"):
+                    updated_count += 1
+                self.index[url] = result
+                self.refreshed[url] = result["hash"]
+
+            self.logger.info(f"远程资源验证完成，{updated_count} 个有更新")
+            self.save_index()
+            self.prune()
+
+        return {url: self.refreshed[url] for url in urls if url in self.refreshed}
+
+    def prune(self):
+        """清理索引不再引用且超过保留期的资源文件"""
+        if not os.path.isdir(self.objects_dir):
+            return
+        referenced = {f"{entry.get('hash')}.txt" for entry in self.index.values()}
+        expire_before = datetime.now().timestamp() - RESOURCE_RETENTION_DAYS * 86400
+        for name in os.listdir(self.objects_dir):
+            path = os.path.join(self.objects_dir, name)
+            try:
+                if name not in referenced and os.path.getmtime(path) < expire_before:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class ServerNode:
+    """订阅中的一个节点：类型、地址、端口、名称和其余参数（不含tag）"""
+
+    __slots__ = ("type", "host", "port", "tag", "params")
+
+    def __init__(self, node_type: str, host: str, port: str, tag: str, params: str):
+        self.type = node_type
+        self.host = host
+        self.port = port
+        self.tag = tag
+        self.params = params
+
+    @property
+    def endpoint(self) -> Tuple[str, str, str]:
+        """用于去重的节点地址"""
+        return self.type, self.host.strip('[]').lower(), self.port
+
+    def to_line(self) -> str:
+        return f"{self.params}, tag={self.tag}"
+
+
+class ServerNodePipeline:
+    """server_remote 节点订阅的预处理
+
+    订阅内容由 RemoteResourceCache 并发获取和缓存，这里解析为节点记录，
+    按 QX_SERVER_FILTER / QX_SERVER_EXCLUDE 筛选节点名称，按 QX_SERVER_RENAME 重命名，
+    并按地址去重。处理结果按内容哈希保存在缓存目录的 nodes 下，index.json 记录
+    (订阅内容哈希, 规则哈希) 对应的结果，订阅和规则都未变化时不重新处理。
+    """
+
+    NODE_TYPES = ("shadowsocks", "vmess", "vless", "trojan", "http", "socks5")
+
+    def __init__(self, cache_dir: str, rules: Dict, logger):
+        self.nodes_dir = os.path.join(cache_dir, "nodes")
+        self.index_file = os.path.join(self.nodes_dir, "index.json")
+        self.logger = logger
+        self.include = self.compile_rule(rules.get("filter"), "QX_SERVER_FILTER")
+        self.exclude = self.compile_rule(rules.get("exclude"), "QX_SERVER_EXCLUDE")
+        self.renames = []
+        for rename in rules.get("rename", []):
+            if not isinstance(rename, dict) or not rename.get("pattern"):
+                self.logger.warning(f"节点重命名规则格式不正确: {rename}")
+                continue
+            pattern = self.compile_rule(rename["pattern"], "QX_SERVER_RENAME")
+            if pattern is not None:
+                self.renames.append((pattern, str(rename.get("replace", ""))))
+        self.rules_hash = hashlib.md5(json.dumps(rules, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        self.index = self.load_index()
+
+    def compile_rule(self, pattern, name: str):
+        if not pattern:
+            return None
+        try:
+            return re.compile(pattern)
+        except re.error as e:
+            self.logger.warning(f"{name} 正则表达式无效，已忽略: {pattern}: {str(e)}")
+            return None
+
+    def load_index(self) -> Dict:
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if isinstance(index, dict):
+                    return index
+        except Exception as e:
+            self.logger.warning(f"加载节点缓存索引失败: {str(e)}")
+        return {}
+
+    def object_path(self, output_hash: str) -> str:
+        return os.path.join(self.nodes_dir, f"{output_hash}.txt")
+
+    @staticmethod
+    def mirror_url(output_hash: str) -> str:
+        """节点列表的本地镜像地址"""
+        return f"{RESOURCE_MIRROR_URL}/nodes/{output_hash}.txt"
+
+    @classmethod
+    def parse_node(cls, line: str) -> Optional[ServerNode]:
+        """解析 "类型=地址:端口, 参数..., tag=名称"，不支持的行返回None"""
+        fields = [field.strip() for field in line.strip().split(',')]
+        node_type, sep, address = fields[0].partition('=')
+        node_type = node_type.strip().lower()
+        host, _, port = address.strip().rpartition(':')
+        if not sep or node_type not in cls.NODE_TYPES or not host or not port.isdigit():
+            return None
+
+        tag = ""
+        params = []
+        for field in fields:
+            if field.lower().startswith("tag") and field[3:].lstrip().startswith('='):
+                tag = field.split('=', 1)[1].strip()
+            elif field:
+                params.append(field)
+        return ServerNode(node_type, host, port, tag or f"{host}:{port}", ', '.join(params))
+
+    @staticmethod
+    def decode_lines(text: str) -> List[str]:
+        """订阅内容按行拆分，整体为base64编码时先解码"""
+        compact = ''.join(text.split())
+        if compact and re.fullmatch(r'[A-Za-z0-9+/=_-]+', compact):
+            import base64
+            try:
+                text = base64.urlsafe_b64decode(compact.replace('+', '-').replace('/', '_') + '=' * (-len(compact) % 4)
+                                                ).decode('utf-8', errors='replace')
+            except ValueError:
+                pass
+        return text.splitlines()
+
+    def transform(self, nodes: List[ServerNode]) -> Tuple[List[ServerNode], int, int]:
+        """筛选、重命名并按地址去重，返回 (节点, 筛除数, 重复数)"""
+        selected = []
+        for node in nodes:
+            if (self.include is not None and not self.include.search(node.tag)) or \
+                    (self.exclude is not None and self.exclude.search(node.tag)):
+                continue
+            for pattern, replace in self.renames:
+                node.tag = pattern.sub(replace, node.tag)
+            node.tag = node.tag.strip() or f"{node.host}:{node.port}"
+            selected.append(node)
+        unique = self.dedupe(selected, set(), set())
+        return unique, len(nodes) - len(selected), len(selected) - len(unique)
+
+    @staticmethod
+    def dedupe(nodes: List[ServerNode], seen: set, tags: set) -> List[ServerNode]:
+        """按地址去重（保留先出现的节点），重名的节点加序号；seen / tags 为已有的地址和名称"""
+        result = []
+        for node in nodes:
+            if node.endpoint in seen:
+                continue
+            seen.add(node.endpoint)
+            tag, n = node.tag, 2
+            while node.tag in tags:
+                node.tag = f"{tag} {n}"
+                n += 1
+            tags.add(node.tag)
+            result.append(node)
+        return result
+
+    def process(self, content_hash: str, read_text: Callable[[str], str]) -> Dict:
+        """处理一个订阅，返回结果记录：hash（节点列表的内容哈希）、节点数和各项统计"""
+        key = f"{content_hash}:{self.rules_hash}"
+        now = int(time.time())
+        entry = self.index.get(key)
+        if entry and os.path.exists(self.object_path(entry["hash"])):
+            entry["used_at"] = now
+            return entry
+
+        nodes = []
+        unsupported_count = 0
+        for line in self.decode_lines(read_text(content_hash)):
+            line = line.strip()
+            if not line or line.startswith(('#', ';', '//')):
+                continue
+            node = self.parse_node(line)
+            if node is None:
+                unsupported_count += 1
+            else:
+                nodes.append(node)
+
+        output, filtered_count, duplicate_count = self.transform(nodes)
+        body = '\n'.join(node.to_line() for node in output).encode('utf-8')
+        output_hash = hashlib.md5(body).hexdigest()
+        if not os.path.exists(self.object_path(output_hash)):
+            write_file_atomic(self.object_path(output_hash), body)
+
+        entry = {
+            "hash": output_hash,
+            "parsed": len(nodes),
+            "unsupported": unsupported_count,
+            "filtered": filtered_count,
+            "duplicate": duplicate_count,
+            "count": len(output),
+            "used_at": now,
+        }
+        self.index[key] = entry
+        return entry
+
+    def read_nodes(self, entry: Dict) -> List[ServerNode]:
+        """读取处理后的节点列表"""
+        with open(self.object_path(entry["hash"]), 'r', encoding='utf-8') as f:
+            return [node for node in map(self.parse_node, f.read().splitlines()) if node is not None]
+
+    def save(self):
+        """保存结果索引，清理超过保留期未使用的记录和不再引用的节点列表"""
+        expire_before = datetime.now().timestamp() - RESOURCE_RETENTION_DAYS * 86400
+        self.index = {key: entry for key, entry in self.index.items() if entry.get("used_at", 0) >= expire_before}
+        try:
+            write_file_atomic(self.index_file, json.dumps(self.index, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            self.logger.warning(f"保存节点缓存索引失败: {str(e)}")
+            return
+
+        referenced = {f"{entry['hash']}.txt" for entry in self.index.values()}
+        for name in os.listdir(self.nodes_dir):
+            path = os.path.join(self.nodes_dir, name)
+            try:
+                if name.endswith(".txt") and name not in referenced and os.path.getmtime(path) < expire_before:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class LatencyProber:
+    """节点TCP连接延迟探测
+
+    用asyncio并发建立TCP连接测量延迟，同时进行的连接数不超过 concurrency，
+    单个连接超过 timeout 视为不可达，整批探测超过 total_timeout 时未完成的节点结果未知。
+    结果（毫秒，不可达为None）按 "地址:端口" 保存在缓存文件中，ttl 秒内不重新探测。
+    """
+
+    def __init__(self, cache_file: str, logger, concurrency: int = PROBE_CONCURRENCY,
+                 timeout: float = PROBE_TIMEOUT, total_timeout: float = PROBE_TOTAL_TIMEOUT, ttl: float = PROBE_TTL):
+        self.cache_file = cache_file
+        self.logger = logger
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.ttl = ttl
+        self.cache = self.load_cache()
+        # 本次实际探测的节点数
+        self.probed_count = 0
+
+    def load_cache(self) -> Dict:
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+                if isinstance(cache, dict):
+                    return cache
+        except Exception as e:
+            self.logger.warning(f"加载延迟探测缓存失败: {str(e)}")
+        return {}
+
+    def save_cache(self):
+        # 过期很久的记录不再保留
+        expire_before = time.time() - max(self.ttl, 86400)
+        self.cache = {key: entry for key, entry in self.cache.items() if entry.get("at", 0) >= expire_before}
+        try:
+            write_file_atomic(self.cache_file, json.dumps(self.cache).encode('utf-8'))
+        except Exception as e:
+            self.logger.warning(f"保存延迟探测缓存失败: {str(e)}")
+
+    @staticmethod
+    def cache_key(endpoint: Tuple[str, int]) -> str:
+        return f"{endpoint[0]}:{endpoint[1]}"
+
+    async def connect(self, host: str, port: int, semaphore) -> Optional[float]:
+        """测量一次TCP连接耗时（毫秒），连接失败或超时返回None"""
+        import asyncio
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                return None
+            latency = (time.perf_counter() - start) * 1000
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            return round(latency, 1)
+
+    async def probe_all(self, endpoints: List[Tuple[str, int]]) -> Dict[Tuple[str, int], Optional[float]]:
+        """并发探测一组节点，返回在总时限内完成的结果"""
+        import asyncio
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = {endpoint: asyncio.ensure_future(self.connect(endpoint[0], endpoint[1], semaphore))
+                 for endpoint in endpoints}
+        done, pending = await asyncio.wait(list(tasks.values()), timeout=self.total_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            self.logger.warning(f"延迟探测超过总时限 {self.total_timeout}s，{len(pending)} 个节点结果未知")
+        return {endpoint: task.result() for endpoint, task in tasks.items() if task in done}
+
+    def probe(self, endpoints: List[Tuple[str, int]]) -> Dict[Tuple[str, int], Optional[float]]:
+        """返回各节点的延迟，缓存未过期的节点不重新探测；结果未知的节点不在返回值中"""
+        import asyncio
+        now = time.time()
+        results = {}
+        stale = []
+        for endpoint in dict.fromkeys(endpoints):
+            entry = self.cache.get(self.cache_key(endpoint))
+            if entry is not None and now - entry.get("at", 0) < self.ttl:
+                results[endpoint] = entry.get("latency")
+            else:
+                stale.append(endpoint)
+
+        if stale:
+            self.logger.info(f"开始探测 {len(stale)} 个节点的TCP连接延迟（{len(results)} 个使用缓存结果）")
+            self.probed_count = len(stale)
+            probed = asyncio.run(self.probe_all(stale))
+            for endpoint, latency in probed.items():
+                self.cache[self.cache_key(endpoint)] = {"latency": latency, "at": now}
+            results.update(probed)
+            self.save_cache()
+        return results
+
+
+class ConfigIndex(Mapping):
+    """配置内容的section索引
+
+    只扫描一遍内容，记录每个section正文的起止偏移，section内容在访问时才切片，
+    同一个索引可以同时用于合并、验证和统计。行为与逐行解析一致：
+    同名section以最后一个为准，section header之前的内容被忽略。
+    """
+
+    SECTION_PATTERN = re.compile(r'^[ \t]*\[([^\]\n]+)\][ \t\r]*$', re.MULTILINE)
+
+    def __init__(self, content: str):
+        self.content = content
+        # section名称 -> (正文起始偏移, 正文结束偏移)
+        self.offsets = {}
+        self.cache = {}
+        self.hashes = {}
+
+        previous_name = None
+        previous_end = 0
+        for match in self.SECTION_PATTERN.finditer(content):
+            if previous_name is not None:
+                self.offsets[previous_name] = (previous_end, match.start())
+            previous_name = match.group(1)
+            previous_end = match.end()
+
+        # 最后一个section的header之后没有任何内容时忽略
+        if previous_name is not None and previous_end < len(content):
+            self.offsets[previous_name] = (previous_end, len(content))
+
+    def __getitem__(self, name: str) -> str:
+        if name not in self.cache:
+            start, end = self.offsets[name]
+            self.cache[name] = self.content[start:end].strip()
+        return self.cache[name]
+
+    def __contains__(self, name) -> bool:
+        return name in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def section_hash(self, name: str) -> str:
+        """section正文的MD5哈希，不存在的section按空内容计算"""
+        if name not in self.hashes:
+            self.hashes[name] = hashlib.md5(self.get(name, "").encode('utf-8')).hexdigest()
+        return self.hashes[name]
+
+    def section_lines(self, name: str) -> List[str]:
+        """返回section中去除首尾空白后的非空行"""
+        if name not in self.offsets:
+            return []
+        return [line.strip() for line in self[name].split('\n') if line.strip()]
+
+
+class ConfigLine:
+    """section中的一行：类型（blank / comment / item）以及 key=value 形式的键和值"""
+
+    __slots__ = ("text", "kind", "key", "value")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.key = None
+        self.value = None
+
+        stripped = text.strip()
+        if not stripped:
+            self.kind = "blank"
+        elif stripped.startswith(('#', ';', '//')):
+            self.kind = "comment"
+        else:
+            self.kind = "item"
+            if '=' in stripped:
+                key, value = stripped.split('=', 1)
+                key = key.strip()
+                # 只有简单的键才视为 key=value（排除 "URL, tag=xxx" 这类条目）
+                if key and ',' not in key and ' ' not in key:
+                    self.key = key.lower()
+                    self.value = value.strip()
+
+
+class ConfigSection:
+    """可修改的section
+
+    在第一次修改或读取行之前只保存原文，未修改的section直接输出原文；
+    转换为行记录后，已有配置项和键的索引在第一次使用时建立，之后随修改同步更新，
+    因此添加配置项的开销只与修改的数量有关。
+    """
+
+    def __init__(self, name: str, content: str = ""):
+        self.name = name
+        self.content = content
+        self._lines = None
+        self._item_index = None
+        self._key_index = None
+
+    @property
+    def lines(self) -> List[ConfigLine]:
+        if self._lines is None:
+            self._lines = [ConfigLine(text) for text in self.content.split('\n')] if self.content else []
+            self.content = None
+        return self._lines
+
+    def item_set(self) -> set:
+        """已存在的配置项（去除首尾空白后的文本）"""
+        if self._item_index is None:
+            self._item_index = {line.text.strip() for line in self.lines if line.kind == "item"}
+        return self._item_index
+
+    def key_lines(self, key: str) -> List[ConfigLine]:
+        """按顺序返回指定键的所有行"""
+        if self._key_index is None:
+            self._key_index = {}
+            for line in self.lines:
+                if line.key:
+                    self._key_index.setdefault(line.key, []).append(line)
+        return self._key_index.get(key, [])
+
+    def position(self, line: ConfigLine) -> int:
+        """返回行在section中的位置"""
+        for i, candidate in enumerate(self.lines):
+            if candidate is line:
+                return i
+        return -1
+
+    def index_line(self, line: ConfigLine):
+        """把新行加入已建立的索引"""
+        if self._item_index is not None and line.kind == "item":
+            self._item_index.add(line.text.strip())
+        if self._key_index is not None and line.key:
+            self._key_index.setdefault(line.key, []).append(line)
+
+    def append(self, text: str) -> ConfigLine:
+        """在末尾添加一行"""
+        line = ConfigLine(text)
+        self.lines.append(line)
+        self.index_line(line)
+        return line
+
+    def insert(self, position: int, texts: List[str]):
+        """在指定位置插入多行"""
+        new_lines = [ConfigLine(text) for text in texts]
+        self.lines[position:position] = new_lines
+        if self._key_index is not None and any(line.key for line in new_lines):
+            # 键索引需要保持行的先后顺序，插入时重新建立
+            self._key_index = None
+        for line in new_lines:
+            if self._item_index is not None and line.kind == "item":
+                self._item_index.add(line.text.strip())
+
+    def set_line(self, line: ConfigLine, text: str):
+        """替换一行的内容（键保持不变）"""
+        if self._item_index is not None:
+            self._item_index.discard(line.text.strip())
+            self._item_index.add(text.strip())
+        line.text = text
+        line.value = ConfigLine(text).value
+
+    def replace_all(self, texts: List[str]):
+        """用新的行替换section全部内容，恢复为原文形式，再次读取行时才重新解析"""
+        self.content = '\n'.join(texts)
+        self._lines = None
+        self._item_index = None
+        self._key_index = None
+
+    def is_empty(self) -> bool:
+        if self._lines is None:
+            return not self.content.strip()
+        return all(line.kind == "blank" for line in self._lines)
+
+    def to_text(self) -> str:
+        if self._lines is None:
+            return self.content
+        return '\n'.join(line.text for line in self._lines)
+
+
+class ConfigDocument:
+    """合并用的配置文档：从section索引按需创建可修改的section，最后统一输出"""
+
+    def __init__(self, sections: Mapping):
+        self.source = sections
+        self.sections = {}
+
+    def section(self, name: str) -> ConfigSection:
+        if name not in self.sections:
+            self.sections[name] = ConfigSection(name, self.source.get(name, ""))
+        return self.sections[name]
+
+
+class SectionCache:
+    """section级的合并结果缓存，保存在最终配置旁的 .sections.json
+
+    upstream 记录上次生成时远程配置各section的哈希和行数，用于得到section级的变化；
+    merged 记录每个标准section上次的合并结果及其输入键（远程section内容、相关的个人配置等），
+    输入键相同时直接复用合并结果。每个section只保留最近一次的结果。
+    """
+
+    def __init__(self, path: str, logger):
+        self.path = path
+        self.logger = logger
+        self.upstream = {}
+        self.merged = {}
+        self.loaded = False
+        self.dirty = False
+
+    def load(self):
+        """第一次使用时从磁盘加载，守护模式下之后直接使用内存中的内容"""
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict) and data.get("version") == GENERATOR_VERSION:
+                    self.upstream = data.get("upstream", {})
+                    self.merged = data.get("merged", {})
+        except Exception as e:
+            self.logger.warning(f"加载section缓存失败: {str(e)}")
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {"version": GENERATOR_VERSION, "upstream": self.upstream, "merged": self.merged}
+        try:
+            write_file_atomic(self.path, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+            self.dirty = False
+        except Exception as e:
+            self.logger.warning(f"保存section缓存失败: {str(e)}")
+
+    def get(self, name: str, key: str) -> Optional[str]:
+        self.load()
+        entry = self.merged.get(name)
+        if entry and entry.get("key") == key:
+            return entry.get("text")
+        return None
+
+    def put(self, name: str, key: str, text: str):
+        self.load()
+        self.merged[name] = {"key": key, "text": text}
+        self.dirty = True
+
+    @staticmethod
+    def line_count(text: str) -> int:
+        return text.count('\n') + 1 if text else 0
+
+    @classmethod
+    def upstream_record(cls, sections: ConfigIndex) -> Dict:
+        """远程配置各section的哈希和行数"""
+        return {name: {"hash": sections.section_hash(name), "lines": cls.line_count(sections[name])}
+                for name in sections}
+
+    def diff_upstream(self, upstream: Dict) -> Dict:
+        """与上次记录的远程配置比较，返回新增、删除和内容变化的section（含新旧行数）"""
+        self.load()
+        diff = {"added": [], "removed": [], "changed": {}}
+        if not self.upstream:
+            return diff
+        for name, record in upstream.items():
+            old = self.upstream.get(name)
+            if old is None:
+                diff["added"].append(name)
+            elif old["hash"] != record["hash"]:
+                diff["changed"][name] = [old["lines"], record["lines"]]
+        diff["removed"] = [name for name in self.upstream if name not in upstream]
+        return diff
+
+    def record_upstream(self, upstream: Dict):
+        """记录本次使用的远程配置各section的哈希和行数"""
+        self.load()
+        if upstream != self.upstream:
+            self.upstream = upstream
+            self.dirty = True
+
+
+class GenerationCache:
+    """生成结果的磁盘缓存
+
+    配置内容按SHA-256哈希存放在 objects 目录（内容寻址，输入不同但结果相同的生成共用一个文件），
+    index.json 记录输入键 -> 内容哈希、大小、最近使用时间，以及生成时远程配置各section的哈希和行数
+    （命中时不需要解析也能更新section缓存的远程记录）。读取时校验内容哈希，不一致的记录直接丢弃；
+    记录数超过 max_entries 或内容总大小超过 max_bytes 时按最近使用时间淘汰。
+    每次读写都重新加载索引，批量模式下多个配置档案可以共用同一个目录。
+    """
+
+    def __init__(self, cache_dir: str, logger, max_entries: int = GENERATION_CACHE_ENTRIES,
+                 max_bytes: int = int(GENERATION_CACHE_MAX_MB * 1024 * 1024)):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_file = os.path.join(cache_dir, "index.json")
+        self.logger = logger
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def load_index(self) -> Dict:
+        try:
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if isinstance(index, dict) and index.get("version") == GENERATOR_VERSION:
+                    return index.get("entries", {})
+        except Exception as e:
+            self.logger.warning(f"加载生成结果缓存索引失败: {str(e)}")
+        return {}
+
+    def save_index(self, entries: Dict):
+        data = {"version": GENERATOR_VERSION, "entries": entries}
+        try:
+            write_file_atomic(self.index_file, json.dumps(data).encode('utf-8'))
+        except Exception as e:
+            self.logger.warning(f"保存生成结果缓存索引失败: {str(e)}")
+
+    def object_path(self, content_hash: str) -> str:
+        return os.path.join(self.objects_dir, f"{content_hash}.conf")
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[Dict]]]:
+        """返回输入键对应的配置内容和远程section记录，没有记录或校验失败时返回None"""
+        entries = self.load_index()
+        entry = entries.get(key)
+        if entry is None:
+            return None
+
+        try:
+            with open(self.object_path(entry["hash"]), 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = None
+        if data is None or hashlib.sha256(data).hexdigest() != entry["hash"]:
+            self.logger.warning("生成结果缓存文件缺失或校验失败，丢弃该记录")
+            del entries[key]
+            self.evict(entries)
+            self.save_index(entries)
+            return None
+
+        entry["used_at"] = time.time()
+        self.save_index(entries)
+        return data.decode('utf-8'), entry.get("upstream")
+
+    def put(self, key: str, content: str, upstream: Optional[Dict] = None):
+        """保存生成结果，并按数量和总大小淘汰最久未使用的记录"""
+        data = content.encode('utf-8')
+        if len(data) > self.max_bytes:
+            return
+        content_hash = hashlib.sha256(data).hexdigest()
+        try:
+            if not os.path.exists(self.object_path(content_hash)):
+                write_file_atomic(self.object_path(content_hash), data)
+        except Exception as e:
+            self.logger.warning(f"保存生成结果缓存失败: {str(e)}")
+            return
+
+        entries = self.load_index()
+        entries[key] = {"hash": content_hash, "size": len(data), "used_at": time.time(), "upstream": upstream}
+        self.evict(entries)
+        self.save_index(entries)
+
+    def evict(self, entries: Dict):
+        """淘汰超出限制的记录，删除不再被引用的内容文件"""
+        by_age = sorted(entries, key=lambda k: entries[k].get("used_at", 0), reverse=True)
+        kept_hashes = set()
+        kept_count = total_bytes = 0
+        for key in by_age:
+            entry = entries[key]
+            new_bytes = 0 if entry["hash"] in kept_hashes else entry.get("size", 0)
+            if kept_count >= self.max_entries or total_bytes + new_bytes > self.max_bytes:
+                del entries[key]
+                continue
+            kept_hashes.add(entry["hash"])
+            kept_count += 1
+            total_bytes += new_bytes
+
+        if not os.path.isdir(self.objects_dir):
+            return
+        for name in os.listdir(self.objects_dir):
+            if name.endswith(".conf") and name[:-len(".conf")] not in kept_hashes:
+                try:
+                    os.remove(os.path.join(self.objects_dir, name))
+                except OSError:
+                    pass
+
+
+class FilterRuleSet:
+    """[filter_local] 规则集
+
+    按顺序加入规则，QuantumultX 按第一条匹配的规则生效，因此被前面规则完全覆盖的
+    规则永远不会生效，可以安全移除：
+    - 类型和值相同（域名不区分大小写）的重复规则
+    - 被前面 host-suffix（后缀索引）或 host-keyword（按前缀分组的关键词索引）覆盖的域名规则
+    - 被前面 ip-cidr / ip6-cidr 区间（区间索引）覆盖的IP规则
+    输出时把连续的、策略和参数相同的IP规则合并为最少的CIDR。
+    IP规则只解析为整数区间，只有可能合并的连续规则才构造 ipaddress 对象。
+    """
+
+    DOMAIN_TYPES = ("host", "host-suffix", "host-keyword", "host-wildcard")
+    IP_TYPES = ("ip-cidr", "ip6-cidr")
+    # 关键词索引的前缀长度，更短的关键词单独按长度扫描
+    KEYWORD_PREFIX = 4
+
+    def __init__(self):
+        # 每一项为 (原始行, 解析后的规则或None)
+        self.items = []
+        self.exact_keys = set()
+        self.hosts = set()
+        self.suffixes = set()
+        self.keywords = set()
+        # 关键词前缀 -> 该前缀下的关键词长度
+        self.keyword_prefixes = {}
+        self.short_keyword_lengths = set()
+        # (IP版本, 是否仅统计未设置no-resolve的规则) -> 已合并的有序区间列表
+        self.ip_ranges = {}
+        self.duplicate_count = 0
+        self.shadowed_count = 0
+        self.merged_count = 0
+
+    @classmethod
+    def parse_rule(cls, line: str) -> Optional[Dict]:
+        """解析一条规则，返回类型、值、策略和参数；注释或无法识别的行返回None"""
+        stripped = line.strip()
+        if not stripped or stripped.startswith(('#', ';', '//')):
+            return None
+
+        fields = stripped.split(',')
+        if len(fields) < 2:
+            return None
+
+        type_text = fields[0].strip()
+        rule_type = type_text.lower()
+        value = fields[1].strip()
+        ip_range = None
+        if rule_type in cls.DOMAIN_TYPES:
+            value = value.lower().rstrip('.')
+        elif rule_type in cls.IP_TYPES:
+            ip_range = cls.parse_range(value)
+
+        return {
+            "type": rule_type,
+            "type_text": type_text,
+            "value": value,
+            "policy": fields[2].strip() if len(fields) > 2 else "",
+            "options": [option.strip().lower() for option in fields[3:]] if len(fields) > 3 else [],
+            "range": ip_range,
+        }
+
+    @staticmethod
+    def parse_range(value: str) -> Optional[Tuple[int, int, int]]:
+        """把CIDR解析为 (IP版本, 起始地址, 结束地址)，无效时返回None
+
+        常见的IPv4写法直接按整数计算，IPv6、掩码写法等其余情况交给 ipaddress。
+        """
+        address, _, prefix = value.partition('/')
+        octets = address.split('.')
+        if (len(octets) == 4 and prefix.isascii() and prefix.isdigit() and int(prefix) <= 32
+                and all(octet.isascii() and octet.isdigit() and len(octet) <= 3
+                        and (len(octet) == 1 or octet[0] != '0') and int(octet) <= 255
+                        for octet in octets)):
+            number = (int(octets[0]) << 24) | (int(octets[1]) << 16) | (int(octets[2]) << 8) | int(octets[3])
+            host_mask = (1 << (32 - int(prefix))) - 1
+            start = number & ~host_mask
+            return 4, start, start | host_mask
+
+        import ipaddress
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except ValueError:
+            return None
+        return network.version, int(network.network_address), int(network.broadcast_address)
+
+    def add(self, line: str) -> bool:
+        """按顺序加入一行，规则被前面的规则覆盖时返回False"""
+        rule = self.parse_rule(line)
+        if rule is None or rule["type"] == "final":
+            self.items.append((line, None))
+            return True
+
+        # IP规则的重复由区间索引判断（需要考虑no-resolve）
+        exact_key = (rule["type"], rule["value"])
+        if rule["range"] is None and exact_key in self.exact_keys:
+            self.duplicate_count += 1
+            return False
+
+        if self.is_shadowed(rule):
+            self.shadowed_count += 1
+            return False
+
+        self.exact_keys.add(exact_key)
+        self.index_rule(rule)
+        self.items.append((line, rule))
+        return True
+
+    def match_suffix(self, host: str) -> bool:
+        """检查域名或其任一上级域名是否已有 host-suffix 规则"""
+        while host not in self.suffixes:
+            dot = host.find('.')
+            if dot < 0:
+                return False
+            host = host[dot + 1:]
+        return True
+
+    def match_keyword(self, host: str) -> bool:
+        """检查域名是否包含已有的 host-keyword，只在前缀命中的位置比较子串"""
+        if not self.keywords:
+            return False
+
+        keywords = self.keywords
+        for length in self.short_keyword_lengths:
+            for i in range(len(host) - length + 1):
+                if host[i:i + length] in keywords:
+                    return True
+
+        size = self.KEYWORD_PREFIX
+        prefixes = self.keyword_prefixes
+        for i in range(len(host) - size + 1):
+            lengths = prefixes.get(host[i:i + size])
+            if lengths:
+                for length in lengths:
+                    if host[i:i + length] in keywords:
+                        return True
+        return False
+
+    def is_shadowed(self, rule: Dict) -> bool:
+        """检查规则的匹配范围是否已被前面的规则完全覆盖"""
+        rule_type = rule["type"]
+        value = rule["value"]
+
+        if rule_type == "host":
+            return value in self.hosts or self.match_suffix(value) or self.match_keyword(value)
+        if rule_type == "host-suffix":
+            return self.match_suffix(value) or self.match_keyword(value)
+        if rule_type == "host-keyword":
+            return self.match_keyword(value)
+        if rule_type in self.IP_TYPES and rule["range"] is not None:
+            version, start, end = rule["range"]
+            # 未设置no-resolve的规则会触发DNS解析，只能被同样会解析的规则覆盖
+            intervals = self.ip_ranges.get((version, "no-resolve" not in rule["options"]))
+            if not intervals:
+                return False
+            import bisect
+            i = bisect.bisect_right(intervals, (start, float('inf'))) - 1
+            return i >= 0 and intervals[i][1] >= end
+        return False
+
+    def index_rule(self, rule: Dict):
+        """把规则加入索引，供后续规则判断是否被覆盖"""
+        rule_type = rule["type"]
+        if rule_type == "host":
+            self.hosts.add(rule["value"])
+        elif rule_type == "host-suffix":
+            self.suffixes.add(rule["value"])
+        elif rule_type == "host-keyword":
+            keyword = rule["value"]
+            self.keywords.add(keyword)
+            if len(keyword) < self.KEYWORD_PREFIX:
+                self.short_keyword_lengths.add(len(keyword))
+            else:
+                self.keyword_prefixes.setdefault(keyword[:self.KEYWORD_PREFIX], set()).add(len(keyword))
+        elif rule_type in self.IP_TYPES and rule["range"] is not None:
+            version, start, end = rule["range"]
+            # 所有IP规则都能覆盖设置了no-resolve的规则
+            self.insert_range((version, False), start, end)
+            if "no-resolve" not in rule["options"]:
+                self.insert_range((version, True), start, end)
+
+    def insert_range(self, key: Tuple, start: int, end: int):
+        """向有序区间列表插入区间，合并重叠和相邻的区间"""
+        import bisect
+        intervals = self.ip_ranges.setdefault(key, [])
+        i = bisect.bisect_left(intervals, (start, -1))
+        if i > 0 and intervals[i - 1][1] >= start - 1:
+            i -= 1
+            start = intervals[i][0]
+            end = max(end, intervals[i][1])
+        j = i
+        while j < len(intervals) and intervals[j][0] <= end + 1:
+            end = max(end, intervals[j][1])
+            j += 1
+        intervals[i:j] = [(start, end)]
+
+    def lines(self) -> List[str]:
+        """输出规则，连续的同策略同参数IP规则合并为最少的CIDR"""
+        result = []
+        run = []
+
+        def flush_run():
+            if len(run) > 1:
+                import ipaddress
+                first = run[0]
+                networks = list(ipaddress.collapse_addresses(
+                    ipaddress.ip_network(rule["value"], strict=False) for rule in run))
+                if len(networks) < len(run):
+                    self.merged_count += len(run) - len(networks)
+                    for network in networks:
+                        fields = [first["type_text"], str(network), first["policy"]] + first["options"]
+                        result.append(', '.join(fields))
+                    run.clear()
+                    return
+            result.extend(rule["line"] for rule in run)
+            run.clear()
+
+        for line, rule in self.items:
+            if rule is not None and rule["range"] is not None:
+                run_key = (rule["type"], rule["range"][0], rule["policy"], rule["options"])
+                if run and (run[0]["type"], run[0]["range"][0], run[0]["policy"], run[0]["options"]) != run_key:
+                    flush_run()
+                run.append(dict(rule, line=line))
+                continue
+            if run:
+                flush_run()
+            result.append(line)
+        flush_run()
+
+        return result
+
+
+class PolicyIndex:
+    """[policy] 策略组索引
+
+    只扫描一遍section，按名称记录每个策略组的行和解析结果，并记录每种类型策略组的首尾行。
+    个人策略组支持三种操作：
+    - insert：名称不存在时插入（已存在则跳过）
+    - replace：替换同名策略组（不存在时插入）
+    - merge：把成员合并到同名策略组末尾，已有成员和参数保持不变（不存在时插入）
+    插入位置可以是同类型策略组的开头（start）、末尾（end），或指定策略组之前/之后
+    （before:名称 / after:名称）。插入先挂在锚点行上，最后一次性重建section，
+    因此合并的开销与策略组数量成线性关系。
+    """
+
+    GROUP_TYPES = ("static", "available", "round-robin", "url-latency-benchmark", "dest-hash", "ssid")
+    BUILTIN_POLICIES = {"proxy", "direct", "reject", "reject-img", "reject-dict", "reject-array",
+                        "reject-200", "reject-video", "reject-tinygif"}
+
+    def __init__(self, section: ConfigSection):
+        self.section = section
+        # 策略组名称 -> [行, 解析结果]，新插入的策略组的行为None
+        self.groups = {}
+        # 策略组类型 -> [第一行, 最后一行]
+        self.type_bounds = {}
+        self.first_group = None
+        self.last_group = None
+        # 锚点id -> 插在其前/后的新策略组（新策略组本身也可以作为锚点）
+        self.before = {}
+        self.after = {}
+        self.changed = False
+
+        for line in section.lines:
+            if line.kind != "item":
+                continue
+            group = self.parse_group(line.text)
+            if group is None:
+                continue
+            self.groups.setdefault(group["name"], [line, group])
+            bounds = self.type_bounds.setdefault(group["type"], [line, line])
+            bounds[1] = line
+            if self.first_group is None:
+                self.first_group = line
+            self.last_group = line
+
+    @classmethod
+    def parse_group(cls, text: str) -> Optional[Dict]:
+        """解析 "类型=名称, 成员..., 参数=值..."，不是策略组时返回None"""
+        head, _, rest = text.strip().partition(',')
+        group_type, sep, name = head.partition('=')
+        group_type = group_type.strip().lower()
+        if not sep or group_type not in cls.GROUP_TYPES or not name.strip():
+            return None
+
+        members = []
+        options = []
+        for field in rest.split(','):
+            field = field.strip()
+            if not field:
+                continue
+            if '=' in field:
+                options.append(field)
+            else:
+                members.append(field)
+        return {"type": group_type, "name": name.strip(), "members": members, "options": options}
+
+    @staticmethod
+    def format_group(group: Dict) -> str:
+        return ', '.join([f"{group['type']}={group['name']}"] + group["members"] + group["options"])
+
+    def attach(self, group: Dict, position: str) -> Optional[str]:
+        """按位置把新策略组挂到锚点上，返回错误信息或None"""
+        if position.startswith(("before:", "after:")):
+            side, _, anchor_name = position.partition(':')
+            anchor = self.groups.get(anchor_name.strip())
+            if anchor is None:
+                return f"找不到插入位置的策略组: {anchor_name.strip()}"
+            anchor_key = id(anchor[0]) if anchor[0] is not None else id(anchor[1])
+            (self.before if side == "before" else self.after).setdefault(anchor_key, []).append(group)
+            return None
+        if position not in ("start", "end"):
+            return f"无法识别的插入位置: {position}"
+
+        bounds = self.type_bounds.get(group["type"])
+        if bounds and position == "end":
+            self.after.setdefault(id(bounds[1]), []).append(group)
+        elif bounds:
+            self.before.setdefault(id(bounds[0]), []).append(group)
+        elif group["type"] != "static" and self.last_group is not None:
+            # 没有同类型的策略组时放在所有策略组之后
+            self.after.setdefault(id(self.last_group), []).append(group)
+        elif self.section.lines:
+            self.before.setdefault(id(self.section.lines[0]), []).append(group)
+        else:
+            self.after.setdefault(None, []).append(group)
+        return None
+
+    def apply(self, text: str, mode: str = "insert", position: str = "") -> Tuple[str, Optional[Dict]]:
+        """应用一个个人策略组，返回 (结果, 解析后的策略组)
+
+        结果为 added / replaced / merged / skipped / invalid，或以 "error:" 开头的错误信息。
+        """
+        group = self.parse_group(text)
+        if group is None:
+            return "invalid", None
+
+        existing = self.groups.get(group["name"])
+        if existing is not None and mode in ("replace", "merge"):
+            line, current = existing
+            if mode == "merge":
+                known = set(current["members"])
+                merged = dict(current, members=current["members"] + [m for m in group["members"] if m not in known])
+                option_keys = {option.split('=', 1)[0].strip().lower() for option in current["options"]}
+                merged["options"] = current["options"] + [
+                    option for option in group["options"]
+                    if option.split('=', 1)[0].strip().lower() not in option_keys
+                ]
+                group = merged
+            if line is not None:
+                self.section.set_line(line, self.format_group(group))
+                existing[1] = group
+            else:
+                # 本次新插入、尚未写入section的策略组：原地修改，锚点保持不变
+                current.update(group)
+                group = current
+            self.changed = True
+            return ("merged" if mode == "merge" else "replaced"), group
+
+        if existing is not None:
+            return "skipped", group
+
+        error = self.attach(group, position or ("start" if group["type"] == "static" else "end"))
+        if error:
+            return f"error:{error}", group
+        # 新策略组以解析结果对象的id作为锚点，后续的 before:/after: 可以引用它
+        self.groups[group["name"]] = [None, group]
+        self.changed = True
+        return "added", group
+
+    def undefined_members(self, group: Dict, known: set) -> List[str]:
+        """策略组中引用的、既不是策略组也不是内置策略或已知节点的成员"""
+        return [member for member in group["members"]
+                if member not in self.groups and member.lower() not in self.BUILTIN_POLICIES
+                and member not in known]
+
+    def rebuild(self):
+        """把挂在锚点上的新行一次性写入section"""
+        if not self.before and not self.after:
+            return
+
+        texts = []
+
+        def emit(key, text):
+            for child in self.before.get(key, []):
+                emit(id(child), self.format_group(child))
+            texts.append(text)
+            for child in self.after.get(key, []):
+                emit(id(child), self.format_group(child))
+
+        for line in self.section.lines:
+            emit(id(line), line.text)
+        for child in self.after.get(None, []):
+            emit(id(child), self.format_group(child))
+
+        self.section.replace_all(texts)
+        self.before = {}
+        self.after = {}
+
+
+class ReplacementEngine:
+    """QX_REPLACE_* 替换规则引擎
+
+    规则格式: {"search": "...", "replace": "...", "regex": false, "section": "可选的section名称"}
+    替换结果与按顺序逐条执行 str.replace 相同：互不影响的字面量规则编译成一个正则，
+    一次扫描完成全部替换；可能互相影响的规则（搜索内容有重叠、前面规则的替换结果
+    可能被后面的规则匹配、替换为空）和正则规则放到后续的扫描中依次执行。
+    指定了 section 的规则只作用于该section的内容，并在全局规则之前执行。
+    """
+
+    def __init__(self, rules: List[Dict]):
+        self.rules = []
+        self.errors = []
+        for rule in rules:
+            search = str(rule.get("search", ""))
+            if not search:
+                self.errors.append("替换规则的search为空，已忽略")
+                continue
+            normalized = {
+                "search": search,
+                "replace": str(rule.get("replace", "")),
+                "regex": bool(rule.get("regex", False)),
+                "section": rule.get("section") or None,
+                "count": 0,
+            }
+            if normalized["regex"]:
+                try:
+                    normalized["pattern"] = re.compile(search, re.MULTILINE)
+                except re.error as e:
+                    self.errors.append(f"替换规则正则表达式无效: {search}: {str(e)}")
+                    continue
+            self.rules.append(normalized)
+
+        # 作用范围（None表示全局）-> 依次执行的扫描列表
+        self.stages = {}
+        for scope in dict.fromkeys(rule["section"] for rule in self.rules):
+            self.stages[scope] = self.build_stages([rule for rule in self.rules if rule["section"] == scope])
+
+    @staticmethod
+    def overlaps(a: str, b: str) -> bool:
+        """两个字符串在文本中是否可能重叠（包含或首尾部分相接）"""
+        if not a or not b or a in b or b in a:
+            return True
+        for k in range(1, min(len(a), len(b))):
+            if a.endswith(b[:k]) or b.endswith(a[:k]):
+                return True
+        return False
+
+    def build_stages(self, rules: List[Dict]) -> List[Tuple]:
+        """把规则分组为多次扫描，同一次扫描中的规则互不影响"""
+        stages = []
+        current = []
+
+        def flush():
+            if current:
+                pattern = re.compile('|'.join(f'({re.escape(rule["search"])})' for rule in current))
+                stages.append((pattern, list(current)))
+                current.clear()
+
+        for rule in rules:
+            if rule["regex"]:
+                flush()
+                stages.append((rule["pattern"], [rule]))
+                continue
+
+            conflict = any(
+                self.overlaps(rule["search"], earlier["search"])
+                or not earlier["replace"]
+                or self.overlaps(rule["search"], earlier["replace"])
+                for earlier in current
+            )
+            if conflict:
+                flush()
+            current.append(rule)
+        flush()
+
+        return stages
+
+    def has_scope(self, section: Optional[str]) -> bool:
+        return section in self.stages
+
+    def apply(self, text: str, section: Optional[str] = None) -> str:
+        """对文本应用指定作用范围的规则"""
+        for pattern, rules in self.stages.get(section, []):
+            if len(rules) == 1 and rules[0]["regex"]:
+                text, count = pattern.subn(rules[0]["replace"], text)
+                rules[0]["count"] += count
+                continue
+
+            def replace(match, rules=rules):
+                rule = rules[match.lastindex - 1]
+                rule["count"] += 1
+                return rule["replace"]
+
+            text = pattern.sub(replace, text)
+        return text
+
+
+class ConfigStore:
+    """内存中的最新配置，供订阅服务器直接返回，不再读取磁盘
+
+    每个配置以访问路径（令牌）为键，发布时预先计算ETag和gzip压缩内容。
+    gzip压缩内容是不同的表示，使用带 -gz 后缀的ETag。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def publish(self, key: str, data: bytes):
+        """发布一个配置的新内容"""
+        import gzip
+        from email.utils import formatdate
+
+        digest = hashlib.md5(data).hexdigest()
+        entry = {
+            "data": data,
+            "gzip": gzip.compress(data, compresslevel=6, mtime=0),
+            "etag": f'"{digest}"',
+            "gzip_etag": f'"{digest}-gz"',
+            "last_modified": formatdate(time.time(), usegmt=True),
+        }
+        with self.lock:
+            self.entries[key] = entry
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self.lock:
+            return self.entries.get(key)
+
+
+class SubscriptionHandler:
+    """订阅请求处理：按路径或 token 参数选择配置，支持 ETag/304、gzip 和 Range
+
+    启动服务器时与 http.server.BaseHTTPRequestHandler 组合成实际的处理类。
+    """
+
+    store = None
+    logger = None
+
+    def log_message(self, format, *args):
+        if self.logger:
+            self.logger.debug(f"订阅服务器: {self.address_string()} {format % args}")
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    @staticmethod
+    def etag_matches(header: str, entry: Dict) -> bool:
+        """If-None-Match 中的任一ETag与未压缩或gzip版本的ETag相同时视为未修改（弱比较）"""
+        if header.strip() == '*':
+            return True
+        tags = set()
+        for tag in header.split(','):
+            tag = tag.strip()
+            tags.add(tag[2:] if tag.startswith('W/') else tag)
+        return entry["etag"] in tags or entry["gzip_etag"] in tags
+
+    def handle_request(self, send_body: bool):
+        parsed = urlparse(self.path)
+        key = parse_qs(parsed.query).get("token", [""])[0] or parsed.path.strip('/')
+
+        entry = self.store.get(key) if self.store else None
+        if entry is None:
+            self.send_error(404)
+            return
+
+        # Range请求返回未压缩内容的一部分，其余请求按 Accept-Encoding 选择gzip
+        range_header = self.headers.get('Range', '')
+        partial = range_header.startswith('bytes=') and ',' not in range_header
+        use_gzip = not partial and 'gzip' in self.headers.get('Accept-Encoding', '')
+        etag = entry["gzip_etag"] if use_gzip else entry["etag"]
+
+        if self.etag_matches(self.headers.get('If-None-Match', ''), entry):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+
+        data = entry["data"]
+        status = 200
+        content_range = None
+        encoding = None
+
+        if partial:
+            start_text, _, end_text = range_header[6:].strip().partition('-')
+            try:
+                if start_text:
+                    start = int(start_text)
+                    end = min(int(end_text), len(data) - 1) if end_text else len(data) - 1
+                else:
+                    start = max(len(data) - int(end_text), 0)
+                    end = len(data) - 1
+            except ValueError:
+                start, end = 0, len(data) - 1
+            if start >= len(data) or start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.end_headers()
+                return
+            content_range = f'bytes {start}-{end}/{len(data)}'
+            data = data[start:end + 1]
+            status = 206
+        elif use_gzip:
+            data = entry["gzip"]
+            encoding = 'gzip'
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', entry["last_modified"])
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+
+def start_subscription_server(store: ConfigStore, logger, host: str = SERVE_HOST,
+                              port: int = SERVE_PORT) -> "http.server.ThreadingHTTPServer":
+    """在后台线程中启动订阅服务器"""
+    import http.server
+
+    handler = type("BoundSubscriptionHandler", (SubscriptionHandler, http.server.BaseHTTPRequestHandler),
+                   {"store": store, "logger": logger})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="qx-subscription-server", daemon=True).start()
+    logger.info(f"订阅服务器已启动: http://{host}:{server.server_address[1]}/")
+    return server
+
+
+def print_notification(title: str, content: str):
+    """控制台输出模拟通知"""
+    print(f"\n{'='*60}")
+    print(f"通知标题: {title}")
+    print(f"通知内容:")
+    print(content)
+    print(f"{'='*60}\n")
+
+
+class Notifier:
+    """通知后端：每个进程只查找和导入一次青龙通知模块，在后台线程中发送
+
+    通知放入有界队列后立即返回，慢速推送渠道不会阻塞配置生成；队列满时丢弃新通知。
+    在 coalesce() 范围内提交的通知会合并为一条，批量模式下只推送一次。
+    """
+
+    # 青龙v2.19.2的notify模块通常位于以下路径
+    NOTIFY_PATHS = [
+        '/ql/data/scripts/notify.py',
+        '/ql/scripts/notify.py',
+        '/ql/data/scripts/sendNotify.py',
+        '/ql/scripts/sendNotify.py'
+    ]
+
+    def __init__(self, logger, queue_size: int = NOTIFY_QUEUE_SIZE):
+        self.logger = logger
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.backend = None
+        self.worker = None
+        self.pending = None
+
+    def resolve_backend(self) -> Callable[[str, str], None]:
+        """查找可用的通知方式，结果在进程内缓存"""
+        for notify_path in self.NOTIFY_PATHS:
+            if os.path.exists(notify_path):
+                try:
+                    self.logger.info(f"尝试从 {notify_path} 导入通知模块")
+
+                    # 动态导入模块
+                    import importlib.util
+                    spec = importlib.util.spec_from_file_location("notify_module", notify_path)
+                    notify_module = importlib.util.module_from_spec(spec)
+                    spec.loader.exec_module(notify_module)
+
+                    # 检查是否有send函数，有些版本使用send_notify
+                    for name in ('send', 'send_notify'):
+                        if hasattr(notify_module, name):
+                            self.logger.info(f"使用通知模块 {notify_path} ({name})")
+                            return getattr(notify_module, name)
+
+                except Exception as e:
+                    self.logger.warning(f"从 {notify_path} 导入通知模块失败: {str(e)}")
+                    continue
+
+        # 如果找不到通知模块，尝试使用QL原生的通知方式
+        try:
+            from qinglong import notify
+            self.logger.info("使用QL原生通知方式")
+            return notify
+        except ImportError:
+            pass
+
+        # 尝试使用环境变量中的通知脚本
+        ql_notify_path = os.getenv('QL_NOTIFY_SCRIPT', '/ql/data/scripts/notify.py')
+        if os.path.exists(ql_notify_path):
+            import subprocess
+
+            def run_notify_script(title: str, content: str):
+                result = subprocess.run(
+                    [sys.executable, ql_notify_path, title, content],
+                    capture_output=True,
+                    text=True,
+                    timeout=10
+                )
+                if result.returncode != 0:
+                    raise RuntimeError(f"通知脚本返回 {result.returncode}")
+
+            self.logger.info(f"使用通知脚本 {ql_notify_path}")
+            return run_notify_script
+
+        # 如果所有方法都失败，使用控制台输出
+        self.logger.warning("无法找到青龙通知模块，将使用简单控制台输出")
+        return print_notification
+
+    def start(self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.worker_loop, name="qx-notifier", daemon=True)
+                self.worker.start()
+                atexit.register(self.flush)
+
+    def worker_loop(self):
+        while True:
+            title, content = self.queue.get()
+            try:
+                if self.backend is None:
+                    self.backend = self.resolve_backend()
+                self.backend(title, content)
+                self.logger.info(f"青龙通知发送成功: {title}")
+            except Exception as e:
+                self.logger.error(f"发送青龙通知失败: {str(e)}")
+                # 回退到简单输出
+                print_notification(title, content)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, title: str, content: str) -> bool:
+        """提交通知，不等待发送完成"""
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((title, content))
+                return True
+        self.start()
+        try:
+            self.queue.put_nowait((title, content))
+            return True
+        except queue.Full:
+            self.logger.warning(f"通知队列已满，丢弃通知: {title}")
+            return False
+
+    @contextmanager
+    def coalesce(self):
+        """范围内提交的通知合并为一条发送"""
+        with self.lock:
+            self.pending = []
+        try:
+            yield self
+        finally:
+            with self.lock:
+                pending, self.pending = self.pending, None
+            if len(pending) == 1:
+                self.submit(*pending[0])
+            elif pending:
+                content = "\n\n".join(f"【{title}】\n{content}" for title, content in pending)
+                self.submit(f"QuantumultX配置: {len(pending)} 条通知", content)
+
+    def flush(self, timeout: float = NOTIFY_TIMEOUT) -> bool:
+        """等待队列中的通知发送完成，最多等待 timeout 秒"""
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.logger.warning(f"仍有 {self.queue.unfinished_tasks} 条通知未发送完成")
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+
+_notifier = None
+
+
+def get_notifier(logger) -> Notifier:
+    """获取进程内共享的通知器"""
+    global _notifier
+    if _notifier is None:
+        _notifier = Notifier(logger)
+    return _notifier
+
 
 class QuantumultXConfigGenerator:
     """QuantumultX 配置生成器"""
 
-    def __init__(self):
+    # 各标准section对应的个人配置项
+    SECTION_PERSONAL_KEYS = {
+        "mitm": "mitm",
+        "rewrite_remote": "rewrite_remote",
+        "rewrite_local": "rewrite_local",
+        "server_remote": "server_remote",
+        "policy": "policies",
+        "dns": "dns",
+        "filter_remote": "filter_remote",
+        "filter_local": "filter_local",
+    }
+    # 合并结果还依赖其他section的内容（inline模式下 filter_remote 的规则会内联到 filter_local）
+    SECTION_DEPENDENCIES = {
+        "filter_remote": ("filter_local",),
+        "filter_local": ("filter_remote",),
+    }
+    # 合并结果依赖远程资源缓存的section
+    RESOURCE_SECTIONS = ("rewrite_remote", "filter_remote", "filter_local")
+
+    def __init__(self, remote_url: Optional[str] = None, config_path: Optional[str] = None,
+                 remote_backup: Optional[str] = None, env_overrides: Optional[Dict] = None,
+                 profile_name: str = "", remote_cache: Optional[Dict] = None,
+                 session: Optional["requests.Session"] = None,
+                 resource_cache: Optional[RemoteResourceCache] = None,
+                 mirrors: Optional[List[str]] = None):
         self.logger = self.setup_logger()
+        # 进程内共享的通知器，只解析一次通知后端
+        self.notifier = get_notifier(self.logger)
+        # 共享的HTTP会话，批量模式下所有配置档案复用同一组连接；第一次使用时才创建
+        self._session = session
+        # 守护/服务器模式下为True：常驻进程总是使用共享会话，不走一次性连接的快速路径
+        self.long_running = False
+        # 远程资源缓存，批量模式下各配置档案共享
+        self.resource_cache = resource_cache
+        self.resource_mode = RESOURCE_MODE
+        if self.resource_mode not in ("", "mirror", "inline"):
+            self.logger.warning(f"未知的资源缓存模式: {self.resource_mode}，已禁用")
+            self.resource_mode = ""
+        elif self.resource_mode == "mirror" and not RESOURCE_MIRROR_URL:
+            self.logger.warning("mirror模式需要设置 QX_RESOURCE_MIRROR_URL，已禁用资源缓存")
+            self.resource_mode = ""
+        self.resource_hashes = {}
+        self.inline_filter_rules = []
+        self.server_pipeline = SERVER_PIPELINE
+        if self.server_pipeline not in ("", "mirror", "inline"):
+            self.logger.warning(f"未知的节点订阅预处理模式: {self.server_pipeline}，已禁用")
+            self.server_pipeline = ""
+        elif self.server_pipeline == "mirror" and not RESOURCE_MIRROR_URL:
+            self.logger.warning("节点订阅mirror模式需要设置 QX_RESOURCE_MIRROR_URL，已禁用节点订阅预处理")
+            self.server_pipeline = ""
+        # 节点订阅 URL -> 订阅内容哈希，以及本次生成的处理结果（URL -> 结果记录）
+        self.server_hashes = {}
+        self.server_results = None
+        self.server_node_pipeline = None
+        self.latency_probe = LATENCY_PROBE
+        if self.latency_probe not in ("", "sort", "prune"):
+            self.logger.warning(f"未知的节点延迟探测模式: {self.latency_probe}，已禁用")
+            self.latency_probe = ""
+        # 节点名称 -> TCP连接延迟（毫秒，不可达为None，结果未知的节点不在其中）
+        self.node_latency = {}
+        # 节点名称 -> 排序使用的延迟区间（带滞后），计入输入指纹并记录在配置生成记录中
+        self.node_buckets = {}
+        self.replacement_engine = None
+        self.config_unchanged = False
+        self.saved_config_hash = ""
+        # 上次使用的远程配置内容和解析结果，守护模式下在多次运行之间复用
+        self.remote_memo = None
+        # 订阅服务器使用的内存配置和访问路径（令牌），批量模式下由清单指定
+        self.config_store = None
+        self.serve_key = SERVE_TOKEN if not profile_name else profile_name
+        self.remote_url = remote_url or REMOTE_CONFIG_URL
+        # 远程配置的镜像地址，未指定时 QX_REMOTE_MIRRORS 只用于默认的远程配置地址
+        if mirrors is None:
+            mirrors = REMOTE_MIRRORS if self.remote_url == REMOTE_CONFIG_URL else []
+        self.mirrors = [url for url in mirrors if url != self.remote_url]
+        # 各地址的响应延迟（毫秒，指数加权平均）和连续失败次数，保存在状态记录中
+        self.mirror_stats = {}
+        self.config_path = config_path or LOCAL_CONFIG_PATH
+        self.remote_backup = remote_backup or REMOTE_CONFIG_BACKUP
+        # 批量模式下每个配置档案的个人配置覆盖项（键为QX_*环境变量名）
+        self.env_overrides = env_overrides or {}
+        self.profile_name = profile_name
+        # 批量模式下多个配置档案共享的远程配置缓存：URL -> 获取结果
+        self.remote_cache = remote_cache
         self.config_sections = {}
         self.personal_config = {}
         self.force_update = False
+        self.remote_not_modified = False
+        self.remote_validators = {}
+        self.remote_hash = ""
+        # 下载时同步写入的远程配置备份临时文件，保存备份时提交，否则在运行结束时删除
+        self.staged_backup = None
+        # 本次运行的阶段耗时和计数器，每次 run() 重新创建
+        self.metrics = RunMetrics()
+        # 批量模式下预先获取远程配置时记录的指标，下一次 run() 时并入
+        self.prefetch_metrics = None
+        # section级的合并结果缓存和本次远程配置的section变化
+        self.section_cache = SectionCache(self.config_path + ".sections.json", self.logger) if SECTION_CACHE else None
+        # 整个配置的生成结果缓存，QX_GENERATION_CACHE_ENTRIES 为0时不启用
+        self.generation_cache = GenerationCache(GENERATION_CACHE_DIR, self.logger) if GENERATION_CACHE_ENTRIES > 0 else None
+        self.section_diff = {}
+
+    @property
+    def session(self) -> "requests.Session":
+        if self._session is None:
+            self._session = create_http_session()
+        return self._session
 
     def setup_logger(self):
-        """设置日志"""
+        """设置日志
+
+        日志记录只放入队列，由后台 QueueListener 写入按大小轮转的日志文件和控制台，
+        避免大量日志的I/O拖慢配置生成。
+        """
         import logging
+        import logging.handlers
 
-        # 确保日志目录存在
-        log_dir = os.path.dirname(LOG_FILE)
-        if log_dir and not os.path.exists(log_dir):
-            os.makedirs(log_dir, exist_ok=True)
+        class LogFileHandler(logging.handlers.RotatingFileHandler):
+            """第一次写入日志文件时才创建日志目录，启动时不访问文件系统"""
+
+            def _open(self):
+                log_dir = os.path.dirname(self.baseFilename)
+                if log_dir:
+                    os.makedirs(log_dir, exist_ok=True)
+                return super()._open()
 
         # 创建logger
         logger = logging.getLogger(__name__)
@@ -43,8 +2257,9 @@ class QuantumultXConfigGenerator:
 
         # 避免重复添加handler
         if not logger.handlers:
-            # 文件handler
-            file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
+            # 文件handler，超过 LOG_MAX_BYTES 后轮转
+            file_handler = LogFileHandler(
+                LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
             file_handler.setLevel(logging.INFO)
 
             # 控制台handler
@@ -56,102 +2271,23 @@ class QuantumultXConfigGenerator:
             file_handler.setFormatter(formatter)
             console_handler.setFormatter(formatter)
 
-            # 添加handler
-            logger.addHandler(file_handler)
-            logger.addHandler(console_handler)
+            # 通过队列交给后台线程输出，退出时写完剩余日志
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler)
+            listener.start()
+            atexit.register(listener.stop)
+            logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
         return logger
 
-    def send_ql_notification(self, title: str, content: str):
-        """使用青龙面板v2.19.2内置通知系统发送通知"""
-        try:
-            # 尝试导入青龙面板的notify模块
-            # 青龙v2.19.2的notify模块通常位于以下路径
-            notify_paths = [
-                '/ql/data/scripts/notify.py',
-                '/ql/scripts/notify.py',
-                '/ql/data/scripts/sendNotify.py',
-                '/ql/scripts/sendNotify.py'
-            ]
+    def log_item(self, message: str):
+        """逐项日志，仅在 QX_LOG_VERBOSITY=detail 时输出，默认只输出各section的汇总计数"""
+        if LOG_ITEMS:
+            self.logger.info(message)
 
-            for notify_path in notify_paths:
-                if os.path.exists(notify_path):
-                    try:
-                        self.logger.info(f"尝试从 {notify_path} 导入通知模块")
-
-                        # 动态导入模块
-                        import importlib.util
-                        spec = importlib.util.spec_from_file_location("notify_module", notify_path)
-                        notify_module = importlib.util.module_from_spec(spec)
-                        spec.loader.exec_module(notify_module)
-
-                        # 检查是否有send函数
-                        if hasattr(notify_module, 'send'):
-                            # 尝试发送通知
-                            notify_module.send(title, content)
-                            self.logger.info(f"青龙通知发送成功: {title}")
-                            return True
-                        elif hasattr(notify_module, 'send_notify'):
-                            # 有些版本使用send_notify
-                            notify_module.send_notify(title, content)
-                            self.logger.info(f"青龙通知发送成功: {title} (使用send_notify)")
-                            return True
-
-                    except Exception as e:
-                        self.logger.warning(f"从 {notify_path} 导入通知模块失败: {str(e)}")
-                        continue
-
-            # 如果找不到通知模块，尝试使用QL原生的通知方式
-            self.logger.info("尝试使用QL原生通知方式")
-
-            # 尝试导入ql包
-            try:
-                from qinglong import notify
-                notify(title, content)
-                self.logger.info(f"QL原生通知发送成功: {title}")
-                return True
-            except ImportError:
-                pass
-
-            # 尝试使用环境变量中的通知脚本
-            ql_notify_path = os.getenv('QL_NOTIFY_SCRIPT', '/ql/data/scripts/notify.py')
-            if os.path.exists(ql_notify_path):
-                try:
-                    # 执行通知脚本
-                    import subprocess
-                    result = subprocess.run(
-                        [sys.executable, ql_notify_path, title, content],
-                        capture_output=True,
-                        text=True,
-                        timeout=10
-                    )
-                    if result.returncode == 0:
-                        self.logger.info(f"通过脚本发送通知成功: {title}")
-                        return True
-                except Exception as e:
-                    self.logger.warning(f"执行通知脚本失败: {str(e)}")
-
-            # 如果所有方法都失败，使用控制台输出
-            self.logger.warning("无法找到青龙通知模块，将使用简单控制台输出")
-
-            # 控制台输出模拟通知
-            print(f"\n{'='*60}")
-            print(f"通知标题: {title}")
-            print(f"通知内容:")
-            print(content)
-            print(f"{'='*60}\n")
-            return True
-
-        except Exception as e:
-            self.logger.error(f"发送青龙通知失败: {str(e)}")
-
-            # 回退到简单输出
-            print(f"\n{'='*60}")
-            print(f"通知标题: {title}")
-            print(f"通知内容:")
-            print(content)
-            print(f"{'='*60}\n")
-            return False
+    def send_ql_notification(self, title: str, content: str):
+        """使用青龙面板v2.19.2内置通知系统发送通知（后台线程异步发送）"""
+        return self.notifier.submit(title, content)
 
     def send_notification(self, message: str, update_type: str = "info"):
         """发送通知"""
@@ -193,8 +2329,13 @@ class QuantumultXConfigGenerator:
             title = "ℹ️ QuantumultX配置生成器"
             content = message
 
+        if self.profile_name:
+            content = f"配置档案: {self.profile_name}\n{content}"
+
         # 发送通知
-        return self.send_ql_notification(title, content)
+        self.metrics.count("notifications")
+        with self.metrics.stage("notify"):
+            return self.send_ql_notification(title, content)
 
     def parse_env_var_value(self, value: str):
         """解析环境变量的值，支持JSON和文本格式"""
@@ -226,21 +2367,28 @@ class QuantumultXConfigGenerator:
             "filter_local": [],
             "rewrite_local": [],
             "custom_sections": {},
-            "global_replacements": []
+            "global_replacements": [],
+            "server_rules": {}
         }
 
         self.logger.info("开始从环境变量加载个人配置")
 
-        # 读取所有以QX_开头的环境变量
-        for key, value in os.environ.items():
+        # 读取所有以QX_开头的环境变量，批量模式下叠加配置档案的覆盖项
+        env = dict(os.environ)
+        env.update(self.env_overrides)
+
+        for key, value in env.items():
             if not key.startswith(ENV_VAR_PREFIX):
                 continue
 
             # 去掉前缀并转换为小写
             config_key = key[len(ENV_VAR_PREFIX):].lower()
 
-            # 解析值
-            parsed_value = self.parse_env_var_value(value)
+            # 解析值（清单中的覆盖项可以直接是JSON数组/对象）
+            if isinstance(value, str):
+                parsed_value = self.parse_env_var_value(value)
+            else:
+                parsed_value = value
             if parsed_value is None:
                 continue
 
@@ -274,7 +2422,7 @@ class QuantumultXConfigGenerator:
                     config["policies"].extend(parsed_value)
                 else:
                     config["policies"].append(parsed_value)
-                self.logger.info(f"添加策略组配置: {parsed_value}")
+                self.log_item(f"添加策略组配置: {parsed_value}")
             elif config_key == "dns":
                 if isinstance(parsed_value, list):
                     config["dns"].extend(parsed_value)
@@ -295,6 +2443,13 @@ class QuantumultXConfigGenerator:
                     config["rewrite_local"].extend(parsed_value)
                 else:
                     config["rewrite_local"].append(parsed_value)
+            elif config_key in ("server_filter", "server_exclude"):
+                # 节点名称筛选正则，JSON数组时按"或"合并
+                if isinstance(parsed_value, list):
+                    parsed_value = '|'.join(f"(?:{pattern})" for pattern in parsed_value)
+                config["server_rules"][config_key[len("server_"):]] = str(parsed_value)
+            elif config_key == "server_rename":
+                config["server_rules"]["rename"] = parsed_value if isinstance(parsed_value, list) else [parsed_value]
             elif config_key.startswith("section_"):
                 # 自定义section
                 section_name = config_key[8:]  # 去掉"section_"
@@ -317,53 +2472,496 @@ class QuantumultXConfigGenerator:
         """计算配置内容的哈希值"""
         return hashlib.md5(content.encode('utf-8')).hexdigest()
 
-    def get_remote_config(self) -> Optional[str]:
-        """获取远程配置"""
-        self.logger.info(f"开始获取远程配置: {REMOTE_CONFIG_URL}")
-
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/plain, */*'
+    def load_remote_config_meta(self) -> Dict:
+        """加载远程配置状态记录（哈希值、大小、ETag / Last-Modified 等获取信息）"""
+        meta_file = self.remote_backup + ".meta"
+        try:
+            if os.path.exists(meta_file):
+                with open(meta_file, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if isinstance(meta, dict):
+                    return meta
+        except Exception as e:
+            self.logger.warning(f"加载远程配置状态记录失败: {str(e)}")
+        return {}
+
+    def save_remote_config_meta(self, config_hash: str, size: int, validators: Optional[Dict] = None):
+        """保存远程配置状态记录，与备份文件放在一起
+
+        ETag / Last-Modified 只对提供备份内容的地址（source）有效，下次只向该地址发送条件请求。
+        """
+        meta_file = self.remote_backup + ".meta"
+        if validators is None:
+            validators = self.remote_validators
+        meta = {
+            "url": self.remote_url,
+            "source": validators.get("source") or self.remote_url,
+            "hash": config_hash,
+            "size": size,
+            "etag": validators.get("etag", ""),
+            "last_modified": validators.get("last_modified", ""),
+            "fetched_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         }
+        if self.mirror_stats:
+            meta["mirrors"] = self.mirror_stats
+        try:
+            write_file_atomic(meta_file, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            self.logger.warning(f"保存远程配置状态记录失败: {str(e)}")
+
+    def load_remote_config_hash(self) -> Optional[str]:
+        """获取上次远程配置备份的哈希值，优先使用状态记录，不读取备份内容"""
+        if not os.path.exists(self.remote_backup):
+            return None
+
+        # 状态记录中的大小与备份文件一致时直接使用记录的哈希值
+        meta = self.load_remote_config_meta()
+        if meta.get("hash") and meta.get("size") == os.path.getsize(self.remote_backup):
+            return meta["hash"]
+
+        # 兼容旧版本：只有.hash文件
+        hash_file = self.remote_backup + ".hash"
+        if not meta and os.path.exists(hash_file):
+            try:
+                with open(hash_file, 'r', encoding='utf-8') as f:
+                    config_hash = f.read().strip()
+                if config_hash:
+                    return config_hash
+            except Exception as e:
+                self.logger.warning(f"读取哈希文件失败: {str(e)}")
+
+        # 状态记录缺失或与备份不一致，回退到读取备份计算哈希
+        old_content = self.load_remote_config_backup()
+        if not old_content:
+            return None
+        return self.get_config_hash(old_content)
+
+    @staticmethod
+    def new_fetch_result(**values) -> Dict:
+        """远程配置获取结果：内容、是否未修改/与备份相同、缓存校验信息、正文哈希、
+        已写入临时文件的备份（staged）、下载字节数和各地址的响应延迟与错误"""
+        result = {"content": None, "not_modified": False, "identical": False, "validators": {},
+                  "hash": "", "staged": None, "bytes": 0, "latencies": {}, "errors": {}}
+        result.update(values)
+        return result
+
+    def check_unchanged_fast(self) -> bool:
+        """无需更新的快速路径：只用状态记录和一次条件请求判断，不导入requests，也不读取备份
 
+        只在冷启动的单配置运行中使用（非守护模式，没有镜像、资源缓存模式、节点订阅预处理、延迟探测和代理设置），
+        守护模式下每轮都用一次性连接反而无法复用keep-alive连接。服务器返回304且最终配置仍与输入指纹一致时返回True，其他情况交给完整流程处理。
+        """
+        if (self.force_update or self.long_running or self._session is not None or self.remote_cache is not None
+                or self.mirrors or self.resource_mode or self.server_pipeline or self.latency_probe):
+            return False
+        if any(key.lower() in ("http_proxy", "https_proxy", "all_proxy") for key in os.environ):
+            return False
+
+        meta = self.load_remote_config_meta()
+        if (meta.get("url") != self.remote_url or (meta.get("source") or self.remote_url) != self.remote_url
+                or not meta.get("hash") or not (meta.get("etag") or meta.get("last_modified"))):
+            return False
+        if not os.path.exists(self.remote_backup) or os.path.getsize(self.remote_backup) != meta.get("size"):
+            return False
+
+        self.remote_hash = meta["hash"]
+        if not self.check_if_output_current(self.get_input_fingerprint()):
+            self.remote_hash = ""
+            return False
+
+        headers = dict(REQUEST_HEADERS)
+        if meta.get("etag"):
+            headers['If-None-Match'] = meta["etag"]
+        if meta.get("last_modified"):
+            headers['If-Modified-Since'] = meta["last_modified"]
         try:
-            response = requests.get(REMOTE_CONFIG_URL, headers=headers, timeout=30)
-            response.raise_for_status()
+            with self.metrics.stage("fetch"):
+                status = conditional_request(self.remote_url, headers)
+        except Exception as e:
+            self.logger.info(f"快速检查失败，使用完整流程: {str(e)}")
+            return False
+        if status != 304:
+            return False
 
-            content = response.text
-            if not content.strip():
-                self.logger.error("获取的配置内容为空")
-                return None
+        self.remote_not_modified = True
+        self.metrics.count("remote_not_modified")
+        self.logger.info("远程配置未修改 (HTTP 304)，最终配置与输入指纹一致，跳过配置生成")
+        return True
+
+    def remote_candidates(self, meta: Dict) -> List[str]:
+        """远程配置地址和镜像，按记录的响应延迟从快到慢排序，没有记录的地址按配置顺序排在后面"""
+        urls = [self.remote_url] + self.mirrors
+        if len(urls) == 1:
+            return urls
+
+        stats = (meta.get("mirrors") if meta.get("url") == self.remote_url else None) or self.mirror_stats
+
+        def rank(item):
+            index, url = item
+            latency = stats.get(url, {}).get("latency_ms")
+            return (latency is None, latency or 0, index)
+
+        return [url for _, url in sorted(enumerate(urls), key=rank)]
+
+    def download_remote_config(self, meta: Dict) -> Dict:
+        """依次对冲请求远程配置地址和镜像，返回获取结果
+
+        只读取生成器的配置，不修改运行状态，可以在后台线程中执行。
+        """
+        result = self.new_fetch_result()
+
+        # 强制更新时总是完整下载；只有备份存在且URL未变时才向提供备份的地址发送条件请求
+        conditional = (not self.force_update and os.path.exists(self.remote_backup)
+                       and meta.get("url") == self.remote_url)
+        source = meta.get("source") or self.remote_url
+
+        candidates = []
+        for url in self.remote_candidates(meta):
+            headers = dict(REQUEST_HEADERS)
+            if conditional and url == source:
+                if meta.get("etag"):
+                    headers['If-None-Match'] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers['If-Modified-Since'] = meta["last_modified"]
+            candidates.append((url, headers))
+
+        url, response, latencies, errors = hedged_get(self.session, candidates, HEDGE_DELAY_MS / 1000)
+        result["latencies"], result["errors"] = latencies, errors
+        if response is None:
+            return result
+
+        with response:
+            if response.status_code == 304:
+                # 读完（空）正文后连接回到连接池，守护模式下一次检查可以复用
+                response.content
+                result["not_modified"] = True
+                result["validators"] = {"etag": meta.get("etag", ""),
+                                        "last_modified": meta.get("last_modified", ""), "source": url}
+                return result
+
+            known_hash = None if self.force_update else self.load_remote_config_hash()
+            try:
+                data, staged, result["hash"] = self.stream_remote_body(response)
+            except Exception as e:
+                result["errors"][url] = e
+                return result
+            result["validators"] = {
+                "etag": response.headers.get('ETag', ''),
+                "last_modified": response.headers.get('Last-Modified', ''),
+                "source": url,
+            }
+            encoding = response.encoding
+
+        result["bytes"] = len(data)
+        if result["hash"] == known_hash:
+            # 与备份内容相同，不需要解码，也不需要重写备份
+            staged.discard()
+            result["identical"] = True
+            return result
+
+        try:
+            result["content"] = data.decode('utf-8')
+            result["staged"] = staged
+        except UnicodeDecodeError:
+            # 非UTF-8内容按响应声明的编码解码，备份和哈希使用转换后的UTF-8内容
+            staged.discard()
+            result["content"] = data.decode(encoding or 'utf-8', errors='replace')
+            result["hash"] = self.get_config_hash(result["content"])
+        return result
+
+    def stream_remote_body(self, response) -> Tuple[bytearray, AtomicFile, str]:
+        """分块读取响应正文，同时计算哈希并写入备份的临时文件，超过 MAX_REMOTE_BYTES 时中止"""
+        content_length = response.headers.get('Content-Length', '')
+        if content_length.isdigit() and int(content_length) > MAX_REMOTE_BYTES:
+            raise ValueError(f"远程配置大小 {content_length} 字节超过上限 {MAX_REMOTE_BYTES} 字节")
+
+        data = bytearray()
+        digest = hashlib.md5()
+        staged = AtomicFile(self.remote_backup)
+        try:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                data += chunk
+                if len(data) > MAX_REMOTE_BYTES:
+                    raise ValueError(f"远程配置超过大小上限 {MAX_REMOTE_BYTES} 字节，已中止下载")
+                digest.update(chunk)
+                staged.write(chunk)
+        except BaseException:
+            staged.discard()
+            raise
+        return data, staged, digest.hexdigest()
+
+    def update_mirror_stats(self, result: Dict) -> bool:
+        """根据本次请求更新各地址的响应延迟和失败次数，有多个地址时返回True"""
+        if not self.mirrors:
+            return False
+        for url, latency in result["latencies"].items():
+            stats = self.mirror_stats.setdefault(url, {})
+            previous = stats.get("latency_ms")
+            stats["latency_ms"] = round(latency if previous is None else previous * 0.7 + latency * 0.3, 1)
+            stats["failures"] = 0
+        for url in result["errors"]:
+            stats = self.mirror_stats.setdefault(url, {})
+            stats["failures"] = stats.get("failures", 0) + 1
+            # 失败的地址按超时时间计算延迟，排到其他地址之后
+            stats["latency_ms"] = FETCH_TIMEOUT * 1000 * stats["failures"]
+        return True
+
+    def save_mirror_stats(self):
+        """只更新状态记录中的镜像统计，其余内容不变"""
+        meta = self.load_remote_config_meta()
+        if not meta:
+            return
+        meta["mirrors"] = self.mirror_stats
+        try:
+            write_file_atomic(self.remote_backup + ".meta", json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            self.logger.warning(f"保存镜像统计失败: {str(e)}")
+
+    def download_with_deadline(self, meta: Dict) -> Optional[Dict]:
+        """在后台线程中获取远程配置，最多等待 STALE_WHILE_REVALIDATE 秒
+
+        超时返回None，后台线程获取完成后自行保存新的备份，供下次运行使用。
+        后台线程是守护线程，本次运行结束时进程直接退出，不等待获取完成
+        （守护模式下进程常驻，获取会正常完成；定时运行时下次运行重新获取）。
+        """
+        lock = threading.Lock()
+        state = {"abandoned": False}
+        done = threading.Event()
+
+        def revalidate():
+            try:
+                result = self.download_remote_config(meta)
+            except Exception as e:
+                result = self.new_fetch_result(errors={self.remote_url: e})
+            with lock:
+                state["result"] = result
+                abandoned = state["abandoned"]
+            done.set()
+            if abandoned:
+                self.store_revalidated(result)
+
+        threading.Thread(target=revalidate, name="qx-revalidate", daemon=True).start()
+        done.wait(STALE_WHILE_REVALIDATE)
+        with lock:
+            if "result" in state:
+                return state["result"]
+            state["abandoned"] = True
+        return None
+
+    def store_revalidated(self, result: Dict):
+        """保存后台获取完成的远程配置，内容有变化时更新备份"""
+        self.update_mirror_stats(result)
+        if result["identical"]:
+            self.save_remote_config_meta(result["hash"], os.path.getsize(self.remote_backup), result["validators"])
+            return
+        content = result["content"]
+        if not content or not content.strip():
+            if result["staged"] is not None:
+                result["staged"].discard()
+            if result["errors"]:
+                self.logger.warning(f"后台获取远程配置失败: {self.format_fetch_errors(result)}")
+            return
+        self.save_remote_config_backup(content, result["hash"], result["validators"], result["staged"])
+        self.logger.info("后台获取到新的远程配置，下次运行时生成")
+
+    def format_fetch_errors(self, result: Dict) -> str:
+        return "; ".join(f"{url}: {str(error)}" for url, error in result["errors"].items())
+
+    def request_remote_config(self) -> Tuple[Dict, Optional[Dict], bool]:
+        """下载远程配置，返回 (状态记录, 获取结果, 是否允许使用已有备份)
+
+        获取结果为None表示 stale-while-revalidate 超时。只读取生成器的配置和状态记录，
+        不修改运行状态，批量模式下在后台线程中执行，结果由 get_remote_config 应用。
+        """
+        meta = self.load_remote_config_meta()
+        serve_stale = (STALE_WHILE_REVALIDATE > 0 and not self.force_update
+                       and os.path.exists(self.remote_backup))
+        try:
+            if serve_stale:
+                result = self.download_with_deadline(meta)
+            else:
+                result = self.download_remote_config(meta)
+        except Exception as e:
+            result = self.new_fetch_result(errors={self.remote_url: e})
+        return meta, result, serve_stale
+
+    def get_remote_config(self, fetched: Optional[Tuple[Dict, Optional[Dict], bool]] = None) -> Optional[str]:
+        """获取远程配置，有备份时发送条件请求，304表示远程配置未修改
+
+        配置了镜像时按响应延迟排序对冲请求；启用 stale-while-revalidate 时，
+        在限定时间内未获取到新内容则使用已有备份（视为未修改），后台继续获取。
+        fetched 为预先在后台线程中得到的 request_remote_config() 结果。
+        """
+        self.logger.info(f"开始获取远程配置: {self.remote_url}")
+        self.remote_not_modified = False
+        self.remote_validators = {}
+
+        meta, result, serve_stale = fetched or self.request_remote_config()
+        if meta.get("url") == self.remote_url:
+            self.mirror_stats = meta.get("mirrors", {}) or self.mirror_stats
+
+        if result is None:
+            self.logger.warning(f"{STALE_WHILE_REVALIDATE:g} 秒内未获取到远程配置，使用已有备份，后台继续获取")
+            self.metrics.count("remote_served_stale")
+            self.remote_not_modified = True
+            return None
+
+        if self.update_mirror_stats(result):
+            self.save_mirror_stats()
+            latencies = ", ".join(f"{url} {latency:.0f}ms" for url, latency in result["latencies"].items())
+            self.logger.info(f"远程配置地址响应: {latencies or '无'}")
+        self.metrics.count("remote_mirror_failures", len(result["errors"]))
+        self.metrics.count("remote_bytes_fetched", result["bytes"])
+        self.remote_validators = result["validators"]
+
+        if result["not_modified"]:
+            self.remote_not_modified = True
+            self.metrics.count("remote_not_modified")
+            self.logger.info("远程配置未修改 (HTTP 304)，无需下载")
+            return None
+
+        if result["identical"]:
+            # 服务器不支持条件请求，但下载内容的哈希与备份相同，按未修改处理并更新缓存校验信息
+            self.remote_not_modified = True
+            self.remote_hash = result["hash"]
+            self.metrics.count("remote_identical")
+            self.save_remote_config_meta(result["hash"], os.path.getsize(self.remote_backup))
+            self.logger.info(f"远程配置与备份相同 (哈希值: {result['hash'][:12]}...)，无需解码")
+            return None
+
+        content = result["content"]
+        if content is None:
+            self.logger.error(f"获取远程配置失败: {self.format_fetch_errors(result)}")
+            if serve_stale:
+                self.logger.warning("使用已有的远程配置备份（stale-while-revalidate）")
+                self.metrics.count("remote_served_stale")
+                self.remote_not_modified = True
+            return None
 
-            self.logger.info(f"成功获取远程配置，大小: {len(content)} 字节")
+        if not content.strip():
+            if result["staged"] is not None:
+                result["staged"].discard()
+            self.logger.error("获取的配置内容为空")
+            return None
+
+        # 正文的哈希在下载时已计算，备份已写入临时文件，保存备份时直接重命名
+        self.remote_hash = result["hash"]
+        self.staged_backup = result["staged"]
+        if self.remote_validators.get("source") != self.remote_url:
+            self.logger.info(f"使用镜像地址: {self.remote_validators.get('source')}")
+        self.logger.info(f"成功获取远程配置，大小: {len(content)} 字节")
+        return content
+
+    def fetch_remote_config(self, fetched: Optional[Tuple[Dict, Optional[Dict], bool]] = None) -> Optional[str]:
+        """获取远程配置，批量模式下同一URL只下载一次，结果在各配置档案间共享"""
+        self.remote_hash = ""
+
+        if self.remote_cache is None:
+            return self.get_remote_config(fetched)
+
+        entry = self.remote_cache.get(self.remote_url)
+        if entry is None:
+            content = self.get_remote_config(fetched)
+            entry = {
+                "content": content,
+                "not_modified": self.remote_not_modified,
+                "validators": dict(self.remote_validators),
+                "backup": self.remote_backup,
+                "hash": "",
+                "sections": None,
+            }
+            if self.remote_not_modified:
+                entry["hash"] = self.load_remote_config_hash() or ""
+            elif content:
+                entry["hash"] = self.remote_hash or self.get_config_hash(content)
+            self.remote_cache[self.remote_url] = entry
+            self.remote_hash = entry["hash"]
             return content
 
-        except requests.RequestException as e:
-            self.logger.error(f"获取远程配置失败: {str(e)}")
+        self.logger.info(f"使用批量模式共享的远程配置: {self.remote_url}")
+        self.remote_not_modified = False
+        self.remote_validators = dict(entry["validators"])
+        self.remote_hash = entry["hash"]
+
+        if entry["content"]:
+            return entry["content"]
+
+        if not entry["not_modified"]:
+            # 该URL已获取失败，不再重复请求
             return None
+
+        # 首个配置档案得到304：本档案记录的哈希相同则同样视为未修改
+        if entry["hash"] and self.load_remote_config_hash() == entry["hash"]:
+            self.remote_not_modified = True
+            return None
+
+        # 否则从首个配置档案的备份中读取内容（304说明其备份即为最新内容）
+        try:
+            with open(entry["backup"], 'r', encoding='utf-8') as f:
+                content = f.read()
+            entry["content"] = content
+            self.remote_validators = self.load_shared_validators(entry["backup"])
+            entry["validators"] = dict(self.remote_validators)
+            self.logger.info(f"从共享备份读取远程配置: {entry['backup']}")
+            return content
         except Exception as e:
-            self.logger.error(f"处理远程配置时出错: {str(e)}")
+            self.logger.error(f"读取共享远程配置备份失败: {str(e)}")
             return None
 
-    def save_remote_config_backup(self, content: str):
-        """保存远程配置备份"""
+    def load_shared_validators(self, backup_path: str) -> Dict:
+        """读取其他配置档案备份的缓存校验信息"""
         try:
-            # 确保目录存在
-            backup_dir = os.path.dirname(REMOTE_CONFIG_BACKUP)
-            if backup_dir and not os.path.exists(backup_dir):
-                os.makedirs(backup_dir, exist_ok=True)
+            with open(backup_path + ".meta", 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            return {"etag": meta.get("etag", ""), "last_modified": meta.get("last_modified", ""),
+                    "source": meta.get("source", "")}
+        except Exception:
+            return {}
+
+    def get_config_sections(self, config_content: str) -> ConfigIndex:
+        """解析配置sections，批量模式下同一URL只解析一次，守护模式下内容未变化时复用上次结果"""
+        if self.remote_memo and self.remote_hash and self.remote_memo["hash"] == self.remote_hash:
+            self.logger.info("使用内存中上次的section解析结果")
+            return self.remote_memo["sections"]
+
+        entry = self.remote_cache.get(self.remote_url) if self.remote_cache is not None else None
+        if entry is None or not entry["hash"] or entry["hash"] != self.remote_hash:
+            sections = self.parse_config_sections(config_content)
+        elif entry["sections"] is None:
+            sections = entry["sections"] = self.parse_config_sections(config_content)
+        else:
+            self.logger.info("使用批量模式共享的section解析结果")
+            sections = entry["sections"]
+
+        if self.remote_hash:
+            self.remote_memo = {"hash": self.remote_hash, "content": config_content, "sections": sections}
+        return sections
 
+    def load_remote_config_cached(self) -> Optional[str]:
+        """加载当前远程哈希对应的内容，优先使用内存中上次的内容，否则读取备份"""
+        if self.remote_memo and self.remote_hash and self.remote_memo["hash"] == self.remote_hash:
+            return self.remote_memo["content"]
+        return self.load_remote_config_backup()
+
+    def save_remote_config_backup(self, content: str, config_hash: Optional[str] = None,
+                                  validators: Optional[Dict] = None, staged: Optional[AtomicFile] = None):
+        """保存远程配置备份，下载时已写入临时文件（staged）的直接提交，不再重新编码"""
+        try:
             # 保存备份
-            with open(REMOTE_CONFIG_BACKUP, 'w', encoding='utf-8') as f:
-                f.write(content)
+            if staged is not None:
+                staged.commit()
+            else:
+                write_file_atomic(self.remote_backup, content.encode('utf-8'))
 
             # 保存哈希值
-            config_hash = self.get_config_hash(content)
-            hash_file = REMOTE_CONFIG_BACKUP + ".hash"
-            with open(hash_file, 'w', encoding='utf-8') as f:
-                f.write(config_hash)
+            if not config_hash:
+                config_hash = self.get_config_hash(content)
+            write_file_atomic(self.remote_backup + ".hash", config_hash.encode('utf-8'))
 
-            self.logger.info(f"远程配置备份已保存: {REMOTE_CONFIG_BACKUP}")
+            # 保存状态记录，供下次更新检查和条件请求使用
+            self.save_remote_config_meta(config_hash, os.path.getsize(self.remote_backup), validators)
+
+            self.logger.info(f"远程配置备份已保存: {self.remote_backup}")
             self.logger.info(f"配置哈希值: {config_hash[:12]}...")
 
         except Exception as e:
@@ -372,8 +2970,8 @@ class QuantumultXConfigGenerator:
     def load_remote_config_backup(self) -> Optional[str]:
         """加载远程配置备份"""
         try:
-            if os.path.exists(REMOTE_CONFIG_BACKUP):
-                with open(REMOTE_CONFIG_BACKUP, 'r', encoding='utf-8') as f:
+            if os.path.exists(self.remote_backup):
+                with open(self.remote_backup, 'r', encoding='utf-8') as f:
                     content = f.read()
                 self.logger.info(f"加载远程配置备份，大小: {len(content)} 字节")
                 return content
@@ -386,17 +2984,18 @@ class QuantumultXConfigGenerator:
 
     def check_if_remote_updated(self, new_content: str) -> bool:
         """检查远程配置是否有更新"""
-        # 加载旧备份
-        old_content = self.load_remote_config_backup()
+        if not self.remote_hash:
+            self.remote_hash = self.get_config_hash(new_content)
 
-        if not old_content:
+        # 从状态记录获取旧哈希值，无需读取旧备份
+        old_hash = self.load_remote_config_hash()
+
+        if not old_hash:
             # 如果没有旧备份，说明是第一次运行
             self.logger.info("首次运行，无旧配置可比较")
             return True
 
-        # 计算新旧内容的哈希值
-        old_hash = self.get_config_hash(old_content)
-        new_hash = self.get_config_hash(new_content)
+        new_hash = self.remote_hash
 
         if old_hash == new_hash:
             self.logger.info(f"远程配置无变化 (哈希值相同: {old_hash[:12]}...)")
@@ -405,38 +3004,413 @@ class QuantumultXConfigGenerator:
             self.logger.info(f"远程配置有更新: {old_hash[:12]}... -> {new_hash[:12]}...")
             return True
 
-    def parse_config_sections(self, config_content: str) -> Dict[str, str]:
-        """解析配置文件的各个部分，不包含header"""
-        sections = {}
-        current_section = None
-        content_lines = []
+    def get_input_fingerprint(self) -> str:
+        """计算生成输入的综合指纹：远程配置哈希 + 个人配置哈希 + 生成器版本"""
+        personal_json = json.dumps(self.personal_config, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        personal_hash = self.get_config_hash(personal_json)
+        fingerprint_parts = [GENERATOR_VERSION, self.remote_url, self.remote_hash, personal_hash,
+                             f"filter_optimize={FILTER_OPTIMIZE}"]
+        if self.resource_hashes:
+            # 资源缓存模式下引用资源的内容也会影响生成结果
+            fingerprint_parts.append(self.resource_mode + RESOURCE_MIRROR_URL)
+            fingerprint_parts.append(json.dumps(self.resource_hashes, sort_keys=True))
+        if self.server_hashes:
+            fingerprint_parts.append(self.server_pipeline + RESOURCE_MIRROR_URL)
+            fingerprint_parts.append(json.dumps(self.server_hashes, sort_keys=True))
+        if self.node_latency:
+            # 只有延迟区间计入指纹，区间带滞后，延迟小幅波动不会触发重新生成
+            fingerprint_parts.append(self.latency_probe + ','.join(PROBE_GROUP_TYPES) + str(PROBE_MAX_LATENCY_MS))
+            fingerprint_parts.append(json.dumps(self.node_buckets, sort_keys=True, ensure_ascii=False))
+        return self.get_config_hash('\n'.join(fingerprint_parts))
+
+    def generation_cache_key(self, fingerprint: str) -> str:
+        """生成结果缓存的输入键：输入指纹（远程配置哈希、规范化的个人配置哈希等）和影响输出的生成选项"""
+        return self.get_config_hash('\n'.join([fingerprint, str(FILTER_OPTIMIZE), str(self.force_update)]))
+
+    def refresh_generation_time(self, config_content: str) -> str:
+        """把缓存的配置文件头中的生成时间更新为当前时间"""
+        return re.sub(r'^# 生成时间: .*$', f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                      config_content[:512], count=1, flags=re.M) + config_content[512:]
+
+    def load_output_meta(self) -> Dict:
+        """加载最终配置文件的生成记录"""
+        meta_file = self.config_path + ".meta"
+        try:
+            if os.path.exists(meta_file):
+                with open(meta_file, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if isinstance(meta, dict):
+                    return meta
+        except Exception as e:
+            self.logger.warning(f"加载配置生成记录失败: {str(e)}")
+        return {}
+
+    def save_output_meta(self, fingerprint: str, output_hash: str):
+        """保存最终配置文件的生成记录（输入指纹、输出哈希、大小、修改时间）"""
+        meta_file = self.config_path + ".meta"
+        try:
+            stat = os.stat(self.config_path)
+            meta = {
+                "version": GENERATOR_VERSION,
+                "fingerprint": fingerprint,
+                "hash": output_hash,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "generated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            if self.node_buckets:
+                meta["latency_buckets"] = self.node_buckets
+            write_file_atomic(meta_file, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        except Exception as e:
+            self.logger.warning(f"保存配置生成记录失败: {str(e)}")
+
+    def check_if_output_current(self, fingerprint: str) -> bool:
+        """检查输入指纹是否未变化，且磁盘上的最终配置仍与记录的哈希一致"""
+        meta = self.load_output_meta()
+
+        if meta.get("fingerprint") != fingerprint:
+            if meta:
+                self.logger.info("个人配置、远程配置或生成器版本有变化，需要重新生成配置")
+            else:
+                self.logger.info("没有配置生成记录，需要重新生成配置")
+            return False
+
+        if not os.path.exists(self.config_path):
+            self.logger.info("最终配置文件不存在，需要重新生成配置")
+            return False
+
+        stat = os.stat(self.config_path)
+        if stat.st_size != meta.get("size"):
+            self.logger.info("最终配置文件大小与记录不一致，需要重新生成配置")
+            return False
+
+        # 修改时间未变时直接信任记录的哈希，否则重新计算文件哈希
+        if stat.st_mtime_ns != meta.get("mtime_ns"):
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                output_hash = self.get_config_hash(f.read())
+            if output_hash != meta.get("hash"):
+                self.logger.info("最终配置文件已被修改，需要重新生成配置")
+                return False
 
-        lines = config_content.split('\n')
+        return True
+
+    def parse_resource_entry(self, line: str) -> Tuple[str, Dict[str, str]]:
+        """解析 filter_remote / rewrite_remote 条目，返回 (URL, 参数)"""
+        parts = [part.strip() for part in line.split(',')]
+        options = {}
+        for part in parts[1:]:
+            if '=' in part:
+                key, value = part.split('=', 1)
+                options[key.strip().lower()] = value.strip()
+        return parts[0], options
+
+    def collect_resource_urls(self, sections: Mapping, section_name: str) -> List[str]:
+        """收集远程配置和个人配置中某个section引用的资源URL（跳过禁用的条目）"""
+        urls = []
+        lines = sections.get(section_name, "").split('\n')
+        lines += [item for item in self.personal_config.get(section_name, []) if isinstance(item, str)]
         for line in lines:
-            # 检测新的section
-            section_match = re.match(r'^\[([^\]]+)\]$', line.strip())
-            if section_match:
-                # 保存上一个section的内容
-                if current_section is not None:
-                    sections[current_section] = '\n'.join(content_lines).strip()
-                # 开始新的section
-                current_section = section_match.group(1)
-                content_lines = []
+            line = line.strip()
+            if not line or line.startswith(('#', ';')):
+                continue
+            url, options = self.parse_resource_entry(line)
+            if url.startswith(('http://', 'https://')) and options.get('enabled', 'true') != 'false':
+                if section_name != "server_remote" or options.get('opt-parser', 'false') != 'true':
+                    urls.append(url)
+        return urls
+
+    def refresh_remote_resources(self, sections: Mapping):
+        """收集并验证 filter_remote / rewrite_remote 引用的资源，以及需要预处理的节点订阅"""
+        urls = []
+        if self.resource_mode:
+            for section_name in ("filter_remote", "rewrite_remote"):
+                urls += self.collect_resource_urls(sections, section_name)
+        # 需要解析器转换的订阅（opt-parser=true）保持原样，交给客户端处理
+        server_urls = self.collect_resource_urls(sections, "server_remote") if self.server_pipeline else []
+
+        if self.resource_cache is None:
+            self.resource_cache = RemoteResourceCache(RESOURCE_CACHE_DIR, self.session, self.logger)
+        bytes_before = self.resource_cache.bytes_fetched
+        hashes = self.resource_cache.refresh(urls + server_urls)
+        self.resource_hashes = {url: hashes[url] for url in urls if url in hashes}
+        self.server_hashes = {url: hashes[url] for url in server_urls if url in hashes}
+        self.server_results = None
+        self.metrics.count("resources_referenced", len(set(urls + server_urls)))
+        self.metrics.count("resource_bytes_fetched", self.resource_cache.bytes_fetched - bytes_before)
+
+    def convert_filter_rules(self, content: str, options: Dict[str, str]) -> List[str]:
+        """将 filter_remote 资源内容转换为 filter_local 规则"""
+        force_policy = options.get('force-policy', '')
+        policy = force_policy or options.get('tag', '')
+        rules = []
+        for line in content.splitlines():
+            line = line.strip()
+            if not line or line.startswith(('#', ';', '//')):
+                continue
+            fields = [field.strip() for field in line.split(',')]
+            if len(fields) < 2 or fields[0].lower() == 'final':
                 continue
+            if len(fields) == 2 or fields[2].lower() == 'no-resolve':
+                fields.insert(2, policy)
+            elif force_policy:
+                fields[2] = force_policy
+            rules.append(', '.join(fields))
+        return rules
+
+    def localize_remote_resources(self, section: ConfigSection, section_type: str):
+        """将缓存资源的条目改写为本地镜像地址，inline模式下内联 filter_remote"""
+        if not self.resource_hashes:
+            return
 
-            # 处理当前section的内容
-            if current_section is not None:
-                content_lines.append(line)
+        lines = []
+        mirrored_count = 0
+        inlined_count = 0
+        for line in section.lines:
+            if line.kind != "item":
+                lines.append(line.text)
+                continue
 
-        # 保存最后一个section
-        if current_section is not None and content_lines:
-            sections[current_section] = '\n'.join(content_lines).strip()
+            url, options = self.parse_resource_entry(line.text.strip())
+            content_hash = self.resource_hashes.get(url)
+            if not content_hash or options.get('enabled', 'true') == 'false':
+                lines.append(line.text)
+                continue
+
+            if (self.resource_mode == "inline" and section_type == "filter_remote"
+                    and options.get('opt-parser', 'false') != 'true'):
+                rules = self.convert_filter_rules(self.resource_cache.read_text(content_hash), options)
+                self.inline_filter_rules.extend(rules)
+                inlined_count += 1
+                self.logger.info(f"内联 filter_remote 资源: {options.get('tag', url)} ({len(rules)}条规则)")
+            elif RESOURCE_MIRROR_URL:
+                lines.append(line.text.replace(url, self.resource_cache.mirror_url(content_hash), 1))
+                mirrored_count += 1
+            else:
+                lines.append(line.text)
+
+        if mirrored_count or inlined_count:
+            section.replace_all(lines)
+        self.logger.info(f"{section_type} 资源处理完成: {mirrored_count}个改写为镜像, {inlined_count}个内联")
+
+    def insert_inline_filter_rules(self, section: ConfigSection):
+        """将内联的远程规则插入 filter_local 的 final 规则之前"""
+        if not self.inline_filter_rules:
+            return
+
+        insert_at = len(section.lines)
+        for i, line in enumerate(section.lines):
+            if line.kind == "item" and line.text.strip().lower().startswith('final'):
+                insert_at = i
+                break
+
+        section.insert(insert_at, self.inline_filter_rules)
+        self.logger.info(f"向 filter_local 内联了 {len(self.inline_filter_rules)} 条远程规则")
+
+    def process_server_subscriptions(self) -> Dict[str, Dict]:
+        """预处理已获取的节点订阅，返回 URL -> 处理结果（每次生成只处理一次）"""
+        if self.server_results is not None:
+            return self.server_results
+
+        self.server_results = {}
+        if not self.server_hashes:
+            return self.server_results
+
+        pipeline = ServerNodePipeline(RESOURCE_CACHE_DIR, self.personal_config.get("server_rules", {}), self.logger)
+        totals = {"parsed": 0, "unsupported": 0, "filtered": 0, "duplicate": 0, "count": 0}
+        for url, content_hash in self.server_hashes.items():
+            try:
+                result = pipeline.process(content_hash, self.resource_cache.read_text)
+            except Exception as e:
+                self.logger.warning(f"节点订阅处理失败，保留原订阅: {url}: {str(e)}")
+                continue
+            for key in totals:
+                totals[key] += result.get(key, 0)
+            if not result["count"]:
+                # 格式不支持（例如需要 opt-parser 的 ss:// 列表）或全部被筛除时不内联也不改写，避免丢失节点
+                self.logger.warning(f"节点订阅没有可输出的节点（解析{result['parsed']}个，无法识别{result['unsupported']}行，"
+                                    f"筛除{result['filtered']}个），保留原订阅: {url}")
+                continue
+            self.server_results[url] = result
+            self.log_item(f"节点订阅 {url}: {result['parsed']}个节点，输出{result['count']}个")
+        pipeline.save()
+        self.server_node_pipeline = pipeline
+
+        for key, value in totals.items():
+            self.metrics.count(f"server_nodes_{'output' if key == 'count' else key}", value)
+        self.logger.info(f"节点订阅预处理完成: {len(self.server_results)}个订阅，解析{totals['parsed']}个节点，"
+                         f"筛除{totals['filtered']}个，去重{totals['duplicate']}个，输出{totals['count']}个")
+        return self.server_results
+
+    def insert_inline_server_nodes(self, section: ConfigSection):
+        """inline模式下把预处理后的订阅节点追加到 [server_local]，与已有节点按地址去重"""
+        if self.server_pipeline != "inline" or not self.process_server_subscriptions():
+            return
+
+        seen = set()
+        tags = set()
+        for line in section.lines:
+            node = ServerNodePipeline.parse_node(line.text) if line.kind == "item" else None
+            if node is not None:
+                seen.add(node.endpoint)
+                tags.add(node.tag)
+
+        added_count = duplicate_count = 0
+        for result in self.server_results.values():
+            # 订阅之间以及与已有节点的重复在这里去除，筛选和重命名已在预处理时完成
+            nodes = self.server_node_pipeline.read_nodes(result)
+            unique_nodes = ServerNodePipeline.dedupe(nodes, seen, tags)
+            for node in unique_nodes:
+                section.append(node.to_line())
+            added_count += len(unique_nodes)
+            duplicate_count += len(nodes) - len(unique_nodes)
+
+        self.metrics.count("server_nodes_inlined", added_count)
+        self.logger.info(f"向 server_local 内联了 {added_count} 个订阅节点，跳过 {duplicate_count} 个重复节点")
+
+    def localize_server_subscriptions(self, section: ConfigSection):
+        """已预处理的订阅：mirror模式改写为节点列表的镜像地址，inline模式从 [server_remote] 移除"""
+        results = self.process_server_subscriptions()
+        if not results:
+            return
+
+        lines = []
+        changed_count = 0
+        for line in section.lines:
+            if line.kind != "item":
+                lines.append(line.text)
+                continue
+            url, options = self.parse_resource_entry(line.text.strip())
+            result = results.get(url)
+            if result is None or options.get('enabled', 'true') == 'false' \
+                    or options.get('opt-parser', 'false') == 'true':
+                lines.append(line.text)
+                continue
+            changed_count += 1
+            if self.server_pipeline == "mirror":
+                lines.append(line.text.replace(url, ServerNodePipeline.mirror_url(result["hash"]), 1))
+
+        if changed_count:
+            section.replace_all(lines)
+        action = "改写为镜像" if self.server_pipeline == "mirror" else "内联到 server_local"
+        self.logger.info(f"server_remote 订阅处理完成: {changed_count}个{action}")
+
+    def probe_node_latency(self, sections: Mapping):
+        """探测 [server_local] 和已预处理的订阅中各节点的TCP连接延迟"""
+        endpoints = {}
+        for line in sections.get("server_local", "").split('\n'):
+            node = ServerNodePipeline.parse_node(line)
+            if node is not None:
+                endpoints.setdefault(node.tag, node)
+        # 只有启用节点订阅预处理时才知道订阅中的节点
+        for result in self.process_server_subscriptions().values():
+            for node in self.server_node_pipeline.read_nodes(result):
+                endpoints.setdefault(node.tag, node)
+
+        self.node_latency = {}
+        self.node_buckets = {}
+        if not endpoints:
+            self.logger.info("没有可以探测延迟的节点")
+            return
+
+        prober = LatencyProber(os.path.join(RESOURCE_CACHE_DIR, "latency.json"), self.logger)
+        latencies = prober.probe([(node.host.strip('[]'), int(node.port)) for node in endpoints.values()])
+        for tag, node in endpoints.items():
+            endpoint = (node.host.strip('[]'), int(node.port))
+            if endpoint in latencies:
+                self.node_latency[tag] = latencies[endpoint]
+
+        self.node_buckets = self.latency_buckets(self.load_output_meta().get("latency_buckets"))
+
+        unreachable_count = sum(1 for latency in self.node_latency.values() if latency is None)
+        self.metrics.count("nodes_probed", prober.probed_count)
+        self.metrics.count("nodes_probe_cached", len(endpoints) - prober.probed_count)
+        self.metrics.count("nodes_unreachable", unreachable_count)
+        self.logger.info(f"节点延迟探测完成: {len(self.node_latency)}/{len(endpoints)}个节点有结果，"
+                         f"{unreachable_count}个不可达")
+
+    def latency_buckets(self, previous: Optional[Dict] = None) -> Dict[str, Optional[int]]:
+        """节点延迟所在的区间（QX_PROBE_BUCKET_MS），同一区间内的节点保持原有顺序
+
+        previous 为上次生成配置时使用的区间：延迟超出原区间的边界不到 QX_PROBE_HYSTERESIS 个区间宽度时
+        仍使用原区间。可达和不可达之间的变化总是生效。
+        """
+        bucket_ms = max(PROBE_BUCKET_MS, 1)
+        margin = bucket_ms * max(PROBE_HYSTERESIS, 0)
+        previous = previous if isinstance(previous, dict) else {}
+        buckets = {}
+        for tag, latency in self.node_latency.items():
+            if latency is None:
+                buckets[tag] = None
+                continue
+            bucket = int(latency // bucket_ms)
+            last = previous.get(tag)
+            if (isinstance(last, int) and last != bucket
+                    and last * bucket_ms - margin <= latency < (last + 1) * bucket_ms + margin):
+                bucket = last
+            buckets[tag] = bucket
+        return buckets
+
+    def pruned_over_latency(self) -> List[str]:
+        """prune模式下延迟超过 QX_PROBE_MAX_LATENCY_MS 的节点（按实际延迟判断，不使用区间）"""
+        if self.latency_probe != "prune" or not PROBE_MAX_LATENCY_MS:
+            return []
+        return sorted(tag for tag, latency in self.node_latency.items()
+                      if latency is not None and latency > PROBE_MAX_LATENCY_MS)
+
+    def apply_latency_order(self, section: ConfigSection):
+        """按探测到的延迟重排策略组中的节点，prune模式下移除不可达或延迟超过上限的节点
+
+        只处理 QX_PROBE_GROUPS 中的策略组类型；非节点成员（内置策略、其他策略组）和结果未知的节点
+        位置不变，不可达的节点排在最后，策略组中的节点不会被全部移除。
+        """
+        if not self.latency_probe or not self.node_latency:
+            return
+
+        buckets = self.node_buckets or self.latency_buckets()
+        reordered_count = pruned_count = 0
+        for line in section.lines:
+            if line.kind != "item":
+                continue
+            group = PolicyIndex.parse_group(line.text)
+            if group is None or group["type"] not in PROBE_GROUP_TYPES:
+                continue
+
+            members = group["members"]
+            node_members = [member for member in members if member in self.node_latency]
+            if not node_members:
+                continue
+
+            if self.latency_probe == "prune":
+                kept = [member for member in node_members if self.node_latency[member] is not None and
+                        (not PROBE_MAX_LATENCY_MS or self.node_latency[member] <= PROBE_MAX_LATENCY_MS)]
+                if kept and len(kept) < len(node_members):
+                    pruned = set(node_members) - set(kept)
+                    members = [member for member in members if member not in pruned]
+                    pruned_count += len(pruned)
+                    node_members = kept
+
+            # 节点按延迟区间排序，同一区间内保持原有顺序，不可达的节点排在最后
+            ordered = iter(sorted(node_members, key=lambda member: (buckets[member] is None, buckets[member] or 0)))
+            node_set = set(node_members)
+            members = [next(ordered) if member in node_set else member for member in members]
+            if members != group["members"]:
+                group["members"] = members
+                section.set_line(line, PolicyIndex.format_group(group))
+                reordered_count += 1
+
+        self.metrics.count("policy_groups_reordered", reordered_count)
+        self.metrics.count("policy_members_pruned", pruned_count)
+        self.logger.info(f"按节点延迟调整了 {reordered_count} 个策略组，移除 {pruned_count} 个节点")
+
+    def parse_config_sections(self, config_content: str) -> ConfigIndex:
+        """解析配置文件的各个部分，不包含header"""
+        sections = ConfigIndex(config_content)
 
         self.logger.info(f"解析到以下section: {list(sections.keys())}")
 
         return sections
 
-    def update_mitm_section(self, mitm_content: str) -> str:
+    def update_mitm_section(self, mitm: ConfigSection):
         """更新MITM部分"""
         passphrase = self.personal_config.get("mitm", {}).get("passphrase", "")
         p12 = self.personal_config.get("mitm", {}).get("p12", "")
@@ -452,175 +3426,130 @@ class QuantumultXConfigGenerator:
 
         if not passphrase or not p12:
             self.logger.warning("MITM证书信息不完整，跳过更新")
-            return mitm_content
+            return
 
         self.logger.info(f"更新MITM证书，passphrase长度: {len(passphrase)}, p12长度: {len(p12)}")
 
-        # 检查是否已存在证书配置
-        has_passphrase = re.search(r'^passphrase\s*=', mitm_content, re.MULTILINE)
-        has_p12 = re.search(r'^p12\s*=', mitm_content, re.MULTILINE)
-
-        if has_passphrase and has_p12:
-            # 替换现有证书
-            lines = mitm_content.split('\n')
-            updated_lines = []
+        # 替换现有证书，缺少的证书配置稍后添加
+        missing_lines = []
+        for key, value in (("passphrase", passphrase), ("p12", p12)):
+            existing_lines = mitm.key_lines(key)
+            if existing_lines:
+                for line in existing_lines:
+                    mitm.set_line(line, f'{key} = {value}')
+            else:
+                missing_lines.append(f'{key} = {value}')
 
-            for line in lines:
-                if line.strip().startswith('passphrase ='):
-                    updated_lines.append(f'passphrase = {passphrase}')
-                elif line.strip().startswith('p12 ='):
-                    updated_lines.append(f'p12 = {p12}')
-                else:
-                    updated_lines.append(line)
+        if not missing_lines:
+            return
 
-            return '\n'.join(updated_lines)
+        # 在hostname行后添加证书，如果没有找到hostname，添加到末尾
+        hostname_lines = mitm.key_lines("hostname")
+        if hostname_lines:
+            mitm.insert(mitm.position(hostname_lines[0]) + 1, missing_lines)
         else:
-            # 添加证书配置
-            # 查找hostname行的位置
-            lines = mitm_content.split('\n')
-            result_lines = []
-
-            for i, line in enumerate(lines):
-                result_lines.append(line)
-                # 在hostname行后添加证书
-                if line.strip().startswith('hostname ='):
-                    if not has_passphrase:
-                        result_lines.append(f'passphrase = {passphrase}')
-                    if not has_p12:
-                        result_lines.append(f'p12 = {p12}')
-
-            # 如果没有找到hostname，添加到末尾
-            if not any('hostname =' in line for line in result_lines):
-                result_lines.append(f'passphrase = {passphrase}')
-                result_lines.append(f'p12 = {p12}')
-
-            return '\n'.join(result_lines)
-
-    def add_personal_policies_smart(self, policy_content: str) -> str:
-        """智能添加个人策略组，确保static策略添加到static部分开始位置"""
+            for line in missing_lines:
+                mitm.append(line)
+
+    def server_tags(self, section: ConfigSection) -> set:
+        """[server_local] 中节点的tag，用于检查策略组成员是否已定义"""
+        tags = set()
+        for line in section.lines:
+            if line.kind != "item":
+                continue
+            match = re.search(r'(?:^|,)\s*tag\s*=\s*([^,]+)', line.text)
+            if match:
+                tags.add(match.group(1).strip())
+        return tags
+
+    def add_personal_policies_smart(self, policy_section: ConfigSection, known_nodes: Optional[set] = None):
+        """通过策略组索引合并个人策略组
+
+        个人策略组可以是字符串（名称不存在时插入，static默认插入到static部分开始位置，
+        其他类型默认插入到同类型策略组末尾），也可以是包含 policy / mode / position 的对象，
+        mode 为 insert、replace 或 merge，position 为 start、end、before:名称 或 after:名称。
+        """
         personal_policies = self.personal_config.get("policies", [])
 
         if not personal_policies:
             self.logger.info("没有个人策略组需要添加")
-            return policy_content
+            return
 
         self.logger.info(f"开始添加个人策略组，共 {len(personal_policies)} 个")
 
-        # 分割policy部分内容
-        lines = policy_content.split('\n')
-
-        # 查找各个部分的位置
-        static_section_start = -1
-        static_section_end = -1
-        comment_section_start = -1
-        benchmark_section_start = -1
-        current_section = None
-
-        for i, line in enumerate(lines):
-            line_stripped = line.strip()
-
-            if line_stripped.startswith('static='):
-                if current_section != 'static':
-                    current_section = 'static'
-                    if static_section_start == -1:
-                        static_section_start = i
-                static_section_end = i
-            elif line_stripped.startswith('#'):
-                if current_section != 'comment':
-                    current_section = 'comment'
-                    if comment_section_start == -1:
-                        comment_section_start = i
-            elif line_stripped.startswith('url-latency-benchmark='):
-                if current_section != 'benchmark':
-                    current_section = 'benchmark'
-                    if benchmark_section_start == -1:
-                        benchmark_section_start = i
-            elif line_stripped and not line_stripped.startswith(('static=', '#', 'url-latency-benchmark=')):
-                if current_section != 'other':
-                    current_section = 'other'
-
-        self.logger.info(f"定位到：static部分 {static_section_start}到{static_section_end}行，注释从 {comment_section_start}行开始")
-
-        # 收集已有策略组名称用于去重
-        existing_policy_names = set()
-        for i in range(len(lines)):
-            if static_section_start <= i <= static_section_end:
-                line = lines[i].strip()
-                if line.startswith('static='):
-                    match = re.match(r'^static=([^,]+),', line)
-                    if match:
-                        existing_policy_names.add(match.group(1).strip())
-
-        # 添加个人策略组到static部分开始位置
-        new_static_policies = []
-        added_count = 0
+        index = PolicyIndex(policy_section)
+        self.logger.info(f"策略组索引建立完成，共 {len(index.groups)} 个策略组")
 
+        results = {"added": 0, "replaced": 0, "merged": 0, "skipped": 0}
+        labels = {"added": "添加", "replaced": "替换", "merged": "合并成员到", "skipped": "已存在，跳过"}
+        personal_groups = {}
         for policy in personal_policies:
-            if isinstance(policy, str):
-                policy_str = policy.strip()
-                # 提取策略组名称
-                match = re.match(r'^static=([^,]+),', policy_str)
-                if match:
-                    policy_name = match.group(1).strip()
-                    # 检查是否已存在
-                    if policy_name in existing_policy_names:
-                        self.logger.info(f"策略组已存在，跳过: {policy_name}")
-                        continue
-
-                    # 添加到新策略组列表
-                    new_static_policies.append(policy_str)
-                    existing_policy_names.add(policy_name)
-                    added_count += 1
-                    self.logger.info(f"添加策略组到static开始位置: {policy_name}")
-                else:
-                    self.logger.warning(f"策略组格式不正确（非static类型）: {policy_str[:50]}...")
-
-        if added_count == 0:
-            self.logger.info("没有新的策略组需要添加")
-            return policy_content
-
-        # 重新构建policy内容
-        new_lines = []
-
-        # 添加static部分开始之前的内容
-        if static_section_start > 0:
-            new_lines.extend(lines[:static_section_start])
-
-        # 添加新的个人策略组（在static部分的最开始）
-        for policy in new_static_policies:
-            new_lines.append(policy)
-
-        # 添加原有的static策略
-        if static_section_start != -1 and static_section_end != -1:
-            for i in range(static_section_start, static_section_end + 1):
-                new_lines.append(lines[i])
-
-        # 添加static部分之后的内容
-        if static_section_end + 1 < len(lines):
-            # 确保在新策略组后有一个空行
-            if new_lines and new_lines[-1].strip():
-                new_lines.append("")
-            new_lines.extend(lines[static_section_end + 1:])
+            if isinstance(policy, dict):
+                policy_str = str(policy.get("policy", "")).strip()
+                mode = str(policy.get("mode", "insert")).strip().lower()
+                position = str(policy.get("position", "")).strip()
+            elif isinstance(policy, str):
+                policy_str, mode, position = policy.strip(), "insert", ""
+            else:
+                self.logger.warning(f"无法识别的策略组配置: {policy}")
+                continue
 
-        self.logger.info(f"成功添加了 {added_count} 个策略组到static部分开始位置")
+            if mode not in ("insert", "replace", "merge"):
+                self.logger.warning(f"无法识别的策略组合并方式 {mode}，按insert处理: {policy_str[:50]}")
+                mode = "insert"
 
-        return '\n'.join(new_lines)
+            result, group = index.apply(policy_str, mode, position)
+            if result == "invalid":
+                self.logger.warning(f"策略组格式不正确: {policy_str[:50]}...")
+                continue
+            if result.startswith("error:"):
+                self.logger.warning(f"策略组 {group['name']} 未添加，{result[len('error:'):]}")
+                continue
 
-    def add_config_items(self, section_content: str, new_items: List, section_type: str) -> str:
+            results[result] += 1
+            if result != "skipped":
+                personal_groups[group["name"]] = group
+            self.log_item(f"策略组{labels[result]}: {group['type']}={group['name']}")
+
+        # 个人策略组中引用了未定义的策略组或节点时给出警告（订阅中的节点无法在此检查）
+        undefined_count = 0
+        for group in personal_groups.values():
+            undefined = index.undefined_members(group, known_nodes or set())
+            if undefined:
+                undefined_count += len(undefined)
+                self.logger.warning(f"策略组 {group['name']} 引用了未定义的策略或节点: {', '.join(undefined)}")
+
+        static_bounds = index.type_bounds.get("static")
+        static_inserted = bool(static_bounds and index.before.get(id(static_bounds[0])))
+        index.rebuild()
+
+        if static_inserted:
+            # 确保static部分之后有一个空行
+            static_lines = policy_section.key_lines("static")
+            after_static = policy_section.position(static_lines[-1]) + 1
+            if after_static < len(policy_section.lines) and policy_section.lines[after_static].kind != "blank":
+                policy_section.insert(after_static, [""])
+
+        self.metrics.count("policies_added", results["added"])
+        self.metrics.count("policies_replaced", results["replaced"])
+        self.metrics.count("policies_merged", results["merged"])
+        self.metrics.count("policies_skipped_duplicate", results["skipped"])
+        self.metrics.count("policies_undefined_references", undefined_count)
+        if results["skipped"]:
+            self.logger.info(f"跳过 {results['skipped']} 个已存在的策略组")
+        self.logger.info(f"策略组合并完成：新增 {results['added']} 个，替换 {results['replaced']} 个，"
+                         f"合并 {results['merged']} 个")
+
+    def add_config_items(self, section: ConfigSection, new_items: List, section_type: str):
         """向指定section添加配置项（通用方法）"""
         if not new_items:
             self.logger.info(f"{section_type} 没有新项需要添加")
-            return section_content
+            return
 
         self.logger.info(f"开始向 {section_type} 添加 {len(new_items)} 个配置项")
 
-        # 收集已存在的配置项（用于去重）
-        existing_items = set()
-        lines = section_content.split('\n')
-
-        for line in lines:
-            if line.strip() and not line.strip().startswith('#'):
-                existing_items.add(line.strip())
+        # 已存在的配置项（用于去重）
+        existing_items = section.item_set()
 
         # 添加新项（去重）
         added_count = 0
@@ -628,45 +3557,141 @@ class QuantumultXConfigGenerator:
             if isinstance(item, str):
                 item_str = item.strip()
                 if item_str and item_str not in existing_items:
-                    lines.append(item_str)
-                    existing_items.add(item_str)
+                    section.append(item_str)
                     added_count += 1
-                    self.logger.info(f"添加 {section_type} 配置项: {item_str[:100]}")
+                    self.log_item(f"添加 {section_type} 配置项: {item_str[:100]}")
 
+        self.metrics.count("items_added", added_count)
+        self.metrics.count("items_skipped_duplicate", len(new_items) - added_count)
         if added_count > 0:
-            self.logger.info(f"成功向 {section_type} 添加了 {added_count} 个新项")
+            self.logger.info(f"成功向 {section_type} 添加了 {added_count} 个新项"
+                             + (f"，{len(new_items) - added_count} 个已存在" if added_count < len(new_items) else ""))
         else:
             self.logger.info(f"{section_type} 所有配置项已存在，无需添加")
 
-        return '\n'.join(lines)
+    def optimize_filter_rules(self, section: ConfigSection):
+        """优化 filter_local 规则：去除重复和被覆盖的规则，合并相邻IP段"""
+        if not FILTER_OPTIMIZE or section.is_empty():
+            return
+
+        import gc
+        # 规则对象之间没有循环引用，批量构建期间暂停循环GC，避免反复扫描生成器中大量存活的对象
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with self.metrics.stage("generate.filter_optimize"):
+                rule_set = FilterRuleSet()
+                for line in section.lines:
+                    rule_set.add(line.text)
+                lines = rule_set.lines()
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        self.metrics.count("filter_duplicates_removed", rule_set.duplicate_count)
+        self.metrics.count("filter_shadowed_removed", rule_set.shadowed_count)
+        self.metrics.count("filter_ip_rules_merged", rule_set.merged_count)
+
+        if rule_set.duplicate_count or rule_set.shadowed_count or rule_set.merged_count:
+            section.replace_all(lines)
+            self.logger.info(f"filter_local 规则优化: 去除{rule_set.duplicate_count}条重复规则, "
+                             f"{rule_set.shadowed_count}条被覆盖规则, 合并{rule_set.merged_count}条IP规则")
+
+    def build_replacement_engine(self) -> ReplacementEngine:
+        """根据 QX_REPLACE_* 规则创建替换引擎"""
+        replacements = [
+            replacement for replacement in self.personal_config.get("global_replacements", [])
+            if isinstance(replacement, dict) and "search" in replacement and "replace" in replacement
+        ]
+        engine = ReplacementEngine(replacements)
+        for error in engine.errors:
+            self.logger.warning(error)
+        return engine
 
     def apply_global_replacements(self, config_content: str) -> str:
         """应用全局替换规则"""
-        replacements = self.personal_config.get("global_replacements", [])
+        engine = self.replacement_engine or self.build_replacement_engine()
 
-        if not replacements:
+        if not engine.rules:
             return config_content
 
-        result = config_content
-        for replacement in replacements:
-            if isinstance(replacement, dict) and "search" in replacement and "replace" in replacement:
-                search_pattern = replacement["search"]
-                replace_with = replacement["replace"]
-                count = result.count(search_pattern)
-                if count > 0:
-                    result = result.replace(search_pattern, replace_with)
-                    self.logger.info(f"全局替换: '{search_pattern}' -> '{replace_with}' (共{count}处)")
+        with self.metrics.stage("generate.replace"):
+            result = engine.apply(config_content)
+
+        # 规则计数包含此前各section范围内的替换
+        self.metrics.count("replacements_applied", sum(rule["count"] for rule in engine.rules))
+        for rule in engine.rules:
+            if rule["count"] > 0:
+                scope = f"[{rule['section']}] " if rule["section"] else ""
+                self.logger.info(f"{scope}全局替换: '{rule['search']}' -> '{rule['replace']}' (共{rule['count']}处)")
 
         return result
 
-    def generate_final_config(self, sections: Dict[str, str]) -> str:
+    def apply_section_replacements(self, content: str, section_name: str) -> str:
+        """应用只作用于指定section的替换规则"""
+        if self.replacement_engine is None or not self.replacement_engine.has_scope(section_name):
+            return content
+        return self.replacement_engine.apply(content, section_name)
+
+    def section_cache_key(self, sections: ConfigIndex, section_name: str) -> str:
+        """标准section合并结果的输入键：相关的远程section内容、个人配置、section替换规则和资源哈希"""
+        related = (section_name,) + self.SECTION_DEPENDENCIES.get(section_name, ())
+        # 相互依赖的section使用相同的输入（包括各自的section替换规则），输入变化时一起重新生成
+        replacements = [
+            replacement for replacement in self.personal_config.get("global_replacements", [])
+            if isinstance(replacement, dict) and replacement.get("section") in related
+        ]
+        key_parts = [
+            GENERATOR_VERSION,
+            FILTER_OPTIMIZE,
+            [sections.section_hash(name) for name in related],
+            [self.personal_config.get(self.SECTION_PERSONAL_KEYS.get(name, ""), []) for name in related],
+            replacements,
+        ]
+        if section_name in self.RESOURCE_SECTIONS and self.resource_hashes:
+            key_parts += [self.resource_mode, RESOURCE_MIRROR_URL, self.resource_hashes]
+        if section_name == "policy" and self.node_latency:
+            key_parts += [self.latency_probe, PROBE_GROUP_TYPES, PROBE_MAX_LATENCY_MS, self.node_buckets,
+                          self.pruned_over_latency()]
+        if section_name in ("server_local", "server_remote") and self.server_hashes:
+            # 预处理后的节点会写入 [server_local] 或改写 [server_remote] 的订阅地址
+            key_parts += [self.server_pipeline, RESOURCE_MIRROR_URL, self.server_hashes,
+                          sections.section_hash("server_remote"), self.personal_config.get("server_remote", []),
+                          self.personal_config.get("server_rules", {})]
+        return self.get_config_hash(json.dumps(key_parts, sort_keys=True, ensure_ascii=False))
+
+    def shared_merged_sections(self) -> Optional[Dict]:
+        """批量模式下共享同一远程配置的配置档案之间共用的合并结果：输入键 -> 内容"""
+        if self.remote_cache is None:
+            return None
+        entry = self.remote_cache.get(self.remote_url)
+        return entry.setdefault("merged", {}) if entry is not None else None
+
+    def load_merged_section(self, section_name: str, key: str) -> Optional[str]:
+        """查找输入键相同的合并结果，先查本配置档案的缓存，再查批量模式共享的结果"""
+        text = self.section_cache.get(section_name, key)
+        if text is None:
+            shared = self.shared_merged_sections()
+            if shared is not None:
+                text = shared.get(key)
+        return text
+
+    def store_merged_section(self, section_name: str, key: str, text: str):
+        self.section_cache.put(section_name, key, text)
+        shared = self.shared_merged_sections()
+        if shared is not None:
+            shared[key] = text
+
+    def generate_final_config(self, sections: Mapping) -> str:
         """生成最终配置文件"""
         config_parts = []
+        self.inline_filter_rules = []
+        self.replacement_engine = self.build_replacement_engine()
 
         # 添加生成信息
         config_parts.append(f"# QuantumultX 配置文件")
         config_parts.append(f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        config_parts.append(f"# 基于: {REMOTE_CONFIG_URL}")
+        config_parts.append(f"# 基于: {self.remote_url}")
         config_parts.append(f"# 配置来源: 青龙面板环境变量")
         if self.force_update:
             config_parts.append(f"# 生成模式: 强制更新")
@@ -690,45 +3715,83 @@ class QuantumultXConfigGenerator:
 
         self.logger.info(f"开始生成最终配置，标准section顺序: {standard_sections_order}")
 
-        # 处理标准section
+        # 处理标准section，在文档模型上原地合并个人配置
+        document = ConfigDocument(sections)
+        use_cache = self.section_cache is not None and isinstance(sections, ConfigIndex)
+        reused_sections = []
+
         for section_name in standard_sections_order:
+            # 输入未变化的section直接复用上次的合并结果
+            if use_cache:
+                cache_key = self.section_cache_key(sections, section_name)
+                cached_text = self.load_merged_section(section_name, cache_key)
+                if cached_text is not None and section_name == "filter_remote" and self.resource_mode == "inline" \
+                        and self.load_merged_section("filter_local",
+                                                     self.section_cache_key(sections, "filter_local")) is None:
+                    # inline模式下 filter_local 需要处理 filter_remote 时收集的内联规则，不能单独复用 filter_remote
+                    cached_text = None
+                if cached_text is not None:
+                    reused_sections.append(section_name)
+                    config_parts.append(f"[{section_name}]")
+                    if cached_text:
+                        config_parts.append(cached_text)
+                    config_parts.append("")
+                    continue
+
             self.logger.info(f"处理section: [{section_name}]")
 
-            # 获取原配置内容，如果没有则使用空字符串
-            content = sections.get(section_name, "")
+            # 获取原配置内容，如果没有则为空section
+            section = document.section(section_name)
 
             # 根据不同section类型添加个人配置
             if section_name == "mitm":
-                content = self.update_mitm_section(content)
+                self.update_mitm_section(section)
                 self.logger.info(f"更新MITM部分完成")
             elif section_name == "rewrite_remote":
                 personal_items = self.personal_config.get("rewrite_remote", [])
-                content = self.add_config_items(content, personal_items, "rewrite_remote")
+                self.add_config_items(section, personal_items, "rewrite_remote")
+                self.localize_remote_resources(section, "rewrite_remote")
             elif section_name == "rewrite_local":
                 personal_items = self.personal_config.get("rewrite_local", [])
-                content = self.add_config_items(content, personal_items, "rewrite_local")
+                self.add_config_items(section, personal_items, "rewrite_local")
+            elif section_name == "server_local":
+                self.insert_inline_server_nodes(section)
             elif section_name == "server_remote":
                 personal_items = self.personal_config.get("server_remote", [])
-                content = self.add_config_items(content, personal_items, "server_remote")
+                self.add_config_items(section, personal_items, "server_remote")
+                self.localize_server_subscriptions(section)
             elif section_name == "policy":
-                # 特殊处理policy部分，确保static策略添加到正确位置
-                content = self.add_personal_policies_smart(content)
+                # 特殊处理policy部分，通过策略组索引插入、替换或合并策略组
+                self.add_personal_policies_smart(section, self.server_tags(document.section("server_local")))
+                self.apply_latency_order(section)
             elif section_name == "dns":
                 personal_items = self.personal_config.get("dns", [])
-                content = self.add_config_items(content, personal_items, "dns")
+                self.add_config_items(section, personal_items, "dns")
             elif section_name == "filter_remote":
                 personal_items = self.personal_config.get("filter_remote", [])
-                content = self.add_config_items(content, personal_items, "filter_remote")
+                self.add_config_items(section, personal_items, "filter_remote")
+                self.localize_remote_resources(section, "filter_remote")
             elif section_name == "filter_local":
                 personal_items = self.personal_config.get("filter_local", [])
-                content = self.add_config_items(content, personal_items, "filter_local")
+                self.add_config_items(section, personal_items, "filter_local")
+                self.insert_inline_filter_rules(section)
+                self.optimize_filter_rules(section)
 
             # 添加section到配置
+            section_text = ""
+            if not section.is_empty():
+                section_text = self.apply_section_replacements(section.to_text(), section_name)
+            if use_cache:
+                self.store_merged_section(section_name, cache_key, section_text)
             config_parts.append(f"[{section_name}]")
-            if content.strip():
-                config_parts.append(content)
+            if section_text:
+                config_parts.append(section_text)
             config_parts.append("")  # section之间的空行
 
+        if reused_sections:
+            self.metrics.count("sections_reused", len(reused_sections))
+            self.logger.info(f"复用 {len(reused_sections)} 个未变化section的合并结果: {reused_sections}")
+
         # 添加自定义section（非标准section）
         all_sections = set(sections.keys())
         custom_sections = all_sections - set(standard_sections_order)
@@ -737,7 +3800,7 @@ class QuantumultXConfigGenerator:
             config_parts.append(f"[{section_name}]")
             content = sections[section_name]
             if content.strip():
-                config_parts.append(content)
+                config_parts.append(self.apply_section_replacements(content, section_name))
             config_parts.append("")
 
         # 添加完全自定义的section（从环境变量加载的）
@@ -746,9 +3809,9 @@ class QuantumultXConfigGenerator:
             if section_name not in all_sections:  # 避免重复
                 config_parts.append(f"[{section_name}]")
                 if isinstance(content, list):
-                    config_parts.append('\n'.join(content))
+                    config_parts.append(self.apply_section_replacements('\n'.join(content), section_name))
                 elif isinstance(content, str):
-                    config_parts.append(content)
+                    config_parts.append(self.apply_section_replacements(content, section_name))
                 config_parts.append("")
 
         # 生成完整配置
@@ -761,41 +3824,89 @@ class QuantumultXConfigGenerator:
 
         return full_config
 
-    def save_config(self, config_content: str) -> bool:
-        """保存配置文件，不进行备份"""
-        try:
-            # 确保目录存在
-            config_dir = os.path.dirname(LOCAL_CONFIG_PATH)
-            if config_dir and not os.path.exists(config_dir):
-                os.makedirs(config_dir, exist_ok=True)
+    def strip_generation_time(self, data: bytes) -> bytes:
+        """去掉文件头中的生成时间行，用于比较两次生成的内容是否相同"""
+        marker = "# 生成时间: ".encode('utf-8')
+        start = data.find(marker, 0, 512)
+        if start == -1:
+            return data
+        end = data.find(b'\n', start)
+        return data[:start] + (data[end + 1:] if end != -1 else b'')
+
+    def write_precompressed(self, data: bytes):
+        """写入预压缩副本，删除未启用格式的旧副本，避免静态服务器返回过期内容"""
+        for fmt, suffix in (("gzip", ".gz"), ("br", ".br")):
+            sibling = self.config_path + suffix
+            if fmt not in OUTPUT_COMPRESS:
+                if os.path.exists(sibling):
+                    os.remove(sibling)
+                continue
 
-            # 直接保存新配置（覆盖原有文件）
-            with open(LOCAL_CONFIG_PATH, 'w', encoding='utf-8') as f:
-                f.write(config_content)
+            if fmt == "gzip":
+                import gzip
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            else:
+                try:
+                    import brotli
+                except ImportError:
+                    self.logger.warning("未安装brotli模块，跳过生成.br压缩副本（pip3 install brotli）")
+                    continue
+                compressed = brotli.compress(data)
+
+            write_file_atomic(sibling, compressed)
+            self.logger.info(f"已生成压缩副本: {sibling} ({len(compressed)} 字节)")
+
+    def publish_config(self, data: Optional[bytes] = None):
+        """把配置发布到订阅服务器的内存中，未提供内容时读取现有文件"""
+        if self.config_store is None:
+            return
+        if data is None:
+            if not os.path.exists(self.config_path):
+                return
+            with open(self.config_path, 'rb') as f:
+                data = f.read()
+        self.config_store.publish(self.serve_key, data)
 
-            self.logger.info(f"配置文件已保存到: {LOCAL_CONFIG_PATH}")
+    def save_config(self, config_content: str) -> bool:
+        """保存配置文件（原子写入），除生成时间外内容未变化时不重写文件"""
+        self.config_unchanged = False
+        try:
+            data = config_content.encode('utf-8')
+
+            # 与现有文件比较（忽略生成时间），相同则保留原文件及其修改时间
+            if os.path.exists(self.config_path) and os.path.getsize(self.config_path) == len(data):
+                with open(self.config_path, 'rb') as f:
+                    existing = f.read()
+                if self.strip_generation_time(existing) == self.strip_generation_time(data):
+                    self.config_unchanged = True
+                    self.saved_config_hash = hashlib.md5(existing).hexdigest()
+                    self.logger.info(f"配置文件内容无变化，保留现有文件: {self.config_path}")
+                    suffixes = {"gzip": ".gz", "br": ".br"}
+                    if any(not os.path.exists(self.config_path + suffixes.get(fmt, ""))
+                           for fmt in OUTPUT_COMPRESS if fmt in suffixes):
+                        self.write_precompressed(existing)
+                    self.publish_config(existing)
+                    return True
+
+            write_file_atomic(self.config_path, data)
+            self.metrics.count("output_bytes_written", len(data))
+            self.saved_config_hash = hashlib.md5(data).hexdigest()
+            self.write_precompressed(data)
+            self.publish_config(data)
+
+            self.logger.info(f"配置文件已保存到: {self.config_path}")
             return True
 
         except Exception as e:
             self.logger.error(f"保存配置失败: {str(e)}")
             return False
 
-    def validate_mitm_section(self, config_content: str) -> bool:
+    def validate_mitm_section(self, config_content: str, config_index: Optional[ConfigIndex] = None) -> bool:
         """验证MITM部分的完整性"""
-        # 提取MITM部分
-        lines = config_content.split('\n')
-        in_mitm_section = False
-        mitm_lines = []
-
-        for line in lines:
-            if line.strip() == "[mitm]":
-                in_mitm_section = True
-                continue
-            elif in_mitm_section and line.strip().startswith("["):
-                break
-            elif in_mitm_section:
-                if line.strip():
-                    mitm_lines.append(line.strip())
+        # 提取MITM部分，优先复用已建立的索引
+        if config_index is None:
+            config_index = ConfigIndex(config_content)
+        mitm_lines = config_index.section_lines("mitm")
 
         # 检查passphrase和p12格式
         passphrase_found = False
@@ -827,21 +3938,77 @@ class QuantumultXConfigGenerator:
         self.logger.info("MITM证书格式正确")
         return True
 
+    def format_section_diff(self) -> str:
+        """section变化的简短描述，用于日志和通知"""
+        parts = [f"[{name}] {old}→{new}行" for name, (old, new) in self.section_diff.get("changed", {}).items()]
+        parts += [f"新增[{name}]" for name in self.section_diff.get("added", [])]
+        parts += [f"删除[{name}]" for name in self.section_diff.get("removed", [])]
+        return ", ".join(parts)
+
+    def save_run_report(self):
+        """保存本次运行的报告：远程配置备份旁的JSON文件，以及可选的 Prometheus textfile"""
+        if RUN_REPORT:
+            report = self.metrics.to_dict(
+                version=GENERATOR_VERSION,
+                profile=self.profile_name,
+                remote_url=self.remote_url,
+                config_path=self.config_path,
+                remote_hash=self.remote_hash,
+                section_diff=self.section_diff,
+            )
+            try:
+                write_file_atomic(self.remote_backup + ".report.json",
+                                  json.dumps(report, ensure_ascii=False, indent=2).encode('utf-8'))
+            except Exception as e:
+                self.logger.warning(f"保存运行报告失败: {str(e)}")
+
+        if METRICS_TEXTFILE_DIR:
+            name = re.sub(r'[^A-Za-z0-9_.-]', '_', self.profile_name or "default")
+            path = os.path.join(METRICS_TEXTFILE_DIR, f"qx_generator_{name}.prom")
+            try:
+                text = self.metrics.to_prometheus({"profile": self.profile_name or "default"})
+                write_file_atomic(path, text.encode('utf-8'))
+            except Exception as e:
+                self.logger.warning(f"保存Prometheus指标失败: {str(e)}")
+
     def run(self, force_update: bool = False) -> bool:
-        """运行配置生成器"""
+        """运行配置生成器，记录各阶段耗时和计数器并保存运行报告"""
+        self.metrics = RunMetrics()
+        if self.prefetch_metrics is not None:
+            self.metrics.merge(self.prefetch_metrics)
+            self.prefetch_metrics = None
+        success = False
+        try:
+            success = self.run_pipeline(force_update)
+            return success
+        finally:
+            if self.staged_backup is not None:
+                self.staged_backup.discard()
+                self.staged_backup = None
+            self.metrics.finish(self.metrics.result if success else "failed")
+            stages = ", ".join(f"{name} {stage['wall_ms']:.0f}ms" for name, stage in self.metrics.stages.items()
+                               if '.' not in name)
+            self.logger.info(f"本次运行耗时 {self.metrics.duration_ms:.0f}ms ({stages})")
+            self.save_run_report()
+
+    def run_pipeline(self, force_update: bool = False) -> bool:
+        """配置生成的各个步骤，结果类型记录在 self.metrics.result"""
         self.force_update = force_update
 
         self.logger.info("=" * 60)
         self.logger.info("QuantumultX 个性化配置生成器启动")
+        if self.profile_name:
+            self.logger.info(f"配置档案: {self.profile_name}")
         self.logger.info(f"时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        self.logger.info(f"远程配置URL: {REMOTE_CONFIG_URL}")
-        self.logger.info(f"本地配置文件: {LOCAL_CONFIG_PATH}")
-        self.logger.info(f"远程配置备份: {REMOTE_CONFIG_BACKUP}")
+        self.logger.info(f"远程配置URL: {self.remote_url}")
+        self.logger.info(f"本地配置文件: {self.config_path}")
+        self.logger.info(f"远程配置备份: {self.remote_backup}")
         self.logger.info(f"更新模式: {'强制更新' if force_update else '智能更新'}")
         self.logger.info("=" * 60)
 
         # 1. 加载个人配置
-        self.personal_config = self.load_personal_config_from_env()
+        with self.metrics.stage("load_personal_config"):
+            self.personal_config = self.load_personal_config_from_env()
 
         policies = self.personal_config.get("policies", [])
         mitm_config = self.personal_config.get("mitm", {})
@@ -849,49 +4016,142 @@ class QuantumultXConfigGenerator:
         self.logger.info(f"个人配置加载完成，策略组数量: {len(policies)}")
         self.logger.info(f"MITM配置: passphrase={mitm_config.get('passphrase', '')[:10]}..., p12长度={len(mitm_config.get('p12', ''))}")
 
+        # 快速路径：状态记录和最终配置都是最新的，一次条件请求确认远程配置未修改即可结束
+        if self.check_unchanged_fast():
+            self.metrics.result = "skipped"
+            return True
+
         # 2. 获取远程配置
-        remote_content = self.get_remote_config()
-        if not remote_content:
+        with self.metrics.stage("fetch"):
+            remote_content = self.fetch_remote_config()
+        if self.remote_not_modified:
+            # 服务器返回304，远程配置未修改，无需下载和比较
+            remote_updated = False
+            self.remote_hash = self.load_remote_config_hash() or ""
+        elif not remote_content:
             self.logger.error("获取远程配置失败，程序退出")
-            notification_msg = f"获取远程配置失败\nURL: {REMOTE_CONFIG_URL}"
+            notification_msg = f"获取远程配置失败\nURL: {self.remote_url}"
             self.send_notification(notification_msg, "error")
             return False
-
-        # 3. 检查远程配置是否有更新
-        remote_updated = self.check_if_remote_updated(remote_content)
+        else:
+            # 3. 检查远程配置是否有更新
+            with self.metrics.stage("check_update"):
+                remote_updated = self.check_if_remote_updated(remote_content)
 
         # 如果是强制更新模式，则忽略检查结果
         if self.force_update:
             remote_updated = True
             self.logger.info("强制更新模式，忽略检查结果")
 
-        if not remote_updated:
-            # 远程配置没有更新，不需要生成新配置，也不发送通知
-            self.logger.info("远程配置无更新，跳过配置生成")
-            return True
-
-        # 4. 保存新的远程配置备份
-        self.save_remote_config_backup(remote_content)
-
-        # 5. 解析配置sections（不包含header）
-        sections = self.parse_config_sections(remote_content)
-        self.logger.info(f"解析到 {len(sections)} 个配置section")
-
-        # 6. 生成最终配置
-        final_config = self.generate_final_config(sections)
+        backup_content = None
+        if self.resource_mode or self.server_pipeline or self.latency_probe:
+            # 资源缓存模式、节点订阅预处理和延迟探测：每次运行都验证引用资源并探测节点，
+            # 资源变化或节点排序变化也会触发重新生成
+            resource_source = remote_content
+            if not resource_source:
+                resource_source = backup_content = self.load_remote_config_cached()
+            if resource_source:
+                resource_sections = self.get_config_sections(resource_source)
+                if self.resource_mode or self.server_pipeline:
+                    with self.metrics.stage("refresh_resources"):
+                        self.refresh_remote_resources(resource_sections)
+                if self.latency_probe:
+                    with self.metrics.stage("probe_latency"):
+                        self.probe_node_latency(resource_sections)
+
+        input_fingerprint = self.get_input_fingerprint()
 
-        # 7. 验证配置
-        mitm_valid = self.validate_mitm_section(final_config)
+        if not remote_updated:
+            if remote_content:
+                # 更新状态记录中的缓存校验信息，使下次运行可以直接得到304
+                self.save_remote_config_meta(self.remote_hash, os.path.getsize(self.remote_backup))
+
+            if self.check_if_output_current(input_fingerprint):
+                # 输入指纹未变化且最终配置完好，不需要生成新配置，也不发送通知
+                self.logger.info("远程配置与个人配置均无更新，跳过配置生成")
+                self.metrics.result = "skipped"
+                return True
 
-        if not mitm_valid:
-            self.logger.error("MITM证书验证失败")
-            self.send_notification("MITM证书验证失败，请检查证书格式", "error")
-            return False
+            # 远程配置未变化但个人配置有变化，使用本地备份重新生成
+            if not remote_content:
+                remote_content = backup_content or self.load_remote_config_cached()
+                if not remote_content:
+                    self.logger.error("加载远程配置备份失败，程序退出")
+                    self.send_notification(f"加载远程配置备份失败\n路径: {self.remote_backup}", "error")
+                    return False
+        else:
+            # 4. 保存新的远程配置备份
+            with self.metrics.stage("save_backup"):
+                self.save_remote_config_backup(remote_content, self.remote_hash, staged=self.staged_backup)
+                self.staged_backup = None
+
+        # 相同的输入之前生成过时直接使用缓存的结果，跳过解析、合并和验证
+        cached = None
+        final_index = None
+        self.section_diff = {}
+        generation_key = self.generation_cache_key(input_fingerprint)
+        if self.generation_cache is not None:
+            with self.metrics.stage("generation_cache"):
+                cached = self.generation_cache.get(generation_key)
+            self.metrics.count("generation_cache_hits" if cached is not None else "generation_cache_misses")
+
+        if cached is not None:
+            self.logger.info("使用生成结果缓存中相同输入的配置，跳过解析和合并")
+            final_config, upstream = cached
+            final_config = self.refresh_generation_time(final_config)
+            if upstream is None and self.section_cache is not None:
+                # 缓存记录中没有远程section信息时只建立section偏移索引计算，不做合并
+                upstream = SectionCache.upstream_record(self.get_config_sections(remote_content))
+        else:
+            # 5. 解析配置sections（不包含header）
+            with self.metrics.stage("parse"):
+                sections = self.get_config_sections(remote_content)
+            self.logger.info(f"解析到 {len(sections)} 个配置section")
+            upstream = SectionCache.upstream_record(sections)
+
+        if self.section_cache is not None:
+            self.section_diff = self.section_cache.diff_upstream(upstream)
+            if any(self.section_diff.values()):
+                self.logger.info(f"远程配置section变化: {self.format_section_diff()}")
+
+        if cached is None:
+            # 6. 生成最终配置
+            with self.metrics.stage("generate"):
+                final_config = self.generate_final_config(sections)
+
+            # 7. 验证配置
+            with self.metrics.stage("validate"):
+                final_index = ConfigIndex(final_config)
+                mitm_valid = self.validate_mitm_section(final_config, final_index)
+
+            if not mitm_valid:
+                self.logger.error("MITM证书验证失败")
+                self.send_notification("MITM证书验证失败，请检查证书格式", "error")
+                return False
+
+            # 只缓存验证通过的结果
+            if self.generation_cache is not None:
+                self.generation_cache.put(generation_key, final_config, upstream)
 
         # 8. 保存配置
-        if self.save_config(final_config):
-            # 计算配置哈希值
-            final_hash = self.get_config_hash(final_config)
+        with self.metrics.stage("save"):
+            saved = self.save_config(final_config)
+            if saved:
+                # 记录磁盘上配置文件的哈希值和本次生成的输入指纹
+                self.save_output_meta(input_fingerprint, self.saved_config_hash)
+                if self.section_cache is not None:
+                    # 使用缓存结果时同样更新远程记录，下次比较的是本次实际使用的远程配置
+                    self.section_cache.record_upstream(upstream)
+                    self.section_cache.save()
+
+        if saved:
+            final_hash = self.saved_config_hash
+            if self.config_unchanged and not self.force_update:
+                # 生成的配置与现有文件相同，不需要通知设备重新导入
+                self.logger.info("生成的配置与现有文件相同，跳过通知")
+                self.metrics.result = "unchanged"
+                return True
+            self.metrics.result = "updated"
 
             # 输出统计信息
             original_size = len(remote_content)
@@ -928,22 +4188,15 @@ class QuantumultXConfigGenerator:
 
             # 特别显示策略组详情
             if policies:
-                self.logger.info("个人策略组详情:")
+                self.log_item("个人策略组详情:")
                 for i, policy in enumerate(policies, 1):
-                    self.logger.info(f"  {i}. {policy}")
+                    self.log_item(f"  {i}. {policy}")
 
             # 显示MITM证书格式
-            mitm_lines = []
-            lines = final_config.split('\n')
-            in_mitm = False
-            for line in lines:
-                if line.strip() == "[mitm]":
-                    in_mitm = True
-                elif in_mitm and line.strip().startswith("["):
-                    break
-                elif in_mitm:
-                    if line.strip().startswith("passphrase =") or line.strip().startswith("p12 ="):
-                        mitm_lines.append(line.strip())
+            if final_index is None:
+                final_index = ConfigIndex(final_config)
+            mitm_lines = [line for line in final_index.section_lines("mitm")
+                          if line.startswith("passphrase =") or line.startswith("p12 =")]
 
             if mitm_lines:
                 self.logger.info("MITM证书格式检查:")
@@ -965,6 +4218,8 @@ class QuantumultXConfigGenerator:
 变化: {final_size - original_size}字节
 策略组: {len(policies)}个
 MITM证书: {'已配置' if mitm_config.get('passphrase') and mitm_config.get('p12') else '未配置'}"""
+            if self.section_diff and any(self.section_diff.values()):
+                notification_msg += f"\n远程变化: {self.format_section_diff()}"
 
             if self.force_update:
                 self.send_notification(notification_msg, "force")
@@ -978,22 +4233,298 @@ MITM证书: {'已配置' if mitm_config.get('passphrase') and mitm_config.get('p
             return False
 
 
+def load_batch_manifest(manifest_path: str) -> List[Dict]:
+    """加载批量模式清单，返回规范化后的配置档案列表"""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if isinstance(manifest, dict):
+        manifest = manifest.get("profiles", [])
+    if not isinstance(manifest, list) or not manifest:
+        raise ValueError("清单中没有配置档案（profiles）")
+
+    profiles = []
+    seen_names = set()
+    seen_paths = set()
+    for index, item in enumerate(manifest, 1):
+        if not isinstance(item, dict) or not item.get("config_path"):
+            raise ValueError(f"第{index}个配置档案缺少 config_path")
+
+        config_path = item["config_path"]
+        name = item.get("name") or os.path.splitext(os.path.basename(config_path))[0]
+        if name in seen_names:
+            raise ValueError(f"配置档案名称重复: {name}")
+        if config_path in seen_paths:
+            raise ValueError(f"配置文件路径重复: {config_path}")
+        seen_names.add(name)
+        seen_paths.add(config_path)
+
+        env = item.get("env", {})
+        if not isinstance(env, dict):
+            raise ValueError(f"配置档案 {name} 的 env 必须是对象")
+
+        mirrors = item.get("mirrors")
+        if mirrors is not None and not isinstance(mirrors, list):
+            raise ValueError(f"配置档案 {name} 的 mirrors 必须是数组")
+
+        profiles.append({
+            "name": name,
+            "token": item.get("token") or name,
+            "remote_url": item.get("remote_url") or REMOTE_CONFIG_URL,
+            "config_path": config_path,
+            "remote_backup": item.get("remote_backup") or os.path.join(
+                os.path.dirname(config_path), f"qx_remote_backup_{name}.conf"),
+            "env": env,
+            "mirrors": mirrors,
+        })
+
+    return profiles
+
+
+def prefetch_remote_configs(fetchers: Dict[str, "QuantumultXConfigGenerator"], remote_cache: Dict):
+    """并发获取多个远程配置，获取到新内容时立即解析sections
+
+    下载在后台线程中进行，结果在当前线程中应用到生成器和 remote_cache。
+    整批超时后，仍在进行的下载被标记为放弃：本批次的令牌在写入任何状态之前检查，
+    迟到的结果只删除已写入的备份临时文件，不会与之后的 run() 竞争。
+    """
+    logger = next(iter(fetchers.values())).logger
+    logger.info(f"开始并发获取 {len(fetchers)} 个远程配置")
+
+    # 本批次的令牌：已放弃的URL，以及完成但尚未被当前线程取走的结果
+    token = {"lock": threading.Lock(), "abandoned": set(), "results": {}}
+
+    def discard_staged(fetched):
+        if fetched and fetched[1] and fetched[1].get("staged") is not None:
+            fetched[1]["staged"].discard()
+
+    def request(url: str, generator: "QuantumultXConfigGenerator"):
+        start = time.perf_counter()
+        fetched = generator.request_remote_config()
+        with token["lock"]:
+            if url in token["abandoned"]:
+                discard_staged(fetched)
+                return None
+            token["results"][url] = (fetched, (time.perf_counter() - start) * 1000)
+
+    tasks = {url: (lambda url=url, generator=generator: request(url, generator))
+             for url, generator in fetchers.items()}
+    for url, result in run_concurrent_fetches(tasks):
+        with token["lock"]:
+            completed = token["results"].pop(url, None)
+            if isinstance(result, Exception):
+                token["abandoned"].add(url)
+                # 超时的同时恰好完成的下载同样丢弃
+                discard_staged(completed and completed[0])
+                completed = None
+
+        if completed is None:
+            logger.error(f"获取远程配置失败: {url}: {str(result)}")
+            remote_cache[url] = {"content": None, "not_modified": False, "validators": {},
+                                 "backup": "", "hash": "", "sections": None}
+            continue
+
+        # 预先获取时记录的耗时和计数器在 run() 中并入运行报告
+        generator = fetchers[url]
+        fetched, wall_ms = completed
+        generator.metrics = RunMetrics()
+        generator.metrics.add_stage("prefetch", wall_ms)
+        generator.fetch_remote_config(fetched)
+        generator.prefetch_metrics = generator.metrics
+
+        entry = remote_cache.get(url)
+        if entry and entry["content"] and entry["sections"] is None:
+            entry["sections"] = generator.parse_config_sections(entry["content"])
+
+
+def create_batch_generators(manifest_path: str) -> List["QuantumultXConfigGenerator"]:
+    """按清单创建各配置档案的生成器，共享HTTP会话和远程资源缓存"""
+    profiles = load_batch_manifest(manifest_path)
+    session = create_http_session()
+
+    generators = [
+        QuantumultXConfigGenerator(
+            remote_url=profile["remote_url"],
+            config_path=profile["config_path"],
+            remote_backup=profile["remote_backup"],
+            env_overrides=profile["env"],
+            profile_name=profile["name"],
+            session=session,
+            mirrors=profile["mirrors"],
+        )
+        for profile in profiles
+    ]
+    for profile, generator in zip(profiles, generators):
+        generator.serve_key = profile["token"]
+    if generators[0].resource_mode or generators[0].server_pipeline:
+        # 所有配置档案共享同一个远程资源缓存，每个资源只验证一次
+        resource_cache = RemoteResourceCache(RESOURCE_CACHE_DIR, session, generators[0].logger)
+        for generator in generators:
+            generator.resource_cache = resource_cache
+
+    return generators
+
+
+def run_batch(manifest_path: str, force_update: bool = False,
+              generators: Optional[List["QuantumultXConfigGenerator"]] = None) -> Dict[str, bool]:
+    """批量模式：在同一进程中按清单生成多个配置文件，相同的远程配置只获取和解析一次"""
+    if generators is None:
+        generators = create_batch_generators(manifest_path)
+    remote_cache = {}
+    results = {}
+    if not generators:
+        return results
+    logger = generators[0].logger
+
+    # 并发获取所有不同的远程配置，由第一个使用该URL的配置档案发起请求
+    fetchers = {}
+    for generator in generators:
+        generator.remote_cache = remote_cache
+        generator.force_update = force_update
+        fetchers.setdefault(generator.remote_url, generator)
+
+    if len(fetchers) > 1:
+        prefetch_remote_configs(fetchers, remote_cache)
+
+    # 各配置档案的通知合并为一条，在后台发送
+    with generators[0].notifier.coalesce():
+        for generator in generators:
+            try:
+                results[generator.profile_name] = generator.run(force_update=force_update)
+            except Exception as e:
+                generator.logger.error(f"配置档案 {generator.profile_name} 生成失败: {str(e)}")
+                results[generator.profile_name] = False
+
+    success_count = sum(1 for ok in results.values() if ok)
+    logger.info(f"批量模式完成: {success_count}/{len(results)} 个配置档案成功, "
+                f"共获取 {len(remote_cache)} 个远程配置")
+    return results
+
+
+def run_daemon(batch_manifest: str = "", force_update: bool = False, serve_port: int = SERVE_PORT):
+    """守护模式：常驻进程内定时运行，保持HTTP连接和上次的解析结果
+
+    每次运行成功后等待 DAEMON_INTERVAL 秒，失败后从 DAEMON_RETRY 秒开始指数退避，
+    最长 DAEMON_MAX_BACKOFF 秒；等待时间加入 ±DAEMON_JITTER 比例的随机抖动，
+    避免多个实例同时请求远程服务器。收到 SIGTERM / SIGINT 后在本次运行结束时退出。
+    serve_port 不为0时同时启动订阅服务器，从内存中返回最新生成的配置。
+    """
+    import random
+    import signal
+
+    if batch_manifest:
+        generators = create_batch_generators(batch_manifest)
+    else:
+        generators = [QuantumultXConfigGenerator()]
+    logger = generators[0].logger
+    for generator in generators:
+        generator.long_running = True
+
+    server = None
+    if serve_port:
+        store = ConfigStore()
+        for generator in generators:
+            generator.config_store = store
+            generator.publish_config()
+        server = start_subscription_server(store, logger, SERVE_HOST, serve_port)
+
+    stop_event = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info(f"收到信号 {signum}，守护模式准备退出")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    logger.info(f"守护模式启动，运行间隔 {DAEMON_INTERVAL:.0f} 秒，配置档案 {len(generators)} 个")
+    failures = 0
+
+    while not stop_event.is_set():
+        # 每轮运行重新验证远程资源
+        for generator in generators:
+            if generator.resource_cache is not None:
+                generator.resource_cache.refreshed.clear()
+
+        try:
+            if batch_manifest:
+                success = all(run_batch(batch_manifest, force_update, generators).values())
+            else:
+                success = generators[0].run(force_update=force_update)
+        except Exception as e:
+            logger.error(f"守护模式运行出错: {str(e)}")
+            success = False
+        force_update = False
+
+        if success:
+            failures = 0
+            delay = DAEMON_INTERVAL
+        else:
+            failures += 1
+            delay = min(DAEMON_RETRY * 2 ** (failures - 1), DAEMON_MAX_BACKOFF)
+        delay = max(delay * (1 + random.uniform(-DAEMON_JITTER, DAEMON_JITTER)), 1)
+
+        logger.info(f"{'运行成功' if success else f'连续失败 {failures} 次'}，{delay:.0f} 秒后再次运行")
+        stop_event.wait(delay)
+
+    if server is not None:
+        server.shutdown()
+    logger.info("守护模式已退出")
+
+
 def main():
     """主函数"""
     # 解析命令行参数
     force_update = False
+    daemon_mode = False
+    serve_port = SERVE_PORT
+    batch_manifest = BATCH_MANIFEST
 
-    for arg in sys.argv[1:]:
+    args = sys.argv[1:]
+    for i, arg in enumerate(args):
         if arg == "--force":
             force_update = True
             print("强制更新模式已启用")
+        elif arg == "--daemon":
+            daemon_mode = True
+        elif arg == "--serve":
+            daemon_mode = True
+            serve_port = serve_port or 8080
+        elif arg == "--batch" and i + 1 < len(args):
+            batch_manifest = args[i + 1]
+        elif arg.startswith("--batch="):
+            batch_manifest = arg[len("--batch="):]
         elif arg in ["-h", "--help"]:
             # 简单帮助信息
             print("QuantumultX 配置生成器")
-            print("使用方法: python3 script.py [--force]")
-            print("  --force  强制更新配置（忽略检查结果）")
+            print("使用方法: python3 script.py [--force] [--batch 清单文件] [--daemon]")
+            print("  --force   强制更新配置（忽略检查结果）")
+            print("  --batch   批量模式，按清单文件生成多个配置")
+            print("  --daemon  守护模式，常驻进程定时检查更新")
+            print("  --serve   守护模式并启动订阅服务器（默认端口8080）")
             return
 
+    if daemon_mode:
+        try:
+            run_daemon(batch_manifest, force_update=force_update, serve_port=serve_port)
+        except Exception as e:
+            print(f"❌ 守护模式启动失败: {str(e)}")
+            sys.exit(1)
+        return
+
+    if batch_manifest:
+        # 批量模式
+        try:
+            results = run_batch(batch_manifest, force_update=force_update)
+        except Exception as e:
+            print(f"❌ 加载批量清单失败: {str(e)}")
+            sys.exit(1)
+
+        for name, ok in results.items():
+            print(f"{'✅' if ok else '❌'} {name}")
+        print(f"📝 日志文件: {LOG_FILE}")
+        sys.exit(0 if all(results.values()) else 1)
+
     # 运行配置生成器
     generator = QuantumultXConfigGenerator()
     success = generator.run(force_update=force_update)
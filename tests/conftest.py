@@ -0,0 +1,80 @@
+"""测试公共设置：导入生成器之前把所有路径指向临时目录，不读取当前环境中的个人配置"""
+
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+WORK_DIR = tempfile.mkdtemp(prefix="qx_tests_")
+for _key in [key for key in os.environ if key.startswith("QX_")]:
+    del os.environ[_key]
+os.environ.update({
+    "QX_CONFIG_PATH": os.path.join(WORK_DIR, "QuantumultX.conf"),
+    "QX_REMOTE_BACKUP": os.path.join(WORK_DIR, "qx_remote_backup.conf"),
+    "QX_LOG_FILE": os.path.join(WORK_DIR, "quantumultx_generator.log"),
+    "QX_RESOURCE_CACHE_DIR": os.path.join(WORK_DIR, "resources"),
+    "QX_GENERATION_CACHE_DIR": os.path.join(WORK_DIR, "generations"),
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import quantumultx_generator as qx  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """每个测试使用独立的配置、备份和缓存路径"""
+    monkeypatch.setattr(qx, "RESOURCE_CACHE_DIR", str(tmp_path / "resources"))
+    monkeypatch.setattr(qx, "GENERATION_CACHE_DIR", str(tmp_path / "generations"))
+    return tmp_path
+
+
+@pytest.fixture
+def generator(workdir):
+    return qx.QuantumultXConfigGenerator(config_path=str(workdir / "QuantumultX.conf"),
+                                         remote_backup=str(workdir / "qx_remote_backup.conf"))
+
+
+class RemoteConfigHandler(BaseHTTPRequestHandler):
+    """远程配置服务器：返回带ETag的配置，If-None-Match匹配时返回304，其他路径返回404"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.client_address[1], self.path, dict(self.headers)))
+        if self.path != "/config":
+            self.reply(404, b"not found")
+        elif self.headers.get("If-None-Match") == server.etag:
+            self.reply(304, b"")
+        else:
+            self.reply(200, server.body)
+
+    def reply(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header("ETag", self.server.etag)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def remote_server():
+    """本地HTTP服务器，记录每个请求的 (客户端端口, 路径, 请求头)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RemoteConfigHandler)
+    server.etag = '"v1"'
+    server.body = b"[general]\nnetwork_check_url=http://www.gstatic.com/generate_204\n"
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
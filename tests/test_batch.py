@@ -0,0 +1,22 @@
+"""批量模式：各配置档案共享远程配置，汇总日志覆盖所有配置档案"""
+
+import quantumultx_generator as qx
+
+
+def test_empty_generator_list():
+    assert qx.run_batch("", generators=[]) == {}
+
+
+def test_summary_counts_all_profiles(workdir, remote_server, caplog):
+    generators = [
+        qx.QuantumultXConfigGenerator(remote_url=f"{remote_server.url}/config",
+                                      config_path=str(workdir / f"{name}.conf"),
+                                      remote_backup=str(workdir / f"{name}_backup.conf"),
+                                      env_overrides={"QX_MITM_PASSPHRASE": "test",
+                                                     "QX_MITM_P12": "MIIKPAIBAzCCCgYGCSqGSIb3DQEHAaCCCfcEggnz"},
+                                      profile_name=name)
+        for name in ("a", "b")
+    ]
+    assert qx.run_batch("", generators=generators) == {"a": True, "b": True}
+    assert "批量模式完成: 2/2 个配置档案成功, 共获取 1 个远程配置" in caplog.text
+    assert len(remote_server.requests) == 1
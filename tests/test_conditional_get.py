@@ -0,0 +1,28 @@
+"""远程配置的条件请求：第一次得到200和ETag，之后带 If-None-Match 请求得到304"""
+
+
+def test_etag_then_not_modified(generator, remote_server):
+    generator.remote_url = f"{remote_server.url}/config"
+
+    content = generator.fetch_remote_config()
+    assert content == remote_server.body.decode("utf-8")
+    assert not generator.remote_not_modified
+    assert generator.remote_validators["etag"] == remote_server.etag
+    assert "If-None-Match" not in remote_server.requests[0][2]
+    generator.save_remote_config_backup(content, generator.remote_hash, staged=generator.staged_backup)
+
+    assert generator.fetch_remote_config() is None
+    assert generator.remote_not_modified
+    assert remote_server.requests[1][2].get("If-None-Match") == remote_server.etag
+
+
+def test_changed_etag_downloads_again(generator, remote_server):
+    generator.remote_url = f"{remote_server.url}/config"
+    content = generator.fetch_remote_config()
+    generator.save_remote_config_backup(content, generator.remote_hash, staged=generator.staged_backup)
+
+    remote_server.etag = '"v2"'
+    remote_server.body += b"\n[dns]\nserver=223.5.5.5\n"
+    assert generator.fetch_remote_config() == remote_server.body.decode("utf-8")
+    assert not generator.remote_not_modified
+    assert generator.remote_validators["etag"] == '"v2"'
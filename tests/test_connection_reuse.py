@@ -0,0 +1,28 @@
+"""流式响应在304和错误时读完正文后关闭，连接回到连接池复用"""
+
+import quantumultx_generator as qx
+
+
+def test_not_modified_reuses_connection(generator, remote_server):
+    generator.remote_url = f"{remote_server.url}/config"
+    with open(generator.remote_backup, "w", encoding="utf-8") as f:
+        f.write("[general]\n")
+    meta = {"url": generator.remote_url, "etag": remote_server.etag}
+
+    for _ in range(3):
+        assert generator.download_remote_config(meta)["not_modified"]
+
+    assert len(remote_server.requests) == 3
+    assert len({port for port, _, _ in remote_server.requests}) == 1
+
+
+def test_error_response_reuses_connection(remote_server):
+    session = qx.create_http_session()
+    for _ in range(2):
+        url, response, _, errors = qx.hedged_get(session, [(f"{remote_server.url}/missing", {})])
+        assert response is None and errors
+    url, response, _, _ = qx.hedged_get(session, [(f"{remote_server.url}/config", {})])
+    with response:
+        assert response.content == remote_server.body
+
+    assert len({port for port, _, _ in remote_server.requests}) == 1
@@ -0,0 +1,39 @@
+"""无需更新时的快速路径：冷启动的单次运行用一次条件请求结束，守护模式不使用"""
+
+import quantumultx_generator as qx
+
+MITM = {"QX_MITM_PASSPHRASE": "test", "QX_MITM_P12": "MIIKPAIBAzCCCgYGCSqGSIb3DQEHAaCCCfcEggnz"}
+
+
+def new_generator(workdir, remote_server):
+    generator = qx.QuantumultXConfigGenerator(config_path=str(workdir / "QuantumultX.conf"),
+                                              remote_backup=str(workdir / "qx_remote_backup.conf"))
+    generator.remote_url = f"{remote_server.url}/config"
+    generator.env_overrides = dict(MITM)
+    return generator
+
+
+def test_cold_start_uses_fast_path(workdir, remote_server):
+    assert new_generator(workdir, remote_server).run()
+
+    generator = new_generator(workdir, remote_server)
+    assert generator.run()
+    assert generator.metrics.counters.get("remote_not_modified") == 1
+    assert generator._session is None
+    assert remote_server.requests[-1][2].get("If-None-Match") == remote_server.etag
+
+
+def test_long_running_uses_shared_session(workdir, remote_server):
+    assert new_generator(workdir, remote_server).run()
+    del remote_server.requests[:]
+
+    generator = new_generator(workdir, remote_server)
+    generator.long_running = True
+    for _ in range(3):
+        generator.metrics = qx.RunMetrics()
+        assert generator.run()
+        assert generator.metrics.counters.get("remote_not_modified") == 1
+
+    # 每轮都通过共享会话发出请求，复用同一个连接
+    assert len(remote_server.requests) == 3
+    assert len({port for port, _, _ in remote_server.requests}) == 1
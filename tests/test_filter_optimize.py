@@ -0,0 +1,47 @@
+"""filter_local 规则优化：默认关闭，开关计入输入指纹"""
+
+import quantumultx_generator as qx
+
+
+def test_disabled_by_default():
+    assert qx.FILTER_OPTIMIZE is False
+
+
+def test_toggle_changes_fingerprint(generator, monkeypatch):
+    generator.personal_config = generator.load_personal_config_from_env()
+    generator.remote_hash = "remote"
+
+    monkeypatch.setattr(qx, "FILTER_OPTIMIZE", True)
+    optimized = generator.get_input_fingerprint()
+    monkeypatch.setattr(qx, "FILTER_OPTIMIZE", False)
+    assert generator.get_input_fingerprint() != optimized
+
+
+def test_optimize_section(generator, monkeypatch):
+    monkeypatch.setattr(qx, "FILTER_OPTIMIZE", True)
+    section = qx.ConfigSection("filter_local", "\n".join([
+        "host-suffix, example.com, proxy",
+        "host, www.example.com, direct",
+        "HOST-SUFFIX, Example.com., reject",
+        "host-keyword, ads, reject",
+        "host, cdn.ads.net, proxy",
+        "ip-cidr, 10.0.0.0/25, direct, no-resolve",
+        "ip-cidr, 10.0.0.128/25, direct, no-resolve",
+        "ip-cidr, 10.0.0.5/32, proxy, no-resolve",
+        "final, proxy",
+    ]))
+    generator.optimize_filter_rules(section)
+    assert section.to_text().splitlines() == [
+        "host-suffix, example.com, proxy",
+        "host-keyword, ads, reject",
+        "ip-cidr, 10.0.0.0/24, direct, no-resolve",
+        "final, proxy",
+    ]
+
+
+def test_disabled_keeps_section(generator, monkeypatch):
+    monkeypatch.setattr(qx, "FILTER_OPTIMIZE", False)
+    text = "host-suffix, example.com, proxy\nhost, www.example.com, direct"
+    section = qx.ConfigSection("filter_local", text)
+    generator.optimize_filter_rules(section)
+    assert section.to_text() == text
@@ -0,0 +1,147 @@
+"""节点延迟探测：排序、prune模式剔除不可达节点、TTL缓存、总时限和延迟区间的滞后
+
+连接延迟由替换的 asyncio.open_connection 按端口固定增加，不依赖内核的连接重传时间。
+"""
+
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+import quantumultx_generator as qx
+
+POLICY = ("static=Select, Slow, Dead, Fast, direct\n"
+          "url-latency-benchmark=Auto, Slow, Dead, Fast, direct, check-interval=600")
+
+
+@pytest.fixture
+def endpoints(monkeypatch):
+    """本地回环地址上的探测目标 (地址, 端口)：fast 立即建立连接，slow 延迟0.2秒，blackhole 永远不完成，
+    dead 为已关闭的端口"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def handle(reader, writer):
+        writer.close()
+
+    server = asyncio.run_coroutine_threadsafe(asyncio.start_server(handle, "127.0.0.1", 0), loop).result()
+    port = server.sockets[0].getsockname()[1]
+    with socket.socket() as closed:
+        closed.bind(("127.0.0.1", 0))
+        dead_port = closed.getsockname()[1]
+    # slow 和 blackhole 使用不同的回环地址区分，等待后连接到同一个监听端口
+    targets = {"fast": ("127.0.0.1", port), "slow": ("127.0.0.2", port),
+               "blackhole": ("127.0.0.3", port), "dead": ("127.0.0.1", dead_port)}
+    delays = {"127.0.0.2": 0.2, "127.0.0.3": 3600}
+
+    open_connection = asyncio.open_connection
+
+    async def delayed_open_connection(host, target_port, **kwargs):
+        if host in delays:
+            await asyncio.sleep(delays[host])
+            host = "127.0.0.1"
+        return await open_connection(host, target_port, **kwargs)
+
+    monkeypatch.setattr(asyncio, "open_connection", delayed_open_connection)
+    yield targets
+
+    asyncio.run_coroutine_threadsafe(_close(server), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+async def _close(server):
+    server.close()
+    await server.wait_closed()
+
+
+def server_local(endpoints) -> str:
+    return "\n".join(f"shadowsocks={endpoints[name][0]}:{endpoints[name][1]}, method=aes-128-gcm, password=x, tag={name.title()}"
+                     for name in ("slow", "dead", "fast"))
+
+
+def probe(generator, endpoints, mode="prune"):
+    generator.latency_probe = mode
+    generator.probe_node_latency({"server_local": server_local(endpoints)})
+    section = qx.ConfigSection("policy", POLICY)
+    generator.apply_latency_order(section)
+    return section.to_text().split("\n")
+
+
+def test_sort_and_prune(generator, endpoints):
+    static, auto = probe(generator, endpoints)
+
+    latency = generator.node_latency
+    assert latency["Dead"] is None
+    assert latency["Slow"] >= 200 > latency["Fast"]
+    assert generator.node_buckets == {"Fast": 0, "Slow": 1, "Dead": None}
+    assert auto == POLICY.split("\n")[1].replace("Auto, Slow, Dead, Fast", "Auto, Fast, Slow")
+    # 不在 QX_PROBE_GROUPS 中的策略组不变
+    assert static == POLICY.split("\n")[0]
+
+
+def test_sort_keeps_unreachable_last(generator, endpoints):
+    assert probe(generator, endpoints, "sort")[1].startswith("url-latency-benchmark=Auto, Fast, Slow, Dead, direct")
+
+
+def test_cached_results_within_ttl(generator, endpoints, workdir):
+    probe(generator, endpoints)
+
+    cached = qx.QuantumultXConfigGenerator(config_path=str(workdir / "QuantumultX.conf"),
+                                           remote_backup=str(workdir / "qx_remote_backup.conf"))
+    probe(cached, endpoints)
+    assert cached.metrics.counters.get("nodes_probed", 0) == 0
+    assert cached.metrics.counters.get("nodes_probe_cached") == 3
+    assert cached.node_latency == generator.node_latency
+
+
+def test_expired_results_are_probed_again(generator, endpoints, workdir):
+    cache_file = str(workdir / "latency.json")
+    qx.LatencyProber(cache_file, generator.logger).probe([endpoints["fast"]])
+
+    expired = qx.LatencyProber(cache_file, generator.logger, ttl=0)
+    expired.probe([endpoints["fast"]])
+    assert expired.probed_count == 1
+
+
+def test_total_timeout_returns_finished_results(generator, endpoints, workdir):
+    prober = qx.LatencyProber(str(workdir / "latency.json"), generator.logger, timeout=5, total_timeout=0.3)
+    blackhole, fast = endpoints["blackhole"], endpoints["fast"]
+
+    start = time.perf_counter()
+    results = prober.probe([blackhole, fast])
+    assert time.perf_counter() - start < 1.5
+    assert fast in results and blackhole not in results
+    # 结果未知的节点不写入缓存
+    assert qx.LatencyProber.cache_key(blackhole) not in prober.cache
+
+
+def test_bucket_hysteresis(generator, monkeypatch):
+    monkeypatch.setattr(qx, "PROBE_BUCKET_MS", 200)
+    monkeypatch.setattr(qx, "PROBE_HYSTERESIS", 0.5)
+    previous = {"A": 0, "B": 1, "C": 1, "D": 2}
+    generator.node_latency = {"A": 260.0, "B": 140.0, "C": 90.0, "D": None}
+
+    # 超出原区间不到半个区间宽度时保持原区间，超出更多或可达性变化时使用新区间
+    assert generator.latency_buckets(previous) == {"A": 0, "B": 1, "C": 0, "D": None}
+    assert generator.latency_buckets() == {"A": 1, "B": 0, "C": 0, "D": None}
+
+
+def test_small_latency_change_keeps_fingerprint(generator):
+    generator.latency_probe = "sort"
+    generator.node_latency = {"A": 190.0, "B": 420.0}
+    generator.node_buckets = generator.latency_buckets()
+    fingerprint = generator.get_input_fingerprint()
+    previous = dict(generator.node_buckets)
+
+    generator.node_latency = {"A": 215.0, "B": 380.0}
+    generator.node_buckets = generator.latency_buckets(previous)
+    assert generator.get_input_fingerprint() == fingerprint
+
+    generator.node_latency = {"A": 520.0, "B": 380.0}
+    generator.node_buckets = generator.latency_buckets(previous)
+    assert generator.get_input_fingerprint() != fingerprint
@@ -0,0 +1,59 @@
+"""section级合并结果缓存：inline模式下 filter_remote 与 filter_local 必须一起复用"""
+
+import quantumultx_generator as qx
+
+REMOTE = """[general]
+network_check_url=http://www.gstatic.com/generate_204
+
+[filter_remote]
+https://example.com/ads.list, tag=Ads, force-policy=reject, enabled=true
+
+[filter_local]
+host-suffix, local.example.com, direct
+final, proxy
+"""
+
+
+class RuleCache:
+    """按内容哈希返回规则列表，代替 RemoteResourceCache"""
+
+    def read_text(self, content_hash: str) -> str:
+        return "host-suffix, ads.example.com\nhost-keyword, tracker\n"
+
+    def mirror_url(self, content_hash: str) -> str:
+        return f"http://mirror.local/objects/{content_hash}.txt"
+
+
+def generate(generator, replacements) -> str:
+    generator.personal_config = generator.load_personal_config_from_env()
+    generator.personal_config["global_replacements"] = replacements
+    return generator.generate_final_config(qx.ConfigIndex(REMOTE))
+
+
+def test_inline_rules_survive_filter_local_change(generator):
+    generator.resource_mode = "inline"
+    generator.resource_cache = RuleCache()
+    generator.resource_hashes = {"https://example.com/ads.list": "hash"}
+
+    first = generate(generator, [])
+    assert "host-suffix, ads.example.com, reject" in first
+
+    # 只作用于 filter_local 的替换规则变化后，filter_local 重新生成，仍然要包含内联的远程规则
+    second = generate(generator, [{"search": "local.example.com", "replace": "home.example.com",
+                                   "section": "filter_local"}])
+    assert "host-suffix, home.example.com, direct" in second
+    assert "host-suffix, ads.example.com, reject" in second
+    assert "host-keyword, tracker, reject" in second
+    assert "https://example.com/ads.list" not in second
+
+
+def test_unchanged_inputs_reuse_both_sections(generator):
+    generator.resource_mode = "inline"
+    generator.resource_cache = RuleCache()
+    generator.resource_hashes = {"https://example.com/ads.list": "hash"}
+
+    first = generate(generator, [])
+    generator.metrics = qx.RunMetrics()
+    second = generate(generator, [])
+    assert generator.metrics.counters.get("sections_reused") == 12
+    assert second.split("\n", 2)[2] == first.split("\n", 2)[2]
@@ -0,0 +1,67 @@
+"""server_remote 节点订阅预处理：没有可输出节点的订阅必须保持原样"""
+
+import base64
+
+import quantumultx_generator as qx
+
+SUB_URL = "https://example.com/sub"
+SUB_ENTRY = f"{SUB_URL}, tag=Sub, update-interval=86400, enabled=true"
+
+
+class TextCache:
+    """按内容哈希返回订阅内容，代替 RemoteResourceCache"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def read_text(self, content_hash: str) -> str:
+        return self.text
+
+
+def prepare(generator, mode: str, text: str):
+    generator.server_pipeline = mode
+    generator.server_hashes = {SUB_URL: "hash"}
+    generator.server_results = None
+    generator.resource_cache = TextCache(text)
+
+
+def localize(generator, server_local: str = "") -> tuple:
+    remote = qx.ConfigSection("server_remote", SUB_ENTRY)
+    local = qx.ConfigSection("server_local", server_local)
+    generator.insert_inline_server_nodes(local)
+    generator.localize_server_subscriptions(remote)
+    return remote.to_text(), local.to_text()
+
+
+def test_unsupported_subscription_is_kept_inline(generator, caplog):
+    # 需要 opt-parser 才能识别的 base64 ss:// 列表
+    text = base64.b64encode(b"ss://YWVzLTEyOC1nY206cGFzcw@1.2.3.4:8388#Node\n").decode()
+    prepare(generator, "inline", text)
+
+    assert localize(generator, "shadowsocks=5.6.7.8:443, method=aes-128-gcm, password=x, tag=Local") == \
+        (SUB_ENTRY, "shadowsocks=5.6.7.8:443, method=aes-128-gcm, password=x, tag=Local")
+    assert "保留原订阅" in caplog.text
+
+
+def test_unsupported_subscription_is_kept_mirror(generator, monkeypatch):
+    monkeypatch.setattr(qx, "RESOURCE_MIRROR_URL", "http://mirror.local")
+    prepare(generator, "mirror", "ss://YWVzLTEyOC1nY206cGFzcw@1.2.3.4:8388#Node")
+
+    assert localize(generator)[0] == SUB_ENTRY
+
+
+def test_fully_filtered_subscription_is_kept(generator):
+    generator.personal_config = {"server_rules": {"filter": "^HK"}}
+    prepare(generator, "inline", "shadowsocks=1.2.3.4:8388, method=aes-128-gcm, password=x, tag=US 1")
+
+    assert localize(generator) == (SUB_ENTRY, "")
+
+
+def test_supported_subscription_is_inlined(generator):
+    prepare(generator, "inline", "shadowsocks=1.2.3.4:8388, method=aes-128-gcm, password=x, tag=HK 1\n"
+                                 "trojan=example.org:443, password=y, tag=HK 2")
+
+    remote, local = localize(generator)
+    assert remote == ""
+    assert local.splitlines() == ["shadowsocks=1.2.3.4:8388, method=aes-128-gcm, password=x, tag=HK 1",
+                                  "trojan=example.org:443, password=y, tag=HK 2"]